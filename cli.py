@@ -1,29 +1,101 @@
+import functools
 import click
+from src.config import SYNC_BATCH_SIZE, SYNC_WORKERS, SYNC_PROCESSES
 from src.sync.init_db import run_init
 from src.sync.full_load import run_full_load
 from src.sync.incremental import run_incremental
 from src.sync.validate import run_validate
+from src.sync.stream import run_stream
+from src.sync.queries import run_named_query
+from src.sync.export import run_export
+from src.bench.runner import run_benchmark
+from src.sync.profiling import profile_run
+
+def profiled(command):
+    # --profile [DIR]: run under cProfile with per-statement SQL timings.
+    @click.option('--profile', 'profile_dir', is_flag=False, flag_value='profile', default=None,
+                  help='Profile the run and write the reports to DIR (default: profile/)')
+    @functools.wraps(command)
+    def run(*args, profile_dir=None, **kwargs):
+        if profile_dir is None:
+            return command(*args, **kwargs)
+        with profile_run(command.__name__, profile_dir):
+            return command(*args, **kwargs)
+    return run
 
 @click.group()
 def cli():
     pass
 
 @cli.command()
+@profiled
 def init():
     run_init()
 
 @cli.command()
-def full_load():
-    run_full_load()
+@click.option('--batch-size', default=SYNC_BATCH_SIZE, help='Rows per extract/insert batch')
+@click.option('--workers', default=SYNC_WORKERS, help='Tables extracted in parallel')
+@click.option('--resume/--restart', default=True, help='Continue an interrupted load from its checkpoints, or start over')
+@click.option('--processes', default=SYNC_PROCESSES, help='Processes transforming fact batches (0 = in-process)')
+@profiled
+def full_load(batch_size, workers, resume, processes):
+    run_full_load(batch_size, workers, resume, processes)
+
+@cli.command()
+@click.option('--batch-size', default=SYNC_BATCH_SIZE, help='Rows per UPSERT batch')
+@click.option('--workers', default=SYNC_WORKERS, help='Tables extracted in parallel')
+@click.option('--processes', default=SYNC_PROCESSES, help='Processes transforming fact batches (0 = in-process)')
+@profiled
+def incremental(batch_size, workers, processes):
+    run_incremental(batch_size, workers, processes)
+
+@cli.command()
+@click.option('--days', default=30, help='Number of days to reconcile row by row (0 = all rows)')
+@click.option('--report', default=None, help='Write a JSON report with per-check latency to this file')
+@profiled
+def validate(days, report):
+    run_validate(days, report)
+
+@cli.command()
+@click.option('--events', default=None, help='Replay row events from this JSONL file instead of the MySQL binlog')
+@click.option('--follow', is_flag=True, help='Keep waiting for new events instead of stopping at the end of the stream')
+@click.option('--batch-size', default=SYNC_BATCH_SIZE, help='Events applied per micro-batch')
+@click.option('--flush-interval', default=1.0, help='Seconds before a partial micro-batch is applied')
+@profiled
+def stream(events, follow, batch_size, flush_interval):
+    run_stream(events, batch_size, follow, flush_interval)
+
+@cli.command()
+@click.argument('name', required=False)
+@click.option('--param', '-p', 'params', multiple=True, help='Query parameter as NAME=VALUE (repeatable)')
+@click.option('--json', 'as_json', is_flag=True, help='Print the rows as JSON')
+@click.option('--no-cache', is_flag=True, help='Run the query even if a result for the current data is cached')
+@profiled
+def query(name, params, as_json, no_cache):
+    # Without a name, lists the available queries.
+    try:
+        run_named_query(name, params, as_json, not no_cache)
+    except ValueError as e:
+        raise click.UsageError(str(e))
 
 @cli.command()
-def incremental():
-    run_incremental()
+@click.option('--dir', 'out_dir', default='export', help='Directory the Parquet files are written to')
+@click.option('--full', is_flag=True, help='Rewrite every partition, not only those changed since the last export')
+@profiled
+def export(out_dir, full):
+    run_export(out_dir, full)
 
 @cli.command()
-@click.option('--days', default=30, help='Number of days to validate')
-def validate(days):
-    run_validate(days)
+@click.option('--scale', 'scales', multiple=True, type=float, default=[1], help='Scale factor of the synthetic source (repeatable)')
+@click.option('--change-ratio', default=0.01, help='Share of source rows changed and added before the incremental step')
+@click.option('--workers', default=SYNC_WORKERS, help='Workers for full-load and incremental')
+@click.option('--batch-size', default=SYNC_BATCH_SIZE, help='Batch size for full-load and incremental')
+@click.option('--dir', 'bench_dir', default='bench', help='Directory for generated sources, warehouses and results')
+@click.option('--tolerance', default=0.2, help='Slowdown against the previous run reported as a regression')
+@profiled
+def bench(scales, change_ratio, workers, batch_size, bench_dir, tolerance):
+    if run_benchmark(scales, change_ratio, workers, batch_size, bench_dir, tolerance=tolerance):
+        raise SystemExit(1)
 
 if __name__ == '__main__':
     cli()
\ No newline at end of file
@@ -0,0 +1,161 @@
+import random
+from datetime import datetime, timedelta
+from decimal import Decimal
+from sqlalchemy import create_engine, insert, select, update, func
+from src.models.sakila import (SakilaBase, Language, Country, City, Address, Store, Staff, Film, Actor, Category,
+                               FilmActor, FilmCategory, Customer, Inventory, Rental, Payment)
+from src.sync.bulk import batched
+
+# Row counts of the real Sakila database at scale factor 1. The catalog
+# (films, actors, inventory, ...) is fixed; customers, their addresses,
+# rentals and payments grow with the scale factor.
+BASE_ROWS = {
+    'language': 6, 'country': 109, 'city': 600, 'store': 2, 'film': 1000, 'actor': 200, 'category': 16,
+    'film_actor': 5462, 'inventory': 4581, 'address': 603, 'customer': 599, 'rental': 16044,
+}
+SCALED = ('address', 'customer', 'rental')
+
+FIRST_RENTAL = datetime(2005, 5, 24, 22, 53, 30)
+RENTAL_PERIOD = timedelta(days=266)
+LAST_UPDATE = datetime(2006, 2, 15, 4, 57, 12)
+RATINGS = ['G', 'PG', 'PG-13', 'R', 'NC-17']
+
+def row_counts(scale):
+    return {table: max(1, int(rows * scale)) if table in SCALED else rows for table, rows in BASE_ROWS.items()}
+
+def _name(rng, length=8):
+    return ''.join(rng.choice('ABCDEFGHIJKLMNOPQRSTUVWXYZ') for _ in range(length))
+
+def _rentals(rng, counts):
+    step = RENTAL_PERIOD / counts['rental']
+    for rental_id in range(1, counts['rental'] + 1):
+        rented = FIRST_RENTAL + step * rental_id
+        returned = rented + timedelta(days=rng.randint(1, 9), minutes=rng.randint(0, 1439))
+        yield {
+            'rental_id': rental_id,
+            'rental_date': rented.replace(microsecond=0),
+            'inventory_id': rng.randint(1, counts['inventory']),
+            'customer_id': rng.randint(1, counts['customer']),
+            # About 1% of rentals are still out, as in Sakila.
+            'return_date': returned.replace(microsecond=0) if rng.random() > 0.01 else None,
+            'staff_id': rng.randint(1, 2),
+            'last_update': LAST_UPDATE,
+        }
+
+def _payments(rng, rentals):
+    for rental in rentals:
+        yield {
+            'payment_id': rental['rental_id'],
+            'customer_id': rental['customer_id'],
+            'staff_id': rental['staff_id'],
+            # A few payments are not tied to a rental.
+            'rental_id': rental['rental_id'] if rng.random() > 0.003 else None,
+            'amount': Decimal(rng.choice([99, 199, 299, 399, 499, 599, 699, 799, 899, 999, 1099])) / 100,
+            'payment_date': rental['rental_date'],
+            'last_update': LAST_UPDATE,
+        }
+
+def generate(url, scale=1, seed=1, batch_size=10000):
+    # Build a Sakila-shaped source at `url` with scale factor `scale`; the same
+    # seed and scale always produce the same data.
+    engine = create_engine(url)
+    SakilaBase.metadata.drop_all(engine)
+    SakilaBase.metadata.create_all(engine)
+    rng = random.Random(seed)
+    counts = row_counts(scale)
+    lu = LAST_UPDATE
+
+    with engine.begin() as conn:
+        conn.execute(insert(Language), [
+            {'language_id': i, 'name': name, 'last_update': lu}
+            for i, name in enumerate(['English', 'Italian', 'Japanese', 'Mandarin', 'French', 'German'], 1)
+        ])
+        conn.execute(insert(Country), [
+            {'country_id': i, 'country': _name(rng), 'last_update': lu} for i in range(1, counts['country'] + 1)
+        ])
+        conn.execute(insert(City), [
+            {'city_id': i, 'city': _name(rng), 'country_id': rng.randint(1, counts['country']), 'last_update': lu}
+            for i in range(1, counts['city'] + 1)
+        ])
+        for batch in batched(({'address_id': i, 'city_id': rng.randint(1, counts['city']), 'last_update': lu}
+                              for i in range(1, counts['address'] + 1)), batch_size):
+            conn.execute(insert(Address), batch)
+        conn.execute(insert(Store), [{'store_id': i, 'address_id': i, 'last_update': lu} for i in (1, 2)])
+        conn.execute(insert(Staff), [{'staff_id': i, 'store_id': i, 'last_update': lu} for i in (1, 2)])
+        conn.execute(insert(Film), [
+            {'film_id': i, 'title': f"{_name(rng)} {_name(rng)}", 'rating': rng.choice(RATINGS),
+             'length': rng.randint(46, 185), 'language_id': 1, 'release_year': '2006', 'last_update': lu}
+            for i in range(1, counts['film'] + 1)
+        ])
+        conn.execute(insert(Actor), [
+            {'actor_id': i, 'first_name': _name(rng, 6), 'last_name': _name(rng), 'last_update': lu}
+            for i in range(1, counts['actor'] + 1)
+        ])
+        conn.execute(insert(Category), [
+            {'category_id': i, 'name': _name(rng, 10), 'last_update': lu} for i in range(1, counts['category'] + 1)
+        ])
+        film_actors = set()
+        while len(film_actors) < counts['film_actor']:
+            film_actors.add((rng.randint(1, counts['actor']), rng.randint(1, counts['film'])))
+        conn.execute(insert(FilmActor), [
+            {'actor_id': actor_id, 'film_id': film_id, 'last_update': lu} for actor_id, film_id in sorted(film_actors)
+        ])
+        conn.execute(insert(FilmCategory), [
+            {'film_id': i, 'category_id': rng.randint(1, counts['category']), 'last_update': lu}
+            for i in range(1, counts['film'] + 1)
+        ])
+        for batch in batched(({'customer_id': i, 'first_name': _name(rng, 6), 'last_name': _name(rng),
+                               'active': int(rng.random() > 0.03), 'address_id': rng.randint(3, counts['address']),
+                               'last_update': lu} for i in range(1, counts['customer'] + 1)), batch_size):
+            conn.execute(insert(Customer), batch)
+        conn.execute(insert(Inventory), [
+            {'inventory_id': i, 'film_id': rng.randint(1, counts['film']), 'store_id': rng.randint(1, 2),
+             'last_update': lu} for i in range(1, counts['inventory'] + 1)
+        ])
+        for batch in batched(_rentals(rng, counts), batch_size):
+            conn.execute(insert(Rental), batch)
+            conn.execute(insert(Payment), list(_payments(rng, batch)))
+    return engine
+
+def apply_changes(url, ratio, seed=2, batch_size=10000):
+    # Simulate source activity between two syncs: touch `ratio` of the films,
+    # customers, rentals and payments and append `ratio` new rentals (with
+    # payments). Returns the number of rows changed or added per table.
+    engine = create_engine(url)
+    rng = random.Random(seed)
+    now = datetime.now().replace(microsecond=0)
+    changed = {}
+
+    with engine.begin() as conn:
+        counts = {model: conn.execute(select(func.max(key))).scalar() or 0 for model, key in [
+            (Film, Film.film_id), (Customer, Customer.customer_id), (Rental, Rental.rental_id),
+            (Payment, Payment.payment_id), (Inventory, Inventory.inventory_id)
+        ]}
+        touch = {
+            Film: (Film.film_id, {'length': Film.length + 1}),
+            Customer: (Customer.customer_id, {'active': 1 - Customer.active}),
+            Rental: (Rental.rental_id, {'staff_id': 3 - Rental.staff_id}),
+            Payment: (Payment.payment_id, {'amount': Payment.amount + Decimal('0.01')}),
+        }
+        for model, (key, values) in touch.items():
+            ids = rng.sample(range(1, counts[model] + 1), int(counts[model] * ratio))
+            for batch in batched(ids, batch_size):
+                conn.execute(update(model).where(key.in_(batch)).values(last_update=now, **values))
+            changed[model.__tablename__] = len(ids)
+
+        new = int(counts[Rental] * ratio)
+        rentals = [{
+            'rental_id': counts[Rental] + i, 'rental_date': now - timedelta(hours=i % 48),
+            'inventory_id': rng.randint(1, counts[Inventory]), 'customer_id': rng.randint(1, counts[Customer]),
+            'return_date': None, 'staff_id': rng.randint(1, 2), 'last_update': now,
+        } for i in range(1, new + 1)]
+        for batch in batched(rentals, batch_size):
+            conn.execute(insert(Rental), batch)
+            conn.execute(insert(Payment), [
+                dict(payment, payment_id=counts[Payment] + rental['rental_id'] - counts[Rental], last_update=now)
+                for rental, payment in zip(batch, _payments(rng, batch))
+            ])
+        changed['rental'] += new
+        changed['payment'] += new
+    engine.dispose()
+    return changed
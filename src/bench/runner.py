@@ -0,0 +1,136 @@
+import json
+import os
+import shutil
+import subprocess
+import sys
+import time
+from datetime import datetime
+from src.bench.generate import generate, apply_changes, row_counts
+
+CLI = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'cli.py')
+STEPS = ['init', 'full-load', 'incremental', 'validate']
+# Slowdowns smaller than this are treated as noise.
+NOISE_S = 0.05
+
+def _source(bench_dir, scale):
+    path = os.path.join(bench_dir, f"sakila-x{scale:g}.db")
+    return path, f"sqlite:///{os.path.abspath(path)}"
+
+def _run(step, env, workers, batch_size):
+    args = [sys.executable, CLI, step]
+    if step in ('full-load', 'incremental'):
+        args += ['--workers', str(workers), '--batch-size', str(batch_size)]
+        if step == 'full-load':
+            args.append('--restart')
+    elif step == 'validate':
+        args += ['--days', '0']
+    start = time.perf_counter()
+    completed = subprocess.run(args, env=env, capture_output=True, text=True)
+    wall_s = round(time.perf_counter() - start, 3)
+    if completed.returncode != 0:
+        raise RuntimeError(f"{step} exited with {completed.returncode}: {completed.stderr.strip()}")
+    return wall_s, completed.stdout
+
+def run_scale(bench_dir, scale, change_ratio, workers, batch_size):
+    source_path, source_url = _source(bench_dir, scale)
+    if not os.path.exists(source_path):
+        print(f"Generating Sakila source at {scale:g}x...")
+        generate(source_url, scale).dispose()
+    warehouse = os.path.join(bench_dir, f"analytics-x{scale:g}.db")
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(warehouse + suffix):
+            os.remove(warehouse + suffix)
+    metrics_dir = os.path.join(bench_dir, f"metrics-x{scale:g}")
+    # Every run works on a pristine copy of the generated source, so changes
+    # applied for the incremental step never accumulate between runs.
+    working = source_path + '.run'
+    shutil.copyfile(source_path, working)
+    env = dict(os.environ, SOURCE_URL=f"sqlite:///{os.path.abspath(working)}", SQLITE_PATH=warehouse,
+               SYNC_METRICS_DIR=metrics_dir)
+
+    steps = {}
+    changes = None
+    try:
+        for step in STEPS:
+            if step == 'incremental':
+                changes = apply_changes(env['SOURCE_URL'], change_ratio)
+            wall_s, output = _run(step, env, workers, batch_size)
+            report_file = os.path.join(metrics_dir, f"{step.replace('-', '_')}.json")
+            stages = {}
+            peak = None
+            if os.path.exists(report_file):
+                with open(report_file) as f:
+                    report = json.load(f)
+                peak = report.get('peak_rss_mb')
+                stages = {s['name']: {'wall_s': s['wall_s'], 'rows_per_sec': s['rows_per_sec']} for s in report['stages']}
+                if report['status'] != 'ok':
+                    raise RuntimeError(f"{step} finished with status {report['status']}:\n{output}")
+            steps[step] = {'wall_s': wall_s, 'peak_rss_mb': peak, 'stages': stages}
+            print(f"  {step}: {wall_s:.2f}s")
+    finally:
+        os.remove(working)
+
+    return {
+        'scale': scale,
+        'rows': row_counts(scale),
+        'change_ratio': change_ratio,
+        'changes': changes,
+        'workers': workers,
+        'batch_size': batch_size,
+        'steps': steps,
+    }
+
+def _previous(history, result):
+    same = ('scale', 'change_ratio', 'workers', 'batch_size')
+    for run in reversed(history):
+        for earlier in run['results']:
+            if all(earlier[k] == result[k] for k in same):
+                return earlier
+    return None
+
+def regressions(history, results, tolerance):
+    found = []
+    for result in results:
+        earlier = _previous(history, result)
+        if earlier is None:
+            continue
+        for step, timing in result['steps'].items():
+            before = earlier['steps'].get(step)
+            if before is None:
+                continue
+            slower = timing['wall_s'] - before['wall_s']
+            if slower > NOISE_S and timing['wall_s'] > before['wall_s'] * (1 + tolerance):
+                found.append({'scale': result['scale'], 'step': step, 'before_s': before['wall_s'],
+                              'after_s': timing['wall_s'], 'change': round(slower / before['wall_s'], 3)})
+    return found
+
+def run_benchmark(scales=(1,), change_ratio=0.01, workers=1, batch_size=5000, bench_dir='bench',
+                  results_file=None, tolerance=0.2):
+    # Time init/full-load/incremental/validate against a synthetic source per
+    # scale factor, append the timings to the results history and compare
+    # them with the previous run of the same configuration.
+    os.makedirs(bench_dir, exist_ok=True)
+    results_file = results_file or os.path.join(bench_dir, 'results.json')
+    history = []
+    if os.path.exists(results_file):
+        with open(results_file) as f:
+            history = json.load(f)
+
+    results = []
+    for scale in scales:
+        print(f"Benchmarking {scale:g}x ({row_counts(scale)['rental']} rentals)...")
+        results.append(run_scale(bench_dir, scale, change_ratio, workers, batch_size))
+
+    found = regressions(history, results, tolerance)
+    history.append({'timestamp': datetime.now().isoformat(timespec='seconds'), 'results': results,
+                    'regressions': found})
+    with open(results_file, 'w') as f:
+        json.dump(history, f, indent=2)
+    print(f"Results written to {results_file}")
+
+    for r in found:
+        print(f"REGRESSION: {r['step']} at {r['scale']:g}x took {r['after_s']:.2f}s "
+              f"(was {r['before_s']:.2f}s, +{r['change'] * 100:.0f}%)")
+    if not found:
+        print("No regressions against the previous run.")
+    return found
@@ -1,6 +1,6 @@
 import os
 from dotenv import load_dotenv
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from sqlalchemy.orm import sessionmaker
 
 load_dotenv()
@@ -16,12 +16,55 @@ MYSQL_DB = os.getenv("MYSQL_DB", "sakila")
 SQLITE_PATH = os.getenv("SQLITE_PATH", "analytics.db")
 MYSQL_URL = f"mysql+pymysql://{MYSQL_USER}:{MYSQL_PASSWORD}@{MYSQL_HOST}:{MYSQL_PORT}/{MYSQL_DB}"
 SQLITE_URL = f"sqlite:///{SQLITE_PATH}"
+# Source database; any URL with the Sakila schema, e.g. a synthetic SQLite
+# file from `cli.py bench`, can stand in for MySQL.
+SOURCE_URL = os.getenv("SOURCE_URL", MYSQL_URL)
+
+# Sync
+SYNC_BATCH_SIZE = int(os.getenv("SYNC_BATCH_SIZE", "5000"))
+SYNC_WORKERS = int(os.getenv("SYNC_WORKERS", "1"))
+# Processes transforming fact batches during full-load (0 = transform in-process).
+SYNC_PROCESSES = int(os.getenv("SYNC_PROCESSES", "0"))
+# Query results kept by the `query` command's LRU cache (in memory and on disk).
+QUERY_CACHE_SIZE = int(os.getenv("QUERY_CACHE_SIZE", "128"))
+# Directory for run reports and Prometheus textfile-collector files (unset: not written).
+SYNC_METRICS_DIR = os.getenv("SYNC_METRICS_DIR", "")
+
+# SQLite pragmas, applied to every new connection. page_size only takes effect
+# on a new database, so it is set before journal_mode.
+SQLITE_PRAGMAS = {
+    "page_size": int(os.getenv("SQLITE_PAGE_SIZE", "4096")),
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "cache_size": -64000,
+    "mmap_size": 268435456,
+    "temp_store": "MEMORY",
+}
+# Bulk-load profile used during full-load: no fsync per commit and a larger page cache.
+SQLITE_LOAD_PRAGMAS = dict(SQLITE_PRAGMAS, synchronous="OFF", cache_size=-262144)
 
 def get_mysql_engine():
-    return create_engine(MYSQL_URL)
+    # Parallel stages and range workers each hold their own connection.
+    return create_engine(SOURCE_URL, max_overflow=-1)
+
+def use_sqlite_profile(engine, pragmas):
+    def apply(dbapi_conn, connection_record):
+        cursor = dbapi_conn.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+        cursor.close()
+
+    previous = getattr(engine, "sqlite_profile", None)
+    if previous is not None and event.contains(engine, "connect", previous):
+        event.remove(engine, "connect", previous)
+    event.listen(engine, "connect", apply)
+    engine.sqlite_profile = apply
+    # Pooled connections were opened with the previous pragmas.
+    engine.dispose()
+    return engine
 
 def get_sqlite_engine():
-    return create_engine(SQLITE_URL)
+    return use_sqlite_profile(create_engine(SQLITE_URL), SQLITE_PRAGMAS)
 
 def get_mysql_session():
     engine = get_mysql_engine()
@@ -91,10 +91,42 @@ class FactPayment(AnalyticsBase):
     staff_id = Column(Integer)
     amount = Column(DECIMAL(5, 2))
 
+# Summary tables kept in step with the facts; amounts are in cents so that
+# additive updates stay exact.
+class AggDailyStoreRevenue(AnalyticsBase):
+    __tablename__ = 'agg_daily_store_revenue'
+    date_key = Column(Integer, primary_key=True)
+    store_key = Column(Integer, primary_key=True)
+    payments = Column(Integer)
+    revenue_cents = Column(Integer)
+
+class AggFilmRentalsMonthly(AnalyticsBase):
+    __tablename__ = 'agg_film_rentals_monthly'
+    month_key = Column(Integer, primary_key=True)
+    film_key = Column(Integer, primary_key=True)
+    rentals = Column(Integer)
+
+class AggCustomerLtv(AnalyticsBase):
+    __tablename__ = 'agg_customer_ltv'
+    customer_key = Column(Integer, primary_key=True)
+    payments = Column(Integer)
+    revenue_cents = Column(Integer)
+
 class SyncState(AnalyticsBase):
     __tablename__ = 'sync_state'
     table_name = Column(String, primary_key=True)
     last_updated = Column(DateTime)
+    last_id = Column(Integer)
+    # Replication position of the stream command (binlog file:offset, or event file offset).
+    position = Column(String)
+
+class LoadCheckpoint(AnalyticsBase):
+    __tablename__ = 'load_checkpoint'
+    table_name = Column(String, primary_key=True)
+    range_start = Column(Integer, primary_key=True)
+    range_end = Column(Integer)
+    rows_loaded = Column(Integer)
+    completed_at = Column(DateTime)
 
 Index('idx_fact_rental_date', FactRental.date_key_rented)
 Index('idx_fact_rental_customer', FactRental.customer_key)
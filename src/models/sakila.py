@@ -108,4 +108,5 @@ class Payment(SakilaBase):
     staff_id = Column(Integer, ForeignKey('staff.staff_id'))
     rental_id = Column(Integer, ForeignKey('rental.rental_id'))
     amount = Column(DECIMAL(5, 2))
-    payment_date = Column(DateTime)
\ No newline at end of file
+    payment_date = Column(DateTime)
+    last_update = Column(DateTime)
\ No newline at end of file
@@ -0,0 +1,115 @@
+from collections import namedtuple
+from datetime import datetime
+from functools import partial
+from sqlalchemy import select, delete, insert, func, tuple_
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from src.models.analytics import AggDailyStoreRevenue, AggFilmRentalsMonthly, AggCustomerLtv, FactRental, FactPayment, SyncState
+from src.sync.bulk import NATURAL_KEYS, upsert
+from src.sync.columnar import ColumnBatch
+from src.sync.partitions import tracked
+from src.sync.reconcile import cents
+
+# Summary table over one fact: group columns (name -> fact expression) and
+# additive measures (name -> aggregate), the first of which counts fact rows.
+# Facts missing a group key are left out, as they would be by a join.
+Aggregate = namedtuple('Aggregate', ['model', 'fact', 'groups', 'measures'])
+
+AGGREGATES = [
+    Aggregate(AggDailyStoreRevenue, FactPayment,
+              {'date_key': FactPayment.date_key_paid, 'store_key': FactPayment.store_key},
+              {'payments': func.count(), 'revenue_cents': func.sum(cents(FactPayment.amount))}),
+    Aggregate(AggFilmRentalsMonthly, FactRental,
+              {'month_key': FactRental.date_key_rented // 100, 'film_key': FactRental.film_key},
+              {'rentals': func.count()}),
+    Aggregate(AggCustomerLtv, FactPayment,
+              {'customer_key': FactPayment.customer_key},
+              {'payments': func.count(), 'revenue_cents': func.sum(cents(FactPayment.amount))}),
+]
+# sync_state row present while the aggregates match the facts; a full load
+# clears it until it rebuilds them.
+BUILT = 'aggregates'
+
+def _query(aggregate):
+    groups = [expr.label(name) for name, expr in aggregate.groups.items()]
+    measures = [expr.label(name) for name, expr in aggregate.measures.items()]
+    return (select(*groups, *measures)
+            .where(*[expr.isnot(None) for expr in aggregate.groups.values()])
+            .group_by(*aggregate.groups.values()))
+
+def rebuild(sqlite_conn):
+    for aggregate in AGGREGATES:
+        sqlite_conn.execute(delete(aggregate.model))
+        sqlite_conn.execute(insert(aggregate.model).from_select(
+            [*aggregate.groups, *aggregate.measures], _query(aggregate)
+        ))
+    upsert(sqlite_conn, SyncState, [[{'table_name': BUILT, 'last_updated': datetime.now()}]])
+
+def invalidate(sqlite_conn):
+    sqlite_conn.execute(delete(SyncState).where(SyncState.table_name == BUILT))
+
+def ensure(sqlite_conn):
+    # Aggregates are built from scratch once (e.g. on a warehouse loaded
+    # before they existed); after that they are only maintained.
+    if sqlite_conn.execute(select(SyncState.table_name).where(SyncState.table_name == BUILT)).first() is None:
+        rebuild(sqlite_conn)
+        return True
+    return False
+
+def contributions(sqlite_conn, aggregate, ids):
+    # Measures the facts with these natural ids add to each group.
+    key = getattr(aggregate.fact, NATURAL_KEYS[aggregate.fact][0])
+    width = len(aggregate.groups)
+    return {tuple(row[:width]): tuple(value or 0 for value in row[width:])
+            for row in sqlite_conn.execute(_query(aggregate).where(key.in_(ids)))}
+
+def apply_deltas(sqlite_conn, aggregate, deltas):
+    # Additive upsert of measure deltas per group; groups left without facts are dropped.
+    rows = [{**dict(zip(aggregate.groups, group)), **dict(zip(aggregate.measures, delta))}
+            for group, delta in deltas.items() if any(delta)]
+    if not rows:
+        return 0
+    model = aggregate.model
+    stmt = sqlite_insert(model.__table__)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=list(aggregate.groups),
+        set_={name: getattr(model, name) + stmt.excluded[name] for name in aggregate.measures}
+    )
+    sqlite_conn.execute(stmt, rows)
+    groups = tuple_(*[getattr(model, name) for name in aggregate.groups])
+    count = getattr(model, next(iter(aggregate.measures)))
+    sqlite_conn.execute(delete(model).where(groups.in_([tuple(row[name] for name in aggregate.groups) for row in rows]),
+                                            count <= 0))
+    return len(rows)
+
+def natural_ids(fact, rows):
+    name = NATURAL_KEYS[fact][0]
+    if isinstance(rows, ColumnBatch):
+        return list(rows.columns[name])
+    return [row[name] for row in rows]
+
+def maintained(sqlite_conn, fact, ids, write):
+    # Runs write(), which changes the facts with these natural ids, and applies
+    # its effect to the aggregates: the rows' contributions after the write
+    # minus those before it, so updated and deleted facts are netted out. The
+    # export partitions the facts were in are marked as changed too.
+    write = partial(tracked, sqlite_conn, fact, ids, write)
+    aggregates = [aggregate for aggregate in AGGREGATES if aggregate.fact is fact]
+    if not aggregates or not ids:
+        return write()
+    before = [contributions(sqlite_conn, aggregate, ids) for aggregate in aggregates]
+    result = write()
+    for aggregate, old in zip(aggregates, before):
+        new = contributions(sqlite_conn, aggregate, ids)
+        zero = (0,) * len(aggregate.measures)
+        apply_deltas(sqlite_conn, aggregate, {
+            group: tuple(n - o for n, o in zip(new.get(group, zero), old.get(group, zero)))
+            for group in new.keys() | old.keys()
+        })
+    return result
+
+def forget(sqlite_conn, column, surrogate):
+    # Facts whose key column is cleared leave every group on those keys.
+    for aggregate in AGGREGATES:
+        for name, expr in aggregate.groups.items():
+            if expr is column:
+                sqlite_conn.execute(delete(aggregate.model).where(getattr(aggregate.model, name).in_(surrogate)))
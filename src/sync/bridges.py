@@ -0,0 +1,71 @@
+from sqlalchemy import select, delete, bindparam, func
+from src.models.sakila import FilmActor, FilmCategory
+from src.models.analytics import BridgeFilmActor, BridgeFilmCategory, DimFilm
+from src.sync.bulk import insert_ignore
+from src.sync.keycache import DIMENSIONS
+from src.sync.state import changed_since
+
+# Bridge tables are synced film by film: the source links of every film with
+# a changed link are compared with the warehouse links of that film and the
+# difference is inserted or deleted. A recast replaces or removes other links
+# of the same film, which a watermark over the link rows alone would miss.
+BRIDGES = {
+    'bridge_film_actor': (BridgeFilmActor, BridgeFilmActor.actor_key, FilmActor, FilmActor.actor_id, 'film_actor',
+                          'dim_actor'),
+    'bridge_film_category': (BridgeFilmCategory, BridgeFilmCategory.category_key, FilmCategory, FilmCategory.category_id,
+                             'film_category', 'dim_category'),
+}
+
+def changed_films(mysql_conn, name, mark):
+    # Films with a link after the watermark. Links at or before it existed
+    # when the watermark was read and were diffed by that run.
+    source, table_name = BRIDGES[name][2], BRIDGES[name][4]
+    return mysql_conn.execute(
+        select(source.film_id).distinct().where(changed_since(table_name, mark)).order_by(source.film_id)
+    ).scalars().all()
+
+def _link_digests(conn, query):
+    return {film_id: (int(count), int(total), int(squares)) for film_id, count, total, squares in conn.execute(query)}
+
+def drifted_films(mysql_conn, sqlite_conn, name):
+    # Films whose links differ between source and warehouse, by per-film
+    # digests (count, sum and sum of squares of the linked ids). A deleted
+    # link leaves no newer last_update behind, so only this finds it.
+    model, other_key, source, other_id, _, dimension = BRIDGES[name]
+    dim_id, dim_key = DIMENSIONS[dimension]
+
+    def digest(film_id, linked_id):
+        return select(film_id, func.count(), func.sum(linked_id), func.sum(linked_id * linked_id)).group_by(film_id)
+
+    expected = _link_digests(mysql_conn, digest(source.film_id, other_id))
+    actual = _link_digests(sqlite_conn, digest(DimFilm.film_id, dim_id)
+                           .select_from(model)
+                           .join(DimFilm, model.film_key == DimFilm.film_key)
+                           .join(dim_id.class_, other_key == dim_key))
+    return sorted(film_id for film_id in expected.keys() | actual.keys() if expected.get(film_id) != actual.get(film_id))
+
+def diff_links(mysql_conn, sqlite_conn, name, film_ids, film_map, other_map):
+    model, other_key, source, other_id = BRIDGES[name][:4]
+    wanted = set()
+    for film_id, linked_id in mysql_conn.execute(select(source.film_id, other_id).where(source.film_id.in_(film_ids))):
+        film_key = film_map.get(film_id)
+        linked_key = other_map.get(linked_id)
+        if film_key and linked_key:
+            wanted.add((film_key, linked_key))
+    film_keys = [key for key in map(film_map.get, film_ids) if key]
+    present = set(map(tuple, sqlite_conn.execute(
+        select(model.film_key, other_key).where(model.film_key.in_(film_keys))
+    )))
+    return sorted(wanted - present), sorted(present - wanted)
+
+def apply_links(sqlite_conn, name, added, removed):
+    model, other_key = BRIDGES[name][:2]
+    inserted = 0
+    if added:
+        inserted = insert_ignore(sqlite_conn, model, [[{'film_key': f, other_key.key: o} for f, o in added]])
+    if removed:
+        sqlite_conn.execute(
+            delete(model).where(model.film_key == bindparam('f'), other_key == bindparam('o')),
+            [{'f': f, 'o': o} for f, o in removed]
+        )
+    return inserted, len(removed)
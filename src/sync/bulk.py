@@ -0,0 +1,103 @@
+import sqlite3
+from sqlalchemy import select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from src.config import SYNC_BATCH_SIZE
+from src.models.analytics import AnalyticsBase, DimFilm, DimActor, DimCategory, DimStore, DimCustomer, BridgeFilmActor, BridgeFilmCategory, FactRental, FactPayment, SyncState, LoadCheckpoint
+from src.sync.columnar import ColumnBatch
+
+# Natural key of every warehouse table, used as the ON CONFLICT target.
+NATURAL_KEYS = {
+    DimFilm: ['film_id'],
+    DimActor: ['actor_id'],
+    DimCategory: ['category_id'],
+    DimStore: ['store_id'],
+    DimCustomer: ['customer_id'],
+    BridgeFilmActor: ['film_key', 'actor_key'],
+    BridgeFilmCategory: ['film_key', 'category_key'],
+    FactRental: ['rental_id'],
+    FactPayment: ['payment_id'],
+    SyncState: ['table_name'],
+    LoadCheckpoint: ['table_name', 'range_start'],
+}
+# INSERT ... RETURNING needs SQLite 3.35; older libraries read the keys back.
+RETURNING = sqlite3.sqlite_version_info >= (3, 35)
+# Ids per read-back query, under the 999 bound variables of old SQLite builds.
+READBACK_IDS = 500
+
+def batched(rows, size=SYNC_BATCH_SIZE):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def _write_columns(conn, stmt, batch):
+    # Bind column batches straight to the driver, skipping per-row parameter
+    # processing; fact columns are plain ints and floats by this point.
+    compiled = stmt.compile(dialect=conn.dialect, column_keys=list(batch.columns))
+    params = list(zip(*(batch.columns[name] for name in compiled.positiontup)))
+    return conn.exec_driver_sql(compiled.string, params).rowcount
+
+def _write(conn, stmt, batch, keys):
+    if isinstance(batch, ColumnBatch):
+        if keys is None:
+            return _write_columns(conn, stmt, batch)
+        batch = list(batch)
+    if keys is None:
+        return conn.execute(stmt, batch).rowcount
+    if not RETURNING:
+        written = conn.execute(stmt, batch).rowcount
+        id_column, key_column = keys.columns
+        for ids in batched([row[id_column.key] for row in batch], READBACK_IDS):
+            keys.update(conn.execute(select(id_column, key_column).where(id_column.in_(ids))))
+        return written
+    # RETURNING hands back the surrogate keys of written rows, so the key map
+    # is updated without reading the dimension back.
+    written = conn.execute(stmt.returning(*keys.columns), batch).all()
+    keys.update(written)
+    return len(written)
+
+def _names(batch):
+    return batch.columns if isinstance(batch, ColumnBatch) else batch[0]
+
+def insert_ignore(conn, model, batches, keys=None):
+    stmt = sqlite_insert(model.__table__).on_conflict_do_nothing(index_elements=NATURAL_KEYS[model])
+    inserted = 0
+    for batch in batches:
+        if not len(batch):
+            continue
+        inserted += _write(conn, stmt, batch, keys)
+    return inserted
+
+def upsert(conn, model, batches, keys=None):
+    conflict = NATURAL_KEYS[model]
+    stmt = None
+    written = 0
+    for batch in batches:
+        if not len(batch):
+            continue
+        if stmt is None:
+            insert = sqlite_insert(model.__table__)
+            stmt = insert.on_conflict_do_update(
+                index_elements=conflict,
+                set_={name: insert.excluded[name] for name in _names(batch) if name not in conflict}
+            )
+        written += _write(conn, stmt, batch, keys)
+    return written
+
+def secondary_indexes():
+    return [index for table in AnalyticsBase.metadata.sorted_tables for index in table.indexes if index.name.startswith('idx_')]
+
+def drop_secondary_indexes(engine):
+    with engine.begin() as conn:
+        for index in secondary_indexes():
+            index.drop(conn, checkfirst=True)
+
+def rebuild_secondary_indexes(engine):
+    with engine.begin() as conn:
+        for index in secondary_indexes():
+            index.create(conn, checkfirst=True)
+        conn.exec_driver_sql("ANALYZE")
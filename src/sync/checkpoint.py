@@ -0,0 +1,53 @@
+from datetime import datetime
+from sqlalchemy import select, delete
+from src.models.analytics import LoadCheckpoint, SyncState
+from src.sync.bulk import upsert
+from src.sync.state import set_watermarks
+
+# Progress of an unfinished full load. Tables loaded in one transaction have a
+# single checkpoint at range_start 0; partitioned tables have one per key range,
+# planned up front so a resumed run works through the same ranges.
+
+WHOLE_TABLE = (0, None)
+
+def _marks_name(table_name):
+    return f"full_load:{table_name}"
+
+def checkpoints(sqlite_conn, table_name):
+    rows = sqlite_conn.execute(
+        select(LoadCheckpoint.range_start, LoadCheckpoint.range_end, LoadCheckpoint.completed_at)
+        .where(LoadCheckpoint.table_name == table_name)
+        .order_by(LoadCheckpoint.range_start)
+    )
+    return {(start, end): completed_at is not None for start, end, completed_at in rows}
+
+def plan(sqlite_conn, table_name, ranges):
+    upsert(sqlite_conn, LoadCheckpoint, [[
+        {'table_name': table_name, 'range_start': start, 'range_end': end, 'rows_loaded': 0, 'completed_at': None}
+        for start, end in ranges
+    ]])
+
+def complete(sqlite_conn, table_name, key_range, rows_loaded):
+    start, end = key_range
+    upsert(sqlite_conn, LoadCheckpoint, [[
+        {'table_name': table_name, 'range_start': start, 'range_end': end,
+         'rows_loaded': rows_loaded, 'completed_at': datetime.now()}
+    ]])
+
+def saved_marks(sqlite_conn, tables):
+    # Source watermarks taken when the interrupted load started; a resumed
+    # load must finish with these, not with marks taken at resume time.
+    rows = sqlite_conn.execute(
+        select(SyncState.table_name, SyncState.last_updated, SyncState.last_id)
+        .where(SyncState.table_name.in_([_marks_name(t) for t in tables]))
+    ).all()
+    if len(rows) < len(tables):
+        return None
+    return {name.split(':', 1)[1]: (last_updated, last_id) for name, last_updated, last_id in rows}
+
+def save_marks(sqlite_conn, marks):
+    set_watermarks(sqlite_conn, {_marks_name(t): mark for t, mark in marks.items()})
+
+def clear(sqlite_conn):
+    sqlite_conn.execute(delete(LoadCheckpoint))
+    sqlite_conn.execute(delete(SyncState).where(SyncState.table_name.like(_marks_name('%'))))
@@ -0,0 +1,39 @@
+class ColumnBatch:
+    # A transformed batch held as one list per column. The bulk writer binds
+    # it positionally, so no dict is built per row.
+    def __init__(self, columns):
+        self.columns = columns
+
+    @classmethod
+    def from_rows(cls, rows):
+        if isinstance(rows, ColumnBatch):
+            return rows
+        if not rows:
+            return cls({})
+        return cls(dict(zip(rows[0]._fields, map(list, zip(*rows)))))
+
+    def __len__(self):
+        return len(next(iter(self.columns.values()), ()))
+
+    def __iter__(self):
+        names = list(self.columns)
+        for values in zip(*self.columns.values()):
+            yield dict(zip(names, values))
+
+def date_keys(values):
+    return [None if v is None else v.year * 10000 + v.month * 100 + v.day for v in values]
+
+def day_spans(starts, ends):
+    # Whole days between two datetimes, rounded down like timedelta.days.
+    return [(end - start).days if start is not None and end is not None else None
+            for start, end in zip(starts, ends)]
+
+def lookup(key_map, ids):
+    keys, sparse = key_map.keys, key_map.sparse
+    size = len(keys)
+    if not sparse:
+        return [(keys[i] or None) if i is not None and 0 <= i < size else None for i in ids]
+    return [(keys[i] if i is not None and 0 <= i < size else 0) or sparse.get(i) for i in ids]
+
+def to_float(values):
+    return [None if v is None else float(v) for v in values]
@@ -0,0 +1,75 @@
+from sqlalchemy import select, delete, update, func
+from src.models.sakila import Film, Actor, Category, Store, Customer, Rental, Payment
+from src.models.analytics import DimFilm, DimActor, DimCategory, DimStore, DimCustomer, BridgeFilmActor, BridgeFilmCategory, FactRental, FactPayment
+from src.sync.aggregates import maintained, forget
+from src.sync.bulk import batched
+from src.sync.keycache import DIMENSIONS
+from src.sync.partitions import months_where, mark
+
+# Source and warehouse key of every table whose hard deletes are mirrored,
+# facts before the dimensions they reference.
+KEY_SETS = {
+    'fact_rental': (Rental.rental_id, FactRental.rental_id),
+    'fact_payment': (Payment.payment_id, FactPayment.payment_id),
+    'dim_customer': (Customer.customer_id, DimCustomer.customer_id),
+    'dim_film': (Film.film_id, DimFilm.film_id),
+    'dim_actor': (Actor.actor_id, DimActor.actor_id),
+    'dim_category': (Category.category_id, DimCategory.category_id),
+    'dim_store': (Store.store_id, DimStore.store_id),
+}
+# Rows pointing at a removed dimension row: fact references are cleared,
+# bridge rows are deleted.
+REFERENCES = {
+    'dim_customer': ([FactRental.customer_key, FactPayment.customer_key], []),
+    'dim_film': ([FactRental.film_key], [BridgeFilmActor.film_key, BridgeFilmCategory.film_key]),
+    'dim_actor': ([], [BridgeFilmActor.actor_key]),
+    'dim_category': ([], [BridgeFilmCategory.category_key]),
+    'dim_store': ([FactRental.store_key, FactPayment.store_key], []),
+}
+# Ids per digest range; only ranges whose digests differ are listed id by id.
+RANGE_SIZE = 1000
+
+def key_digests(conn, key, width=RANGE_SIZE):
+    bucket = (key // width).label('bucket')
+    query = select(bucket, func.count(), func.min(key), func.max(key), func.sum(key)).group_by(bucket)
+    return {int(b): (count, low, high, int(total)) for b, count, low, high, total in conn.execute(query)}
+
+def deleted_ids(mysql_conn, sqlite_conn, name, width=RANGE_SIZE):
+    # Warehouse ids no longer in the source. Ranges without warehouse rows
+    # cannot hold deletes, so only the warehouse side's ranges are compared.
+    source_key, warehouse_key = KEY_SETS[name]
+    expected = key_digests(mysql_conn, source_key, width)
+    actual = key_digests(sqlite_conn, warehouse_key, width)
+    deleted = []
+    for bucket in sorted(actual):
+        if expected.get(bucket) == actual[bucket]:
+            continue
+        low, high = bucket * width, (bucket + 1) * width
+        present = set(mysql_conn.execute(
+            select(source_key).where(source_key >= low, source_key < high)
+        ).scalars())
+        deleted += [i for i in sqlite_conn.execute(
+            select(warehouse_key).where(warehouse_key >= low, warehouse_key < high).order_by(warehouse_key)
+        ).scalars() if i not in present]
+    return deleted
+
+def remove(sqlite_conn, name, ids, keys=None, batch_size=RANGE_SIZE):
+    warehouse_key = KEY_SETS[name][1]
+    model = warehouse_key.class_
+    removed = 0
+    for batch in batched(ids, batch_size):
+        if name in REFERENCES:
+            id_column, key_column = DIMENSIONS[name]
+            surrogate = select(key_column).where(id_column.in_(batch))
+            facts, bridges = REFERENCES[name]
+            for column in facts:
+                forget(sqlite_conn, column, surrogate)
+                mark(sqlite_conn, column.class_, months_where(sqlite_conn, column.class_, column.in_(surrogate)))
+                sqlite_conn.execute(update(column.class_).where(column.in_(surrogate)).values({column.key: None}))
+            for column in bridges:
+                sqlite_conn.execute(delete(column.class_).where(column.in_(surrogate)))
+        removed += maintained(sqlite_conn, model, batch,
+                              lambda: sqlite_conn.execute(delete(model).where(warehouse_key.in_(batch))).rowcount)
+        if keys is not None:
+            keys.update((natural_id, 0) for natural_id in batch)
+    return removed
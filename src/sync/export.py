@@ -0,0 +1,165 @@
+import os
+from datetime import datetime
+from sqlalchemy import select, delete, or_, Integer, Float, DECIMAL, DateTime, Date
+from src.config import get_sqlite_engine
+from src.models.analytics import (DimDate, DimFilm, DimActor, DimCategory, DimStore, DimCustomer, BridgeFilmActor,
+                                  BridgeFilmCategory, FactRental, FactPayment, SyncState)
+from src.sync.bulk import upsert
+from src.sync.partitions import PARTITION_KEYS, NO_DATE, all_months, marks
+from src.sync.state import data_version
+from src.sync.telemetry import Telemetry, record_rows
+
+# Tables written to Parquet and the date key facts are partitioned on by
+# year/month; dimensions are one file each.
+TABLES = {
+    'dim_date': (DimDate, None),
+    'dim_film': (DimFilm, None),
+    'dim_actor': (DimActor, None),
+    'dim_category': (DimCategory, None),
+    'dim_store': (DimStore, None),
+    'dim_customer': (DimCustomer, None),
+    'bridge_film_actor': (BridgeFilmActor, None),
+    'bridge_film_category': (BridgeFilmCategory, None),
+    'fact_rental': (FactRental, PARTITION_KEYS[FactRental]),
+    'fact_payment': (FactPayment, PARTITION_KEYS[FactPayment]),
+}
+# Month key (YYYYMM) of an unpartitioned table; facts without a date key land
+# in the same year=0/month=0 partition.
+WHOLE = NO_DATE
+ROW_GROUP_SIZE = 100000
+
+def _arrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise RuntimeError("Parquet export needs the pyarrow package (pip install pyarrow)")
+    return pyarrow, pyarrow.parquet
+
+def arrow_schema(pa, model):
+    def arrow_type(column_type):
+        if isinstance(column_type, DECIMAL):
+            return pa.decimal128(column_type.precision, column_type.scale)
+        if isinstance(column_type, Integer):
+            return pa.int64()
+        if isinstance(column_type, Float):
+            return pa.float64()
+        if isinstance(column_type, DateTime):
+            return pa.timestamp('us')
+        if isinstance(column_type, Date):
+            return pa.date32()
+        return pa.string()
+    return pa.schema([(column.name, arrow_type(column.type)) for column in model.__table__.columns])
+
+def partition_path(root, name, key, month):
+    if key is None:
+        return os.path.join(root, f"{name}.parquet")
+    return os.path.join(root, name, f"year={month // 100}", f"month={month % 100}", "part-0.parquet")
+
+def _in_partition(key, month):
+    if key is None:
+        return []
+    if month == WHOLE:
+        return [or_(key.is_(None), key < 100)]
+    # A range on the date key itself, so its index is used.
+    return [key.between(month * 100, month * 100 + 99)]
+
+def write_partition(sqlite_conn, pa, pq, model, key, month, path, row_group_size=ROW_GROUP_SIZE):
+    # Written to a temporary file and renamed, so readers never see a partial partition.
+    schema = arrow_schema(pa, model)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    result = sqlite_conn.execution_options(yield_per=row_group_size).execute(
+        select(model.__table__).where(*_in_partition(key, month))
+    )
+    written = 0
+    with pq.ParquetWriter(path + '.tmp', schema) as writer:
+        for rows in result.partitions():
+            columns = list(zip(*rows))
+            writer.write_table(pa.Table.from_arrays(
+                [pa.array(values, type=field.type) for values, field in zip(columns, schema)], schema=schema
+            ))
+            written += len(rows)
+    os.replace(path + '.tmp', path)
+    return written
+
+def remove_partition(root, path):
+    # The file, then its month and year directories once empty.
+    if os.path.exists(path):
+        os.remove(path)
+    directory = os.path.dirname(path)
+    for _ in range(2):
+        if os.path.abspath(directory) == os.path.abspath(root) or not os.path.isdir(directory) or os.listdir(directory):
+            break
+        os.rmdir(directory)
+        directory = os.path.dirname(directory)
+
+def stale_partitions(sqlite_conn, model, key, exported, version, full=False):
+    # Months to rewrite, from the versions they were exported at (exported) and
+    # the marks left by the syncs that changed them; no table is scanned except
+    # for the months of a fact after a full load. A mark at the exported
+    # version may postdate the export, so it counts as a change.
+    if key is None:
+        done = exported.get(WHOLE)
+        return [WHOLE] if full or done is None or version > done else []
+    whole, changed = marks(sqlite_conn, model)
+    if full or not exported or (whole is not None and whole >= min(exported.values())):
+        return sorted(all_months(sqlite_conn, model) | set(exported))
+    return sorted(m for m in set(changed) | set(exported)
+                  if m not in exported or changed.get(m, -1) >= exported[m])
+
+def export_table(sqlite_engine, root, name, version, full=False):
+    # Only partitions changed since they were last exported to this directory
+    # (or whose file is missing) are rewritten; emptied ones are removed.
+    pa, pq = _arrow()
+    model, key = TABLES[name]
+    prefix = f"export:{root}:{name}:"
+    written = rows = 0
+    removed = []
+    with sqlite_engine.connect() as conn:
+        exported = {int(table_name[len(prefix):]): done or -1 for table_name, done in conn.execute(
+            select(SyncState.table_name, SyncState.last_id).where(SyncState.table_name.startswith(prefix, autoescape=True))
+        )}
+        stale = set(stale_partitions(conn, model, key, exported, version, full))
+        stale |= {m for m in exported if not os.path.exists(partition_path(root, name, key, m))}
+        for month in sorted(stale):
+            path = partition_path(root, name, key, month)
+            count = write_partition(conn, pa, pq, model, key, month, path)
+            if count == 0 and key is not None:
+                remove_partition(root, path)
+                removed.append(month)
+            else:
+                written += 1
+                rows += count
+    exported_now = sorted(stale - set(removed))
+    with sqlite_engine.begin() as conn:
+        if exported_now:
+            upsert(conn, SyncState, [[{'table_name': f"{prefix}{month}", 'last_updated': datetime.now(),
+                                       'last_id': version} for month in exported_now]])
+        if removed:
+            conn.execute(delete(SyncState).where(SyncState.table_name.in_([f"{prefix}{month}" for month in removed])))
+    record_rows('exported', rows)
+    record_rows('partitions', written)
+    return written, len(set(exported) | stale) - len(removed), len(removed), rows
+
+def run_export(out_dir='export', full=False):
+    print(f"Exporting to {out_dir}...")
+    root = os.path.abspath(out_dir)
+    sqlite_engine = get_sqlite_engine()
+    telemetry = Telemetry('export')
+    telemetry.watch(sqlite_engine, 'sqlite')
+    status = 'error'
+    try:
+        # Read before any data, so changes made during the export are
+        # exported again next time.
+        with sqlite_engine.connect() as conn:
+            version = data_version(conn)
+        for name in TABLES:
+            with telemetry.stage(name):
+                written, partitions, removed, rows = export_table(sqlite_engine, root, name, version, full)
+            print(f"{name} done ({written} of {partitions} partitions written, {rows} rows"
+                  f"{f', {removed} removed' if removed else ''})")
+        status = 'ok'
+        print("Export complete!")
+    except Exception as e:
+        print(f"Export failed: {e}")
+    return telemetry.finish(status)
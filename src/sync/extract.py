@@ -0,0 +1,63 @@
+from sqlalchemy import select, case
+from src.config import SYNC_BATCH_SIZE
+from src.models.sakila import Film, Language, Store, Customer, Address, City, Country, Inventory, Rental, Payment
+
+def stream(conn, stmt, batch_size=SYNC_BATCH_SIZE):
+    # Server-side cursor: only one batch of source rows is held in memory at a time.
+    result = conn.execute(stmt.execution_options(stream_results=True, yield_per=batch_size))
+    try:
+        yield from result.partitions()
+    finally:
+        result.close()
+
+# Source queries are denormalized on the MySQL side, so foreign keys are
+# resolved by the join and only the columns the warehouse stores are sent.
+
+def film_query():
+    return (
+        select(
+            Film.film_id, Film.title, Film.rating, Film.length, Film.release_year, Film.last_update,
+            case((Language.language_id.is_(None), 'Unknown'), else_=Language.name).label('language')
+        )
+        .select_from(Film)
+        .outerjoin(Language, Film.language_id == Language.language_id)
+    )
+
+def _located(query, address_id):
+    return (
+        query.add_columns(City.city, Country.country)
+        .outerjoin(Address, address_id == Address.address_id)
+        .outerjoin(City, Address.city_id == City.city_id)
+        .outerjoin(Country, City.country_id == Country.country_id)
+    )
+
+def store_query():
+    return _located(select(Store.store_id, Store.last_update).select_from(Store), Store.address_id)
+
+def customer_query():
+    return _located(
+        select(Customer.customer_id, Customer.first_name, Customer.last_name, Customer.active, Customer.last_update)
+        .select_from(Customer),
+        Customer.address_id
+    )
+
+def rental_query():
+    return (
+        select(
+            Rental.rental_id, Rental.rental_date, Rental.return_date, Rental.customer_id, Rental.staff_id,
+            Inventory.film_id, Inventory.store_id
+        )
+        .select_from(Rental)
+        .outerjoin(Inventory, Rental.inventory_id == Inventory.inventory_id)
+    )
+
+def payment_query():
+    return (
+        select(
+            Payment.payment_id, Payment.payment_date, Payment.customer_id, Payment.staff_id, Payment.amount,
+            Inventory.store_id
+        )
+        .select_from(Payment)
+        .outerjoin(Rental, Payment.rental_id == Rental.rental_id)
+        .outerjoin(Inventory, Rental.inventory_id == Inventory.inventory_id)
+    )
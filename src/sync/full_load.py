@@ -1,188 +1,189 @@
-from sqlalchemy.orm import sessionmaker
-from src.config import get_mysql_engine, get_sqlite_engine
-from src.models.sakila import Film, Actor, Category, FilmActor, FilmCategory, Language, Store, Customer, Inventory, Rental, Payment, Staff, Address, City, Country
-from src.models.analytics import DimFilm, DimActor, DimCategory, DimStore, DimCustomer, BridgeFilmActor, BridgeFilmCategory, FactRental, FactPayment, SyncState
-from datetime import datetime
+from functools import partial
+from threading import Lock
+from sqlalchemy import select
+from src.config import get_mysql_engine, get_sqlite_engine, use_sqlite_profile, SYNC_BATCH_SIZE, SYNC_WORKERS, SYNC_PROCESSES, SQLITE_PRAGMAS, SQLITE_LOAD_PRAGMAS
+from src.models.sakila import Actor, Category, FilmActor, FilmCategory, Rental, Payment
+from src.models.analytics import DimFilm, DimActor, DimCategory, DimStore, DimCustomer, BridgeFilmActor, BridgeFilmCategory, FactRental, FactPayment
+from src.sync.bulk import insert_ignore, drop_secondary_indexes, rebuild_secondary_indexes
+from src.sync.extract import stream, film_query, store_query, customer_query, rental_query, payment_query
+from src.sync.keycache import KeyCache, DIMENSIONS
+from src.sync import aggregates, checkpoint
+from src.sync.memory import MemoryReport
+from src.sync.overlap import overlapped
+from src.sync.partitions import PARTITION_KEYS, mark_all
+from src.sync.parallel import partitioned, key_ranges, RANGES_PER_WORKER
+from src.sync.scheduler import Stage, run_stages
+from src.sync.schema import upgrade_schema
+from src.sync.state import source_watermark, set_watermarks, bump_version
+from src.sync.telemetry import Telemetry, record_rows
+from src.sync.transform import film_row, actor_row, category_row, store_row, customer_row, film_actor_row, film_category_row, per_row, rental_columns, payment_columns
 
-def get_date_key(dt):
-    if dt is None:
-        return None
-    return int(dt.strftime('%Y%m%d'))
+STATE_TABLES = ['film', 'actor', 'category', 'store', 'customer', 'rental', 'payment', 'film_actor', 'film_category',
+                'address', 'city', 'country']
+# Largest key range committed as one checkpoint.
+CHECKPOINT_SPAN = 100000
 
-def run_full_load():
+def run_full_load(batch_size=SYNC_BATCH_SIZE, workers=SYNC_WORKERS, resume=True, processes=SYNC_PROCESSES):
     print("Starting full load...")
 
-    mysql_session = sessionmaker(bind=get_mysql_engine())()
-    sqlite_session = sessionmaker(bind=get_sqlite_engine())()
+    mysql_engine = get_mysql_engine()
+    sqlite_engine = get_sqlite_engine()
+    memory = MemoryReport()
+    # SQLite has a single writer, so table transactions are serialized while
+    # extraction from MySQL runs concurrently on separate connections.
+    writer = Lock()
+    cache = KeyCache(sqlite_engine)
+    telemetry = Telemetry('full_load')
+    telemetry.watch(mysql_engine, 'mysql')
+    telemetry.watch(sqlite_engine, 'sqlite')
 
-    try:
-        print("Loading dim_film...")
-        languages = {l.language_id: l.name for l in mysql_session.query(Language).all()}
-        for film in mysql_session.query(Film).all():
-            existing = sqlite_session.query(DimFilm).filter_by(film_id=film.film_id).first()
-            if not existing:
-                sqlite_session.add(DimFilm(
-                    film_id=film.film_id,
-                    title=film.title,
-                    rating=film.rating,
-                    length=film.length,
-                    language=languages.get(film.language_id, 'Unknown'),
-                    release_year=str(film.release_year),
-                    last_update=film.last_update
-                ))
-        sqlite_session.commit()
-        print("dim_film done")
-
-        print("Loading dim_actor...")
-        for actor in mysql_session.query(Actor).all():
-            existing = sqlite_session.query(DimActor).filter_by(actor_id=actor.actor_id).first()
-            if not existing:
-                sqlite_session.add(DimActor(
-                    actor_id=actor.actor_id,
-                    first_name=actor.first_name,
-                    last_name=actor.last_name,
-                    last_update=actor.last_update
-                ))
-        sqlite_session.commit()
-        print("dim_actor done")
+    def load_whole(name, model, query, transform, keys):
+        # Dimensions are small: extract them before queueing for the writer.
+        with mysql_engine.connect() as mysql_conn:
+            batches = [batch for batch in overlapped(stream(mysql_conn, query, batch_size), transform) if len(batch)]
+        record_rows('extracted', sum(map(len, batches)))
+        stamp = None
+        with writer, sqlite_engine.begin() as conn:
+            inserted = insert_ignore(conn, model, batches, keys)
+            checkpoint.complete(conn, name, checkpoint.WHOLE_TABLE, inserted)
+            if keys is not None and keys.dirty:
+                stamp = cache.stamp(conn, name)
+        if stamp is not None:
+            cache.save(name, keys, stamp)
+        record_rows('inserted', inserted)
+        return inserted
 
-        print("Loading dim_category...")
-        for cat in mysql_session.query(Category).all():
-            existing = sqlite_session.query(DimCategory).filter_by(category_id=cat.category_id).first()
-            if not existing:
-                sqlite_session.add(DimCategory(
-                    category_id=cat.category_id,
-                    name=cat.name,
-                    last_update=cat.last_update
-                ))
-        sqlite_session.commit()
-        print("dim_category done")
+    def load_ranges(name, model, query, transform, partition_key, planned):
+        if planned:
+            ranges = [key_range for key_range, done in planned.items() if not done]
+            print(f"{name}: resuming {len(ranges)} of {len(planned)} key ranges")
+        else:
+            with mysql_engine.connect() as mysql_conn:
+                ranges = key_ranges(mysql_conn, query, partition_key, workers * RANGES_PER_WORKER, CHECKPOINT_SPAN)
+            if not ranges:
+                # Empty source table: nothing to plan, it is simply done.
+                with writer, sqlite_engine.begin() as conn:
+                    checkpoint.complete(conn, name, checkpoint.WHOLE_TABLE, 0)
+                record_rows('inserted', 0)
+                return 0
+            with writer, sqlite_engine.begin() as conn:
+                checkpoint.plan(conn, name, ranges)
+        inserted = 0
+        loaded = {}
+        with sqlite_engine.connect() as conn:
+            # The writer is taken per batch, so the fact tables load side by
+            # side. A key range's checkpoint commits after all its batches;
+            # batches of an unfinished range are skipped by insert_ignore
+            # when the range is redone.
+            for key_range, batch in partitioned(mysql_engine, query, partition_key, transform,
+                                                max(1, workers), batch_size, ranges, processes):
+                if batch is None:
+                    with writer, conn.begin():
+                        checkpoint.complete(conn, name, key_range, loaded.pop(key_range, 0))
+                    continue
+                with writer, conn.begin():
+                    count = insert_ignore(conn, model, [batch])
+                loaded[key_range] = loaded.get(key_range, 0) + count
+                inserted += count
+                record_rows('extracted', len(batch))
+        record_rows('inserted', inserted)
+        return inserted
 
-        print("Loading dim_store...")
-        addresses = {a.address_id: a for a in mysql_session.query(Address).all()}
-        cities = {c.city_id: c for c in mysql_session.query(City).all()}
-        countries = {c.country_id: c for c in mysql_session.query(Country).all()}
-        for store in mysql_session.query(Store).all():
-            address = addresses.get(store.address_id)
-            city = cities.get(address.city_id) if address else None
-            country = countries.get(city.country_id) if city else None
-            existing = sqlite_session.query(DimStore).filter_by(store_id=store.store_id).first()
-            if not existing:
-                sqlite_session.add(DimStore(
-                    store_id=store.store_id,
-                    city=city.city if city else None,
-                    country=country.country if country else None,
-                    last_update=store.last_update
-                ))
-        sqlite_session.commit()
-        print("dim_store done")
-
-        print("Loading dim_customer...")
-        customers = mysql_session.query(Customer).all()
-        for customer in customers:
-            address = addresses.get(customer.address_id)
-            city = cities.get(address.city_id) if address else None
-            country = countries.get(city.country_id) if city else None
-            existing = sqlite_session.query(DimCustomer).filter_by(customer_id=customer.customer_id).first()
-            if not existing:
-                sqlite_session.add(DimCustomer(
-                    customer_id=customer.customer_id,
-                    first_name=customer.first_name,
-                    last_name=customer.last_name,
-                    active=customer.active,
-                    city=city.city if city else None,
-                    country=country.country if country else None,
-                    last_update=customer.last_update
-                ))
-        sqlite_session.commit()
-        print("dim_customer done")
+    def table_stage(name, model, query, make_transform, deps=(), partition_key=None):
+        def run(results):
+            keys = None
+            with sqlite_engine.connect() as conn:
+                planned = checkpoint.checkpoints(conn, name)
+                if name in DIMENSIONS:
+                    keys = cache.load(conn, name)
+            if planned and all(planned.values()):
+                print(f"{name} already loaded, skipping")
+                return keys
+            print(f"Loading {name}...")
+            transform = make_transform(results)
+            if partition_key is None:
+                inserted = load_whole(name, model, query, transform, keys)
+            else:
+                inserted = load_ranges(name, model, query, transform, partition_key, planned)
+            print(f"{name} done ({inserted} new, {memory.record(name)})")
+            return keys
+        return Stage(name, run, deps)
 
-        print("Loading bridge_film_actor...")
-        film_map = {f.film_id: f.film_key for f in sqlite_session.query(DimFilm).all()}
-        actor_map = {a.actor_id: a.actor_key for a in sqlite_session.query(DimActor).all()}
-        for fa in mysql_session.query(FilmActor).all():
-            fk = film_map.get(fa.film_id)
-            ak = actor_map.get(fa.actor_id)
-            if fk and ak:
-                existing = sqlite_session.query(BridgeFilmActor).filter_by(film_key=fk, actor_key=ak).first()
-                if not existing:
-                    sqlite_session.add(BridgeFilmActor(film_key=fk, actor_key=ak))
-        sqlite_session.commit()
-        print("bridge_film_actor done")
+    stages = [
+        table_stage('dim_film', DimFilm, film_query(), lambda r: per_row(film_row)),
+        table_stage('dim_actor', DimActor, select(Actor.__table__), lambda r: per_row(actor_row)),
+        table_stage('dim_category', DimCategory, select(Category.__table__), lambda r: per_row(category_row)),
+        table_stage('dim_store', DimStore, store_query(), lambda r: per_row(store_row)),
+        table_stage('dim_customer', DimCustomer, customer_query(), lambda r: per_row(customer_row)),
+        table_stage('bridge_film_actor', BridgeFilmActor, select(FilmActor.film_id, FilmActor.actor_id),
+                    lambda r: per_row(partial(film_actor_row, film_map=r['dim_film'], actor_map=r['dim_actor'])),
+                    deps=['dim_film', 'dim_actor']),
+        table_stage('bridge_film_category', BridgeFilmCategory, select(FilmCategory.film_id, FilmCategory.category_id),
+                    lambda r: per_row(partial(film_category_row, film_map=r['dim_film'], category_map=r['dim_category'])),
+                    deps=['dim_film', 'dim_category']),
+        table_stage('fact_rental', FactRental, rental_query(),
+                    lambda r: partial(rental_columns, film_map=r['dim_film'],
+                                      store_map=r['dim_store'], customer_map=r['dim_customer']),
+                    deps=['dim_film', 'dim_store', 'dim_customer'], partition_key=Rental.rental_id),
+        table_stage('fact_payment', FactPayment, payment_query(),
+                    lambda r: partial(payment_columns, store_map=r['dim_store'],
+                                      customer_map=r['dim_customer']),
+                    deps=['dim_store', 'dim_customer'], partition_key=Payment.payment_id),
+    ]
 
-        print("Loading bridge_film_category...")
-        category_map = {c.category_id: c.category_key for c in sqlite_session.query(DimCategory).all()}
-        for fc in mysql_session.query(FilmCategory).all():
-            fk = film_map.get(fc.film_id)
-            ck = category_map.get(fc.category_id)
-            if fk and ck:
-                existing = sqlite_session.query(BridgeFilmCategory).filter_by(film_key=fk, category_key=ck).first()
-                if not existing:
-                    sqlite_session.add(BridgeFilmCategory(film_key=fk, category_key=ck))
-        sqlite_session.commit()
-        print("bridge_film_category done")
+    use_sqlite_profile(sqlite_engine, SQLITE_LOAD_PRAGMAS)
+    status = 'error'
+    try:
+        with telemetry.stage('prepare'):
+            upgrade_schema(sqlite_engine)
+            with sqlite_engine.begin() as conn:
+                # Facts are loaded without maintaining the aggregates, which
+                # are rebuilt once they are in.
+                aggregates.invalidate(conn)
+                bump_version(conn)
+                for fact in PARTITION_KEYS:
+                    mark_all(conn, fact)
+                if not resume:
+                    checkpoint.clear(conn)
+                marks = checkpoint.saved_marks(conn, STATE_TABLES)
+            if marks is not None:
+                print("Resuming interrupted full load...")
+            else:
+                # Watermarks are taken from the source before extracting, so rows changed
+                # during the load are picked up again by the next incremental run.
+                with mysql_engine.connect() as mysql_conn:
+                    marks = {table: source_watermark(mysql_conn, table) for table in STATE_TABLES}
+                with sqlite_engine.begin() as conn:
+                    checkpoint.clear(conn)
+                    checkpoint.save_marks(conn, marks)
 
-        print("Loading fact_rental...")
-        inventories = {i.inventory_id: i for i in mysql_session.query(Inventory).all()}
-        staffs = {s.staff_id: s for s in mysql_session.query(Staff).all()}
-        customer_map = {c.customer_id: c.customer_key for c in sqlite_session.query(DimCustomer).all()}
-        store_map = {s.store_id: s.store_key for s in sqlite_session.query(DimStore).all()}
-        for rental in mysql_session.query(Rental).all():
-            inventory = inventories.get(rental.inventory_id)
-            fk = film_map.get(inventory.film_id) if inventory else None
-            sk = store_map.get(inventory.store_id) if inventory else None
-            ck = customer_map.get(rental.customer_id)
-            duration = None
-            if rental.return_date and rental.rental_date:
-                duration = (rental.return_date - rental.rental_date).days
-            existing = sqlite_session.query(FactRental).filter_by(rental_id=rental.rental_id).first()
-            if not existing:
-                sqlite_session.add(FactRental(
-                    rental_id=rental.rental_id,
-                    date_key_rented=get_date_key(rental.rental_date),
-                    date_key_returned=get_date_key(rental.return_date),
-                    film_key=fk,
-                    store_key=sk,
-                    customer_key=ck,
-                    staff_id=rental.staff_id,
-                    rental_duration_days=duration
-                ))
-        sqlite_session.commit()
-        print("fact_rental done")
+            # Secondary indexes are rebuilt once at the end instead of being
+            # maintained on every insert.
+            drop_secondary_indexes(sqlite_engine)
+        try:
+            run_stages(stages, workers, telemetry)
+        finally:
+            print("Rebuilding indexes...")
+            with telemetry.stage('rebuild_indexes'):
+                rebuild_secondary_indexes(sqlite_engine)
+            with sqlite_engine.begin() as conn:
+                bump_version(conn)
 
-        print("Loading fact_payment...")
-        rental_store_map = {r.rental_id: inventories.get(r.inventory_id) for r in mysql_session.query(Rental).all()}
-        for payment in mysql_session.query(Payment).all():
-            ck = customer_map.get(payment.customer_id)
-            inventory = rental_store_map.get(payment.rental_id)
-            sk = store_map.get(inventory.store_id) if inventory else None
-            existing = sqlite_session.query(FactPayment).filter_by(payment_id=payment.payment_id).first()
-            if not existing:
-                sqlite_session.add(FactPayment(
-                    payment_id=payment.payment_id,
-                    date_key_paid=get_date_key(payment.payment_date),
-                    customer_key=ck,
-                    store_key=sk,
-                    staff_id=payment.staff_id,
-                    amount=payment.amount
-                ))
-        sqlite_session.commit()
-        print("fact_payment done")
+        print("Building aggregates...")
+        with telemetry.stage('aggregates'), sqlite_engine.begin() as conn:
+            aggregates.rebuild(conn)
+            bump_version(conn)
 
-        now = datetime.now()
-        for table in ['film', 'actor', 'category', 'store', 'customer', 'rental', 'payment']:
-            state = sqlite_session.query(SyncState).filter_by(table_name=table).first()
-            if state:
-                state.last_updated = now
-            else:
-                sqlite_session.add(SyncState(table_name=table, last_updated=now))
-        sqlite_session.commit()
+        with sqlite_engine.begin() as conn:
+            set_watermarks(conn, marks)
+            checkpoint.clear(conn)
 
+        status = 'ok'
         print("Full load complete!")
 
     except Exception as e:
-        sqlite_session.rollback()
         print(f"Full load failed: {e}")
+        print("Run full-load again to resume from the last checkpoint, or with --restart to start over.")
     finally:
-        mysql_session.close()
-        sqlite_session.close()
\ No newline at end of file
+        use_sqlite_profile(sqlite_engine, SQLITE_PRAGMAS)
+    return telemetry.finish(status)
@@ -1,181 +1,202 @@
-from sqlalchemy.orm import sessionmaker
-from src.config import get_mysql_engine, get_sqlite_engine
-from src.models.sakila import Film, Actor, Category, Language, Store, Customer, Inventory, Rental, Payment, Address, City, Country
-from src.models.analytics import DimFilm, DimActor, DimCategory, DimStore, DimCustomer, BridgeFilmActor, BridgeFilmCategory, FactRental, FactPayment, SyncState
-from datetime import datetime
+from functools import partial
+from threading import Lock
+from sqlalchemy import select
+from concurrent.futures import Future
+from src.config import get_mysql_engine, get_sqlite_engine, SYNC_BATCH_SIZE, SYNC_WORKERS, SYNC_PROCESSES
+from src.models.sakila import Actor, Category
+from src.models.analytics import DimFilm, DimActor, DimCategory, DimStore, DimCustomer, FactRental, FactPayment
+from src.sync import aggregates
+from src.sync.bridges import BRIDGES, changed_films, drifted_films, diff_links, apply_links
+from src.sync.bulk import upsert, batched
+from src.sync.extract import film_query, store_query, customer_query, rental_query, payment_query
+from src.sync.keycache import KeyCache, DIMENSIONS
+from src.sync.deletes import KEY_SETS, deleted_ids, remove
+from src.sync.memory import MemoryReport
+from src.sync.overlap import overlapped
+from src.sync.propagate import LOCATION_TABLES, LOCATED, changed_addresses, relocated
+from src.sync.scheduler import Stage, run_stages
+from src.sync.schema import upgrade_schema
+from src.sync.state import get_watermark, set_watermarks, watermark_pages, source_watermark, changed_since, bump_version
+from src.sync.telemetry import Telemetry, record_rows
+from src.sync.workers import transform_pool, submit
+from src.sync.transform import film_row, actor_row, category_row, store_row, customer_row, per_row, rental_columns, payment_columns
 
-def get_date_key(dt):
-    if dt is None:
-        return None
-    return int(dt.strftime('%Y%m%d'))
-
-def get_last_updated(sqlite_session, table_name):
-    state = sqlite_session.query(SyncState).filter_by(table_name=table_name).first()
-    return state.last_updated if state else datetime(2000, 1, 1)
-
-def update_sync_state(sqlite_session, table_name, dt):
-    state = sqlite_session.query(SyncState).filter_by(table_name=table_name).first()
-    if state:
-        state.last_updated = dt
-    else:
-        sqlite_session.add(SyncState(table_name=table_name, last_updated=dt))
-    sqlite_session.commit()
-
-def run_incremental():
+def run_incremental(batch_size=SYNC_BATCH_SIZE, workers=SYNC_WORKERS, processes=SYNC_PROCESSES):
     print("Starting incremental update...")
 
-    mysql_session = sessionmaker(bind=get_mysql_engine())()
-    sqlite_session = sessionmaker(bind=get_sqlite_engine())()
-    now = datetime.now()
+    mysql_engine = get_mysql_engine()
+    sqlite_engine = get_sqlite_engine()
+    memory = MemoryReport()
+    writer = Lock()
+    cache = KeyCache(sqlite_engine)
+    telemetry = Telemetry('incremental')
+    telemetry.watch(mysql_engine, 'mysql')
+    telemetry.watch(sqlite_engine, 'sqlite')
 
-    try:
-        languages = {l.language_id: l.name for l in mysql_session.query(Language).all()}
-        addresses = {a.address_id: a for a in mysql_session.query(Address).all()}
-        cities = {c.city_id: c for c in mysql_session.query(City).all()}
-        countries = {c.country_id: c for c in mysql_session.query(Country).all()}
-        inventories = {i.inventory_id: i for i in mysql_session.query(Inventory).all()}
+    def table_stage(name, model, table_name, query, make_transform, deps=(), pooled=False):
+        def run(results):
+            print(f"Updating {name}...")
+            keys = None
+            with sqlite_engine.connect() as conn:
+                mark = get_watermark(conn, table_name)
+                if name in DIMENSIONS:
+                    keys = cache.load(conn, name)
+            transform = make_transform(results)
+
+            written = 0
+            stamp = None
+            with mysql_engine.connect() as mysql_conn, transform_pool(transform, processes if pooled else 0) as pool:
+                def convert(page):
+                    rows = transform(page) if pool is None else submit(pool, page)
+                    return rows, (page[-1].watermark_update, page[-1].watermark_id), len(page)
 
-        print("Updating dim_film...")
-        last = get_last_updated(sqlite_session, 'film')
-        for film in mysql_session.query(Film).filter(Film.last_update > last).all():
-            existing = sqlite_session.query(DimFilm).filter_by(film_id=film.film_id).first()
-            if existing:
-                existing.title = film.title
-                existing.rating = film.rating
-                existing.length = film.length
-                existing.language = languages.get(film.language_id, 'Unknown')
-                existing.release_year = str(film.release_year)
-                existing.last_update = film.last_update
-            else:
-                sqlite_session.add(DimFilm(
-                    film_id=film.film_id,
-                    title=film.title,
-                    rating=film.rating,
-                    length=film.length,
-                    language=languages.get(film.language_id, 'Unknown'),
-                    release_year=str(film.release_year),
-                    last_update=film.last_update
-                ))
-        sqlite_session.commit()
-        update_sync_state(sqlite_session, 'film', now)
-        print("dim_film done")
+                # Each page commits with its watermark, so an interrupted run
+                # resumes after the last page written.
+                pages = watermark_pages(mysql_conn, query, table_name, mark, batch_size)
+                for rows, mark, extracted in overlapped(pages, convert):
+                    if isinstance(rows, Future):
+                        rows = rows.result()
+                    record_rows('extracted', extracted)
+                    with writer, sqlite_engine.begin() as conn:
+                        if len(rows):
+                            written += aggregates.maintained(conn, model, aggregates.natural_ids(model, rows),
+                                                             lambda: upsert(conn, model, [rows], keys))
+                        set_watermarks(conn, {table_name: mark})
+                        if keys is not None and keys.dirty:
+                            stamp = cache.stamp(conn, name)
+            if stamp is not None:
+                cache.save(name, keys, stamp)
+            record_rows('upserted', written)
+            print(f"{name} done ({written} upserted, {memory.record(name)})")
+            return keys
+        return Stage(name, run, deps)
 
-        print("Updating dim_actor...")
-        last = get_last_updated(sqlite_session, 'actor')
-        for actor in mysql_session.query(Actor).filter(Actor.last_update > last).all():
-            existing = sqlite_session.query(DimActor).filter_by(actor_id=actor.actor_id).first()
-            if existing:
-                existing.first_name = actor.first_name
-                existing.last_name = actor.last_name
-                existing.last_update = actor.last_update
-            else:
-                sqlite_session.add(DimActor(
-                    actor_id=actor.actor_id,
-                    first_name=actor.first_name,
-                    last_name=actor.last_name,
-                    last_update=actor.last_update
-                ))
-        sqlite_session.commit()
-        update_sync_state(sqlite_session, 'actor', now)
-        print("dim_actor done")
+    def bridge_stage(name, table_name, dimension):
+        def run(results):
+            print(f"Updating {name}...")
+            with sqlite_engine.connect() as conn:
+                since = get_watermark(conn, table_name)
+            added = removed = 0
+            with mysql_engine.connect() as mysql_conn:
+                # Read before diffing, so links changed meanwhile are diffed again next run.
+                mark = source_watermark(mysql_conn, table_name)
+                film_ids = changed_films(mysql_conn, name, since)
+                record_rows('extracted', len(film_ids))
+                for films in batched(film_ids, batch_size):
+                    with writer, sqlite_engine.begin() as conn:
+                        new, stale = diff_links(mysql_conn, conn, name, films, results['dim_film'], results[dimension])
+                        counts = apply_links(conn, name, new, stale)
+                    mysql_conn.rollback()
+                    added += counts[0]
+                    removed += counts[1]
+            with writer, sqlite_engine.begin() as conn:
+                set_watermarks(conn, {table_name: mark})
+            record_rows('inserted', added)
+            record_rows('deleted', removed)
+            print(f"{name} done ({len(film_ids)} films diffed, {added} inserted, {removed} deleted, {memory.record(name)})")
+        return Stage(name, run, ['dim_film', dimension])
 
-        print("Updating dim_customer...")
-        last = get_last_updated(sqlite_session, 'customer')
-        for customer in mysql_session.query(Customer).filter(Customer.last_update > last).all():
-            address = addresses.get(customer.address_id)
-            city = cities.get(address.city_id) if address else None
-            country = countries.get(city.country_id) if city else None
-            existing = sqlite_session.query(DimCustomer).filter_by(customer_id=customer.customer_id).first()
-            if existing:
-                existing.first_name = customer.first_name
-                existing.last_name = customer.last_name
-                existing.active = customer.active
-                existing.city = city.city if city else None
-                existing.country = country.country if country else None
-                existing.last_update = customer.last_update
-            else:
-                sqlite_session.add(DimCustomer(
-                    customer_id=customer.customer_id,
-                    first_name=customer.first_name,
-                    last_name=customer.last_name,
-                    active=customer.active,
-                    city=city.city if city else None,
-                    country=country.country if country else None,
-                    last_update=customer.last_update
-                ))
-        sqlite_session.commit()
-        update_sync_state(sqlite_session, 'customer', now)
-        print("dim_customer done")
+    def locations_stage():
+        # Address, city and country changes re-derive the city/country columns
+        # of the customers and stores that depend on them.
+        def run(results):
+            print("Updating locations...")
+            with sqlite_engine.connect() as conn:
+                since = {table_name: get_watermark(conn, table_name) for table_name in LOCATION_TABLES}
+            written = 0
+            with mysql_engine.connect() as mysql_conn:
+                marks = {table_name: source_watermark(mysql_conn, table_name) for table_name in LOCATION_TABLES}
+                address_ids = changed_addresses(mysql_conn, {
+                    table_name: changed_since(table_name, mark) for table_name, mark in since.items()
+                })
+                record_rows('extracted', len(address_ids))
+                for name in LOCATED:
+                    for addresses in batched(address_ids, batch_size):
+                        rows = relocated(mysql_conn, name, addresses, results[name])
+                        mysql_conn.rollback()
+                        if rows:
+                            with writer, sqlite_engine.begin() as conn:
+                                written += upsert(conn, LOCATED[name][0], [rows])
+            with writer, sqlite_engine.begin() as conn:
+                set_watermarks(conn, marks)
+            record_rows('upserted', written)
+            print(f"locations done ({len(address_ids)} addresses changed, {written} rows re-derived, {memory.record('locations')})")
+        return Stage('locations', run, list(LOCATED))
 
-        print("Updating fact_rental...")
-        last = get_last_updated(sqlite_session, 'rental')
-        film_map = {f.film_id: f.film_key for f in sqlite_session.query(DimFilm).all()}
-        store_map = {s.store_id: s.store_key for s in sqlite_session.query(DimStore).all()}
-        customer_map = {c.customer_id: c.customer_key for c in sqlite_session.query(DimCustomer).all()}
-        for rental in mysql_session.query(Rental).filter(Rental.last_update > last).all():
-            inventory = inventories.get(rental.inventory_id)
-            fk = film_map.get(inventory.film_id) if inventory else None
-            sk = store_map.get(inventory.store_id) if inventory else None
-            ck = customer_map.get(rental.customer_id)
-            duration = None
-            if rental.return_date and rental.rental_date:
-                duration = (rental.return_date - rental.rental_date).days
-            existing = sqlite_session.query(FactRental).filter_by(rental_id=rental.rental_id).first()
-            if existing:
-                existing.date_key_rented = get_date_key(rental.rental_date)
-                existing.date_key_returned = get_date_key(rental.return_date)
-                existing.film_key = fk
-                existing.store_key = sk
-                existing.customer_key = ck
-                existing.staff_id = rental.staff_id
-                existing.rental_duration_days = duration
-            else:
-                sqlite_session.add(FactRental(
-                    rental_id=rental.rental_id,
-                    date_key_rented=get_date_key(rental.rental_date),
-                    date_key_returned=get_date_key(rental.return_date),
-                    film_key=fk,
-                    store_key=sk,
-                    customer_key=ck,
-                    staff_id=rental.staff_id,
-                    rental_duration_days=duration
-                ))
-        sqlite_session.commit()
-        update_sync_state(sqlite_session, 'rental', now)
-        print("fact_rental done")
+    def deletes_stage(deps):
+        # Runs last: key sets are compared once every insert and update is in.
+        def run(results):
+            print("Detecting deletes...")
+            removed = {}
+            with mysql_engine.connect() as mysql_conn:
+                for name in KEY_SETS:
+                    with sqlite_engine.connect() as conn:
+                        ids = deleted_ids(mysql_conn, conn, name)
+                    mysql_conn.rollback()
+                    if not ids:
+                        continue
+                    keys = results.get(name)
+                    stamp = None
+                    with writer, sqlite_engine.begin() as conn:
+                        removed[name] = remove(conn, name, ids, keys, batch_size)
+                        if keys is not None and keys.dirty:
+                            stamp = cache.stamp(conn, name)
+                    if stamp is not None:
+                        cache.save(name, keys, stamp)
+                # Links deleted from the source: films whose link digests
+                # differ are re-diffed once the dimensions above are settled.
+                for name, bridge in BRIDGES.items():
+                    with sqlite_engine.connect() as conn:
+                        film_ids = drifted_films(mysql_conn, conn, name)
+                    mysql_conn.rollback()
+                    for films in batched(film_ids, batch_size):
+                        with writer, sqlite_engine.begin() as conn:
+                            new, stale = diff_links(mysql_conn, conn, name, films, results['dim_film'], results[bridge[5]])
+                            apply_links(conn, name, new, stale)
+                        mysql_conn.rollback()
+                        if stale:
+                            removed[name] = removed.get(name, 0) + len(stale)
+            record_rows('deleted', sum(removed.values()))
+            summary = ', '.join(f"{count} from {name}" for name, count in removed.items()) or 'none'
+            print(f"deletes done ({summary}, {memory.record('deletes')})")
+        return Stage('deletes', run, deps)
 
-        print("Updating fact_payment...")
-        last = get_last_updated(sqlite_session, 'payment')
-        rental_store_map = {r.rental_id: inventories.get(r.inventory_id) for r in mysql_session.query(Rental).all()}
-        for payment in mysql_session.query(Payment).filter(Payment.payment_date > last).all():
-            ck = customer_map.get(payment.customer_id)
-            inventory = rental_store_map.get(payment.rental_id)
-            sk = store_map.get(inventory.store_id) if inventory else None
-            existing = sqlite_session.query(FactPayment).filter_by(payment_id=payment.payment_id).first()
-            if existing:
-                existing.date_key_paid = get_date_key(payment.payment_date)
-                existing.customer_key = ck
-                existing.store_key = sk
-                existing.staff_id = payment.staff_id
-                existing.amount = payment.amount
-            else:
-                sqlite_session.add(FactPayment(
-                    payment_id=payment.payment_id,
-                    date_key_paid=get_date_key(payment.payment_date),
-                    customer_key=ck,
-                    store_key=sk,
-                    staff_id=payment.staff_id,
-                    amount=payment.amount
-                ))
-        sqlite_session.commit()
-        update_sync_state(sqlite_session, 'payment', now)
-        print("fact_payment done")
+    stages = [
+        table_stage('dim_film', DimFilm, 'film', film_query(), lambda r: per_row(film_row)),
+        table_stage('dim_actor', DimActor, 'actor', select(Actor.__table__), lambda r: per_row(actor_row)),
+        table_stage('dim_category', DimCategory, 'category', select(Category.__table__), lambda r: per_row(category_row)),
+        table_stage('dim_store', DimStore, 'store', store_query(), lambda r: per_row(store_row)),
+        table_stage('dim_customer', DimCustomer, 'customer', customer_query(), lambda r: per_row(customer_row)),
+        locations_stage(),
+        bridge_stage('bridge_film_actor', 'film_actor', 'dim_actor'),
+        bridge_stage('bridge_film_category', 'film_category', 'dim_category'),
+        table_stage('fact_rental', FactRental, 'rental', rental_query(),
+                    lambda r: partial(rental_columns, film_map=r['dim_film'],
+                                      store_map=r['dim_store'], customer_map=r['dim_customer']),
+                    deps=['dim_store', 'dim_film', 'dim_customer'], pooled=True),
+        table_stage('fact_payment', FactPayment, 'payment', payment_query(),
+                    lambda r: partial(payment_columns, store_map=r['dim_store'],
+                                      customer_map=r['dim_customer']),
+                    deps=['dim_store', 'dim_customer'], pooled=True),
+    ]
+    stages.append(deletes_stage([stage.name for stage in stages]))
 
+    status = 'error'
+    try:
+        with telemetry.stage('prepare'):
+            upgrade_schema(sqlite_engine)
+            with sqlite_engine.begin() as conn:
+                bump_version(conn)
+                if aggregates.ensure(conn):
+                    print("Aggregates built")
+        try:
+            run_stages(stages, workers, telemetry)
+        finally:
+            with sqlite_engine.begin() as conn:
+                bump_version(conn)
+        status = 'ok'
         print("Incremental update complete!")
 
     except Exception as e:
-        sqlite_session.rollback()
         print(f"Incremental update failed: {e}")
-    finally:
-        mysql_session.close()
-        sqlite_session.close()
\ No newline at end of file
+    return telemetry.finish(status)
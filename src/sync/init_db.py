@@ -1,60 +1,73 @@
 from datetime import date, timedelta
 from sqlalchemy import inspect
 from src.config import get_sqlite_engine, get_mysql_engine
-from src.models.analytics import AnalyticsBase, DimDate
+from src.models.analytics import DimDate
+from src.sync.schema import upgrade_schema
+from src.sync.state import bump_version
+from src.sync.telemetry import Telemetry, record_rows
 from sqlalchemy.orm import sessionmaker
 
 def run_init():
     print("Initializing database...")
+    telemetry = Telemetry('init')
+    return telemetry.finish('ok' if _init(telemetry) else 'error')
 
+def _init(telemetry):
     try:
         mysql_engine = get_mysql_engine()
-        with mysql_engine.connect() as conn:
+        telemetry.watch(mysql_engine, 'mysql')
+        with telemetry.stage('check_mysql'), mysql_engine.connect() as conn:
             print("MySQL connection successful")
     except Exception as e:
         print(f"MySQL connection failed: {e}")
-        return
+        return False
 
     try:
         sqlite_engine = get_sqlite_engine()
-        AnalyticsBase.metadata.create_all(sqlite_engine)
+        telemetry.watch(sqlite_engine, 'sqlite')
+        with telemetry.stage('create_schema'):
+            upgrade_schema(sqlite_engine)
         print("SQLite tables created successfully")
     except Exception as e:
         print(f"SQLite table creation failed: {e}")
-        return
+        return False
 
     try:
-        Session = sessionmaker(bind=sqlite_engine)
-        session = Session()
+        with telemetry.stage('dim_date'):
+            Session = sessionmaker(bind=sqlite_engine)
+            session = Session()
 
-        existing = session.query(DimDate).first()
-        if existing:
-            print("dim_date already exists, skipping")
-        else:
-            print("Generating dim_date...")
-            start = date(2000, 1, 1)
-            end = date(2030, 12, 31)
-            current = start
-            batch = []
-            while current <= end:
-                date_key = int(current.strftime('%Y%m%d'))
-                batch.append(DimDate(
-                    date_key=date_key,
-                    date=current,
-                    year=current.year,
-                    quarter=(current.month - 1) // 3 + 1,
-                    month=current.month,
-                    day_of_month=current.day,
-                    day_of_week=current.weekday(),
-                    is_weekend=1 if current.weekday() >= 5 else 0
-                ))
-                current += timedelta(days=1)
-            session.bulk_save_objects(batch)
-            session.commit()
-            print(f"dim_date generated successfully, {len(batch)} records")
-        session.close()
+            existing = session.query(DimDate).first()
+            if existing:
+                print("dim_date already exists, skipping")
+            else:
+                print("Generating dim_date...")
+                start = date(2000, 1, 1)
+                end = date(2030, 12, 31)
+                current = start
+                batch = []
+                while current <= end:
+                    date_key = int(current.strftime('%Y%m%d'))
+                    batch.append(DimDate(
+                        date_key=date_key,
+                        date=current,
+                        year=current.year,
+                        quarter=(current.month - 1) // 3 + 1,
+                        month=current.month,
+                        day_of_month=current.day,
+                        day_of_week=current.weekday(),
+                        is_weekend=1 if current.weekday() >= 5 else 0
+                    ))
+                    current += timedelta(days=1)
+                session.bulk_save_objects(batch)
+                bump_version(session.connection())
+                session.commit()
+                record_rows('inserted', len(batch))
+                print(f"dim_date generated successfully, {len(batch)} records")
+            session.close()
     except Exception as e:
         print(f"dim_date generation failed: {e}")
-        return
+        return False
 
-    print("Initialization complete!")
\ No newline at end of file
+    print("Initialization complete!")
+    return True
\ No newline at end of file
@@ -0,0 +1,125 @@
+import os
+from array import array
+from datetime import datetime
+from sqlalchemy import select
+from src.models.analytics import DimFilm, DimActor, DimCategory, DimStore, DimCustomer, SyncState
+from src.sync.bulk import upsert
+
+# Dimensions whose natural id -> surrogate key maps are cached between runs.
+DIMENSIONS = {
+    'dim_film': (DimFilm.film_id, DimFilm.film_key),
+    'dim_actor': (DimActor.actor_id, DimActor.actor_key),
+    'dim_category': (DimCategory.category_id, DimCategory.category_key),
+    'dim_store': (DimStore.store_id, DimStore.store_key),
+    'dim_customer': (DimCustomer.customer_id, DimCustomer.customer_key),
+}
+
+# Natural ids below DENSE_IDS always index the array; higher ones only while
+# the array would stay at least a quarter full, and never from ID_LIMIT up.
+DENSE_IDS = 1 << 16
+ID_LIMIT = 1 << 26
+# Largest surrogate key an array('i') slot holds.
+MAX_KEY = (1 << 31) - 1
+
+class KeyMap:
+    # Array indexed by natural id holding the surrogate key (0 = absent):
+    # four bytes per id instead of a dict entry per id. Ids the array cannot
+    # hold cheaply (negative, huge or sparse ones, or keys past MAX_KEY) go in
+    # the sparse dict instead.
+    def __init__(self, id_column, key_column, keys=None, sparse=None):
+        self.columns = (id_column, key_column)
+        self.keys = keys if keys is not None else array('i')
+        self.sparse = sparse if sparse is not None else {}
+        self.count = len(self.keys) - self.keys.count(0)
+        self.dirty = False
+
+    def _dense(self, natural_id, key):
+        if not isinstance(natural_id, int) or not 0 <= natural_id < ID_LIMIT or key > MAX_KEY:
+            return False
+        return natural_id < len(self.keys) or natural_id < max(DENSE_IDS, 4 * self.count)
+
+    def get(self, natural_id, default=None):
+        if natural_id is None:
+            return default
+        if isinstance(natural_id, int) and 0 <= natural_id < len(self.keys) and self.keys[natural_id]:
+            return self.keys[natural_id]
+        return self.sparse.get(natural_id) or default
+
+    def update(self, pairs):
+        for natural_id, key in pairs:
+            self.dirty = True
+            if not self._dense(natural_id, key or 0):
+                if key:
+                    self.sparse[natural_id] = key
+                else:
+                    self.sparse.pop(natural_id, None)
+                continue
+            if natural_id >= len(self.keys):
+                grow = min(max(natural_id + 1, len(self.keys) * 3 // 2), ID_LIMIT) - len(self.keys)
+                self.keys.frombytes(bytes(grow * self.keys.itemsize))
+            self.count += bool(key) - bool(self.keys[natural_id])
+            self.keys[natural_id] = key or 0
+            self.sparse.pop(natural_id, None)
+
+    def __len__(self):
+        return self.count + len(self.sparse)
+
+def _stamp_name(name):
+    return f"keys:{name}"
+
+class KeyCache:
+    def __init__(self, sqlite_engine):
+        database = sqlite_engine.url.database
+        self.path = f"{database}-keys" if database and database != ':memory:' else None
+
+    def _file(self, name):
+        return os.path.join(self.path, f"{name}.bin")
+
+    def _read(self, name):
+        if self.path is None or not os.path.exists(self._file(name)):
+            return None, None
+        try:
+            with open(self._file(name), 'rb') as f:
+                stamp = f.readline().decode('ascii').strip()
+                keys = array('i')
+                keys.frombytes(f.read())
+        except (OSError, ValueError):
+            return None, None
+        return stamp, keys
+
+    def load(self, sqlite_conn, name):
+        id_column, key_column = DIMENSIONS[name]
+        stamp = sqlite_conn.execute(
+            select(SyncState.last_updated).where(SyncState.table_name == _stamp_name(name))
+        ).scalar()
+        file_stamp, keys = self._read(name)
+        if stamp is not None and keys is not None and file_stamp == stamp.isoformat():
+            return KeyMap(id_column, key_column, keys)
+        # Missing or stale cache: rebuild it from the dimension table.
+        key_map = KeyMap(id_column, key_column)
+        key_map.update(sqlite_conn.execute(select(id_column, key_column)))
+        key_map.dirty = True
+        return key_map
+
+    def stamp(self, sqlite_conn, name):
+        # Bump the version inside the transaction that changed the dimension.
+        stamp = datetime.now()
+        upsert(sqlite_conn, SyncState, [[{'table_name': _stamp_name(name), 'last_updated': stamp}]])
+        return stamp
+
+    def save(self, name, key_map, stamp):
+        # Called after commit; a crash before this leaves a stale stamp, which forces a rebuild.
+        key_map.dirty = False
+        if self.path is None:
+            return
+        if key_map.sparse:
+            # Only the array is cached; a map with sparse ids is rebuilt instead.
+            if os.path.exists(self._file(name)):
+                os.remove(self._file(name))
+            return
+        os.makedirs(self.path, exist_ok=True)
+        tmp = self._file(name) + '.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(stamp.isoformat().encode('ascii') + b'\n')
+            f.write(key_map.keys.tobytes())
+        os.replace(tmp, self._file(name))
@@ -0,0 +1,27 @@
+import sys
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is reported in bytes on macOS and in kilobytes elsewhere.
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+class MemoryReport:
+    def __init__(self):
+        self.last = peak_rss_mb()
+        self.stages = {}
+
+    def record(self, stage):
+        peak = peak_rss_mb()
+        if peak is None:
+            return "peak RSS n/a"
+        growth = peak - self.last
+        self.last = peak
+        self.stages[stage] = (peak, growth)
+        return f"peak RSS {peak:.1f} MB, +{growth:.1f} MB"
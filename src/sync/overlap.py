@@ -0,0 +1,141 @@
+import time
+from contextvars import copy_context
+from queue import Queue, Empty, Full
+from threading import Thread, Event, Lock
+from src.sync.profiling import thread_profiled
+from src.sync.telemetry import record_queues
+
+DONE = object()
+# Batches buffered between two steps; a full queue blocks its producer.
+QUEUE_DEPTH = 4
+
+class Channel:
+    # Bounded queue between two pipeline steps. Time the producer spends
+    # blocked on a full queue means the consumer is the bottleneck; time the
+    # consumer spends waiting on an empty one means the producer is.
+    def __init__(self, name, stop, depth=QUEUE_DEPTH):
+        self.name = name
+        self.stop = stop
+        self.queue = Queue(maxsize=depth)
+        self.lock = Lock()
+        self.batches = 0
+        self.depth_total = 0
+        self.max_depth = 0
+        self.put_wait_s = 0.0
+        self.get_wait_s = 0.0
+
+    def put(self, item):
+        start = time.perf_counter()
+        while not self.stop.is_set():
+            try:
+                self.queue.put(item, timeout=0.1)
+                break
+            except Full:
+                pass
+        waited = time.perf_counter() - start
+        depth = self.queue.qsize()
+        with self.lock:
+            self.put_wait_s += waited
+            if item is not DONE:
+                self.batches += 1
+                self.depth_total += depth
+                self.max_depth = max(self.max_depth, depth)
+
+    def get(self):
+        # Once the pipeline is stopped an empty queue reads as finished.
+        start = time.perf_counter()
+        while True:
+            try:
+                item = self.queue.get(timeout=0.1)
+                break
+            except Empty:
+                if self.stop.is_set():
+                    item = DONE
+                    break
+        with self.lock:
+            self.get_wait_s += time.perf_counter() - start
+        return item
+
+    def waited(self, seconds):
+        # Consumer time spent waiting on work handed over through the queue.
+        with self.lock:
+            self.get_wait_s += seconds
+
+    def counters(self):
+        return {
+            'capacity': self.queue.maxsize,
+            'batches': self.batches,
+            'depth_total': self.depth_total,
+            'max_depth': self.max_depth,
+            'producer_stall_s': self.put_wait_s,
+            'consumer_stall_s': self.get_wait_s,
+        }
+
+def spawn(target, *args):
+    # Pipeline threads run in a copy of the caller's context (e.g. its telemetry stage).
+    thread = Thread(target=copy_context().run, args=(thread_profiled(target), *args), daemon=True)
+    thread.start()
+    return thread
+
+def convert(inbox, outbox, function, producers=1):
+    # Transform step: applies function to every item until all producers are
+    # done; a None result is dropped.
+    finished = 0
+    try:
+        while finished < producers:
+            item = inbox.get()
+            if item is DONE:
+                finished += 1
+            elif isinstance(item, Exception):
+                outbox.put(item)
+            else:
+                item = function(item)
+                if item is not None:
+                    outbox.put(item)
+    except Exception as e:
+        outbox.put(e)
+    finally:
+        outbox.put(DONE)
+
+def drain(outbox):
+    while True:
+        item = outbox.get()
+        if item is DONE:
+            return
+        if isinstance(item, Exception):
+            raise item
+        yield item
+
+def overlapped(batches, transform, depth=QUEUE_DEPTH):
+    # Extract (iterating batches), transform and the caller's load run at the
+    # same time, each in its own thread, connected by bounded queues.
+    stop = Event()
+    extracted = Channel('extracted', stop, depth)
+    transformed = Channel('transformed', stop, depth)
+
+    def read():
+        try:
+            for batch in batches:
+                extracted.put(batch)
+                if stop.is_set():
+                    break
+        except Exception as e:
+            extracted.put(e)
+        finally:
+            # DONE is always sent, or the consumer would wait forever.
+            try:
+                close = getattr(batches, 'close', None)
+                if close is not None:
+                    close()
+            except Exception as e:
+                extracted.put(e)
+            extracted.put(DONE)
+
+    threads = [spawn(read), spawn(convert, extracted, transformed, transform)]
+    try:
+        yield from drain(transformed)
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join()
+        record_queues([extracted, transformed])
@@ -0,0 +1,122 @@
+import time
+from concurrent.futures import Future
+from contextlib import contextmanager
+from queue import Queue, Empty
+from threading import Event
+from sqlalchemy import func
+from sqlalchemy.sql.selectable import Join
+from src.config import SYNC_BATCH_SIZE
+from src.sync.extract import stream
+from src.sync.overlap import Channel, QUEUE_DEPTH, DONE, spawn, convert, drain
+from src.sync.telemetry import record_queues
+from src.sync.workers import transform_pool, submit
+
+RANGES_PER_WORKER = 4
+
+def source_tables(query):
+    names = []
+
+    def walk(from_clause):
+        if isinstance(from_clause, Join):
+            walk(from_clause.left)
+            walk(from_clause.right)
+        elif from_clause.name not in names:
+            names.append(from_clause.name)
+
+    for from_clause in query.get_final_froms():
+        walk(from_clause)
+    return names
+
+@contextmanager
+def snapshot_connections(engine, count, tables):
+    conns = [engine.connect() for _ in range(count)]
+    try:
+        if engine.dialect.name == 'mysql':
+            # Block writers while every connection opens its read view, so all
+            # workers see the same point in time (the mydumper approach).
+            with engine.connect() as coordinator:
+                coordinator.exec_driver_sql("LOCK TABLES " + ", ".join(f"`{t}` READ" for t in tables))
+                try:
+                    for conn in conns:
+                        conn.exec_driver_sql("START TRANSACTION WITH CONSISTENT SNAPSHOT")
+                finally:
+                    coordinator.exec_driver_sql("UNLOCK TABLES")
+        yield conns
+    finally:
+        for conn in conns:
+            conn.close()
+
+def split_range(lo, hi, parts):
+    width = max(1, -(-(hi - lo + 1) // parts))
+    return [(start, min(start + width, hi + 1)) for start in range(lo, hi + 1, width)]
+
+def key_ranges(conn, query, key_column, parts, max_span=None):
+    lo, hi = conn.execute(query.with_only_columns(func.min(key_column), func.max(key_column))).one()
+    if lo is None:
+        return []
+    if max_span:
+        parts = max(parts, -(-(hi - lo + 1) // max_span))
+    return split_range(lo, hi, parts)
+
+def partitioned(engine, query, key_column, transform, workers, batch_size=SYNC_BATCH_SIZE, ranges=None, processes=0):
+    # Extract primary-key ranges of query on `workers` snapshot connections,
+    # transform them in a separate thread (or on a pool of `processes`) and
+    # hand them to the single caller (the SQLite writer) as (range, batch)
+    # pairs, followed by (range, None) once a range is exhausted. Reads,
+    # transforms and writes overlap, with bounded queues between them.
+    with snapshot_connections(engine, workers, source_tables(query)) as conns, \
+            transform_pool(transform, processes) as pool:
+        if ranges is None:
+            ranges = key_ranges(conns[0], query, key_column, workers * RANGES_PER_WORKER)
+        todo = Queue()
+        for key_range in ranges:
+            todo.put(key_range)
+        stop = Event()
+        extracted = Channel('extracted', stop, max(QUEUE_DEPTH, workers * 2))
+        # With a pool the queue holds futures, so its size bounds the batches in flight.
+        transformed = Channel('transformed', stop, max(QUEUE_DEPTH, workers * 2, processes * 2))
+
+        def work(conn):
+            try:
+                while not stop.is_set():
+                    try:
+                        start, end = todo.get_nowait()
+                    except Empty:
+                        break
+                    range_query = query.where(key_column >= start, key_column < end)
+                    for batch in stream(conn, range_query, batch_size):
+                        extracted.put(((start, end), batch))
+                        if stop.is_set():
+                            break
+                    else:
+                        extracted.put(((start, end), None))
+            except Exception as e:
+                extracted.put(e)
+            finally:
+                extracted.put(DONE)
+
+        def apply(item):
+            key_range, batch = item
+            if batch is None:
+                return item
+            if pool is not None:
+                return key_range, submit(pool, batch)
+            rows = transform(batch)
+            return (key_range, rows) if len(rows) else None
+
+        threads = [spawn(work, conn) for conn in conns]
+        threads.append(spawn(convert, extracted, transformed, apply, len(conns)))
+        try:
+            for key_range, batch in drain(transformed):
+                if isinstance(batch, Future):
+                    start = time.perf_counter()
+                    batch = batch.result()
+                    transformed.waited(time.perf_counter() - start)
+                    if not len(batch):
+                        continue
+                yield key_range, batch
+        finally:
+            stop.set()
+            for thread in threads:
+                thread.join()
+            record_queues([extracted, transformed])
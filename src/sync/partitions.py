@@ -0,0 +1,62 @@
+from sqlalchemy import select, func
+from src.models.analytics import FactRental, FactPayment, SyncState
+from src.sync.bulk import NATURAL_KEYS, upsert
+from src.sync.state import data_version
+
+# Date key each fact is partitioned on by month (YYYYMM) for export. Every
+# write to a fact marks the months it touched with the data version it ran
+# at, so an export only revisits months marked since it last wrote them.
+PARTITION_KEYS = {
+    FactRental: FactRental.date_key_rented,
+    FactPayment: FactPayment.date_key_paid,
+}
+# Month of facts without a date key.
+NO_DATE = 0
+# Month mark standing for every month of a table (e.g. after a full load).
+ALL = 'all'
+
+def month(key):
+    return func.coalesce(key, 0) // 100
+
+def _mark_name(table_name, month_key):
+    return f"partition:{table_name}:{month_key}"
+
+def months_where(sqlite_conn, fact, *conditions):
+    key = PARTITION_KEYS[fact]
+    return set(sqlite_conn.execute(select(month(key)).distinct().where(*conditions)).scalars())
+
+def months_of(sqlite_conn, fact, ids):
+    return months_where(sqlite_conn, fact, getattr(fact, NATURAL_KEYS[fact][0]).in_(ids))
+
+def all_months(sqlite_conn, fact):
+    return months_where(sqlite_conn, fact)
+
+def mark(sqlite_conn, fact, months):
+    # Written in the same transaction as the change, at the current version.
+    if not months:
+        return
+    version = data_version(sqlite_conn)
+    upsert(sqlite_conn, SyncState, [[{'table_name': _mark_name(fact.__tablename__, m), 'last_id': version}
+                                     for m in months]])
+
+def mark_all(sqlite_conn, fact):
+    mark(sqlite_conn, fact, [ALL])
+
+def marks(sqlite_conn, fact):
+    # Version each month was last changed at, and that of the whole table (or None).
+    prefix = _mark_name(fact.__tablename__, '')
+    changed = dict(sqlite_conn.execute(
+        select(SyncState.table_name, SyncState.last_id).where(SyncState.table_name.startswith(prefix, autoescape=True))
+    ).all())
+    whole = changed.pop(prefix + ALL, None)
+    return whole, {int(name[len(prefix):]): version for name, version in changed.items()}
+
+def tracked(sqlite_conn, fact, ids, write):
+    # Runs write(), which changes the facts with these natural ids, and marks
+    # the months they were in before and after it.
+    if fact not in PARTITION_KEYS or not ids:
+        return write()
+    before = months_of(sqlite_conn, fact, ids)
+    result = write()
+    mark(sqlite_conn, fact, before | months_of(sqlite_conn, fact, ids))
+    return result
@@ -0,0 +1,157 @@
+import cProfile
+import csv
+import io
+import os
+import pstats
+import re
+import sys
+import time
+from contextlib import contextmanager
+from threading import Lock
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from src.sync.telemetry import current_stage
+
+# A statement shape executed this many times one row at a time within a
+# stage is reported as an N+1 pattern.
+N_PLUS_ONE_THRESHOLD = 50
+
+_session = None
+_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))) + os.sep
+
+_LITERALS = [
+    (re.compile(r"'(?:[^']|'')*'"), "?"),
+    (re.compile(r"\b\d+(?:\.\d+)?\b"), "?"),
+    (re.compile(r"%\(\w+\)s|%s|:\w+|\?"), "?"),
+    (re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)"), "(?, ...)"),
+    (re.compile(r"\(\?, \.\.\.\)(?:\s*,\s*\(\?, \.\.\.\))+"), "(?, ...), ..."),
+    (re.compile(r"\s+"), " "),
+]
+
+def normalize(statement):
+    # Statement shape: literals and placeholders become ?, value lists collapse.
+    for pattern, replacement in _LITERALS:
+        statement = pattern.sub(replacement, statement)
+    return statement.strip()
+
+def _caller():
+    # Innermost frame of this project's code that led to the statement.
+    frame = sys._getframe(2)
+    while frame is not None:
+        filename = frame.f_code.co_filename
+        if filename.startswith(_ROOT) and filename != __file__:
+            return f"{os.path.relpath(filename, _ROOT)}:{frame.f_lineno}"
+        frame = frame.f_back
+    return None
+
+class ProfileSession:
+    def __init__(self, threshold=N_PLUS_ONE_THRESHOLD):
+        self.threshold = threshold
+        self.statements = {}
+        self.stats = None
+        self.lock = Lock()
+
+    def before(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('profile_start', []).append(time.perf_counter())
+
+    def after(self, conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info['profile_start'].pop()
+        key = (current_stage() or '-', conn.engine.dialect.name, normalize(statement))
+        with self.lock:
+            entry = self.statements.get(key)
+            if entry is None:
+                entry = self.statements[key] = {'count': 0, 'single': 0, 'total_s': 0.0, 'max_s': 0.0, 'caller': _caller()}
+            entry['count'] += 1
+            entry['single'] += not executemany
+            entry['total_s'] += elapsed
+            entry['max_s'] = max(entry['max_s'], elapsed)
+
+    def merge(self, profile):
+        with self.lock:
+            if self.stats is None:
+                self.stats = pstats.Stats(profile)
+            else:
+                self.stats.add(profile)
+
+    def rows(self):
+        rows = []
+        for (stage, engine, statement), entry in self.statements.items():
+            rows.append({
+                'stage': stage,
+                'engine': engine,
+                'count': entry['count'],
+                'total_ms': round(entry['total_s'] * 1000, 3),
+                'mean_ms': round(entry['total_s'] * 1000 / entry['count'], 3),
+                'max_ms': round(entry['max_s'] * 1000, 3),
+                'n_plus_one': entry['single'] >= self.threshold and statement.startswith(('SELECT', 'UPDATE', 'DELETE', 'INSERT')),
+                'caller': entry['caller'],
+                'statement': statement,
+            })
+        return sorted(rows, key=lambda row: row['total_ms'], reverse=True)
+
+# Before Python 3.12 cProfile only sees the thread that enabled it. From 3.12
+# it runs on sys.monitoring, which covers every thread of the process and
+# admits a single active profiler, so the run's own profiler is relied on.
+PER_THREAD = sys.version_info < (3, 12)
+
+def thread_profiled(run):
+    # Work handed to other threads is profiled there and merged into the session.
+    session = _session
+    if session is None or not PER_THREAD:
+        return run
+
+    def profiled(*args, **kwargs):
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # Another profiling tool is already active.
+            return run(*args, **kwargs)
+        try:
+            return run(*args, **kwargs)
+        finally:
+            profile.disable()
+            session.merge(profile)
+    return profiled
+
+@contextmanager
+def profile_run(name, profile_dir, threshold=N_PLUS_ONE_THRESHOLD):
+    global _session
+    session = ProfileSession(threshold)
+    event.listen(Engine, 'before_cursor_execute', session.before)
+    event.listen(Engine, 'after_cursor_execute', session.after)
+    _session = session
+    profile = cProfile.Profile()
+    profile.enable()
+    try:
+        yield session
+    finally:
+        profile.disable()
+        _session = None
+        event.remove(Engine, 'before_cursor_execute', session.before)
+        event.remove(Engine, 'after_cursor_execute', session.after)
+        session.merge(profile)
+        write_profile(session, name, profile_dir)
+
+def write_profile(session, name, profile_dir):
+    os.makedirs(profile_dir, exist_ok=True)
+    base = os.path.join(profile_dir, name)
+    session.stats.dump_stats(f"{base}.prof")
+    text = io.StringIO()
+    pstats.Stats(f"{base}.prof", stream=text).sort_stats('cumulative').print_stats(40)
+    with open(f"{base}-functions.txt", 'w') as f:
+        f.write(text.getvalue())
+
+    rows = session.rows()
+    with open(f"{base}-statements.csv", 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=['stage', 'engine', 'count', 'total_ms', 'mean_ms', 'max_ms',
+                                               'n_plus_one', 'caller', 'statement'])
+        writer.writeheader()
+        writer.writerows(rows)
+
+    print(f"Profile written to {base}.prof, {base}-functions.txt and {base}-statements.csv")
+    for row in rows[:5]:
+        print(f"  {row['total_ms']:.1f} ms  {row['count']}x  [{row['stage']}] {row['statement'][:100]}")
+    for row in rows:
+        if row['n_plus_one']:
+            print(f"N+1: {row['count']}x [{row['stage']}] at {row['caller']}: {row['statement'][:100]}")
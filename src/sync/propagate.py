@@ -0,0 +1,40 @@
+from sqlalchemy import select, or_
+from src.models.sakila import Country, City, Address, Customer, Store
+from src.models.analytics import DimCustomer, DimStore
+from src.sync.extract import customer_query, store_query
+from src.sync.transform import customer_row, store_row
+
+# Foreign-key chain the city/country columns of dim_customer and dim_store are
+# denormalized from, parent first: (source table, key, column referencing the parent).
+LOCATION_CHAIN = [
+    ('country', Country.country_id, None),
+    ('city', City.city_id, City.country_id),
+    ('address', Address.address_id, Address.city_id),
+]
+LOCATION_TABLES = [table_name for table_name, _, _ in LOCATION_CHAIN]
+
+# Dimensions carrying location columns: (model, source query, natural id, address reference, transform).
+LOCATED = {
+    'dim_customer': (DimCustomer, customer_query, Customer.customer_id, Customer.address_id, customer_row),
+    'dim_store': (DimStore, store_query, Store.store_id, Store.address_id, store_row),
+}
+
+def changed_addresses(mysql_conn, changed):
+    # changed maps each chain table to a condition selecting its changed rows
+    # (or None). Walk down the chain: a row is affected when it changed itself
+    # or references an affected parent, so only the addresses under a renamed
+    # city or country are read, never the whole lookup tables.
+    affected = []
+    for table_name, key, parent in LOCATION_CHAIN:
+        conditions = [condition for condition in [changed.get(table_name)] if condition is not None]
+        if affected:
+            conditions.append(parent.in_(affected))
+        affected = mysql_conn.execute(select(key).where(or_(*conditions)).order_by(key)).scalars().all() if conditions else []
+    return affected
+
+def relocated(mysql_conn, name, address_ids, keys):
+    # Re-derived rows of the dimension that live at these addresses. Rows not
+    # in the warehouse yet are left to the dimension's own watermark.
+    _, query, natural_id, address_id, transform = LOCATED[name]
+    rows = mysql_conn.execute(query().where(address_id.in_(address_ids)))
+    return [transform(row) for row in rows if keys.get(getattr(row, natural_id.key))]
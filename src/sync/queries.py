@@ -0,0 +1,218 @@
+import hashlib
+import json
+import os
+from collections import namedtuple, OrderedDict
+from threading import Lock
+from sqlalchemy import select, func
+from sqlalchemy.exc import SQLAlchemyError
+from src.config import get_sqlite_engine, QUERY_CACHE_SIZE
+from src.models.analytics import (DimDate, DimFilm, DimCategory, DimStore, DimCustomer, BridgeFilmCategory, FactRental,
+                                  AggDailyStoreRevenue, AggFilmRentalsMonthly, AggCustomerLtv)
+from src.sync.state import data_version
+
+# Named analytic query: parameters (name -> (type, default)) and a builder
+# taking them as keyword arguments.
+Query = namedtuple('Query', ['description', 'params', 'build'])
+QueryResult = namedtuple('QueryResult', ['columns', 'rows', 'version', 'cached'])
+
+def _store_revenue(start, end, store_id):
+    query = (select(AggDailyStoreRevenue.date_key, DimStore.store_id, DimStore.city, AggDailyStoreRevenue.payments,
+                    (AggDailyStoreRevenue.revenue_cents / 100.0).label('revenue'))
+             .join(DimStore, AggDailyStoreRevenue.store_key == DimStore.store_key)
+             .order_by(AggDailyStoreRevenue.date_key, DimStore.store_id))
+    if start is not None:
+        query = query.where(AggDailyStoreRevenue.date_key >= start)
+    if end is not None:
+        query = query.where(AggDailyStoreRevenue.date_key <= end)
+    if store_id is not None:
+        query = query.where(DimStore.store_id == store_id)
+    return query
+
+def _top_films(month, limit):
+    rentals = func.sum(AggFilmRentalsMonthly.rentals).label('rentals')
+    query = (select(DimFilm.film_id, DimFilm.title, rentals)
+             .join(DimFilm, AggFilmRentalsMonthly.film_key == DimFilm.film_key)
+             .group_by(DimFilm.film_key)
+             .order_by(rentals.desc(), DimFilm.film_id)
+             .limit(limit))
+    if month is not None:
+        query = query.where(AggFilmRentalsMonthly.month_key == month)
+    return query
+
+def _category_rentals(month):
+    rentals = func.sum(AggFilmRentalsMonthly.rentals).label('rentals')
+    query = (select(DimCategory.name, rentals)
+             .select_from(AggFilmRentalsMonthly)
+             .join(BridgeFilmCategory, AggFilmRentalsMonthly.film_key == BridgeFilmCategory.film_key)
+             .join(DimCategory, BridgeFilmCategory.category_key == DimCategory.category_key)
+             .group_by(DimCategory.category_key)
+             .order_by(rentals.desc(), DimCategory.name))
+    if month is not None:
+        query = query.where(AggFilmRentalsMonthly.month_key == month)
+    return query
+
+def _customer_ltv(limit):
+    return (select(DimCustomer.customer_id, DimCustomer.first_name, DimCustomer.last_name,
+                   AggCustomerLtv.payments, (AggCustomerLtv.revenue_cents / 100.0).label('revenue'))
+            .join(DimCustomer, AggCustomerLtv.customer_key == DimCustomer.customer_key)
+            .order_by(AggCustomerLtv.revenue_cents.desc(), DimCustomer.customer_id)
+            .limit(limit))
+
+def _rentals_by_weekday(year):
+    query = (select(DimDate.day_of_week, func.count().label('rentals'))
+             .select_from(FactRental)
+             .join(DimDate, FactRental.date_key_rented == DimDate.date_key)
+             .group_by(DimDate.day_of_week)
+             .order_by(DimDate.day_of_week))
+    if year is not None:
+        query = query.where(DimDate.year == year)
+    return query
+
+QUERIES = {
+    'store_revenue': Query("Payments and revenue per store per day (date keys are YYYYMMDD)",
+                           {'start': (int, None), 'end': (int, None), 'store_id': (int, None)}, _store_revenue),
+    'top_films': Query("Most rented films, overall or in one month (YYYYMM)",
+                       {'month': (int, None), 'limit': (int, 10)}, _top_films),
+    'category_rentals': Query("Rentals per film category, overall or in one month (YYYYMM)",
+                              {'month': (int, None)}, _category_rentals),
+    'customer_ltv': Query("Customers with the highest lifetime revenue",
+                          {'limit': (int, 10)}, _customer_ltv),
+    'rentals_by_weekday': Query("Rentals per day of week (0 = Monday), overall or in one year",
+                                {'year': (int, None)}, _rentals_by_weekday),
+}
+
+def bind_params(name, params):
+    # Defaults filled in and values (e.g. strings from the command line) converted.
+    if name not in QUERIES:
+        raise ValueError(f"Unknown query {name}; available: {', '.join(QUERIES)}")
+    declared = QUERIES[name].params
+    unknown = set(params) - set(declared)
+    if unknown:
+        raise ValueError(f"Query {name} has no parameter(s) {', '.join(sorted(unknown))}")
+    return {param: kind(params[param]) if params.get(param) is not None else default
+            for param, (kind, default) in declared.items()}
+
+class QueryCache:
+    # LRU of query results keyed on (query, parameters, data version), kept in
+    # memory and, with a path, as one JSON file per result. A sync bumps the
+    # version, so results of earlier versions are never hit again and age out.
+    def __init__(self, maxsize=QUERY_CACHE_SIZE, path=None):
+        self.maxsize = maxsize
+        self.path = path
+        self.entries = OrderedDict()
+        self.lock = Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _file(self, key):
+        return os.path.join(self.path, hashlib.sha1(json.dumps(key).encode()).hexdigest() + '.json')
+
+    def _remember(self, key, value):
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def get(self, key):
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key]
+        value = self._read(key) if self.path else None
+        with self.lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        if value is not None:
+            self._remember(key, value)
+        return value
+
+    def put(self, key, value):
+        self._remember(key, value)
+        if self.path:
+            self._write(key, value)
+
+    def _read(self, key):
+        file = self._file(key)
+        try:
+            with open(file) as f:
+                stored = json.load(f)
+            if stored.get('key') != json.loads(json.dumps(key)):
+                return None
+            # Touched so the on-disk LRU sees it as recently used.
+            os.utime(file)
+        except (OSError, ValueError):
+            return None
+        return stored['columns'], [tuple(row) for row in stored['rows']]
+
+    def _write(self, key, value):
+        os.makedirs(self.path, exist_ok=True)
+        columns, rows = value
+        file = self._file(key)
+        with open(file + '.tmp', 'w') as f:
+            json.dump({'key': key, 'columns': columns, 'rows': rows}, f, default=str)
+        os.replace(file + '.tmp', file)
+        files = sorted((entry for entry in os.scandir(self.path) if entry.name.endswith('.json')),
+                       key=lambda entry: entry.stat().st_mtime)
+        for entry in files[:max(0, len(files) - self.maxsize)]:
+            try:
+                os.remove(entry.path)
+            except OSError:
+                pass
+
+def disk_cache_path(sqlite_engine):
+    # Next to the warehouse file, like the key cache.
+    database = sqlite_engine.url.database
+    return f"{database}-queries" if database and database != ':memory:' else None
+
+def run_query(sqlite_engine, name, params=None, cache=None):
+    params = bind_params(name, params or {})
+    with sqlite_engine.connect() as conn:
+        # The version is read before the data: a sync writing in between
+        # bumps it, so the result cannot be served for the newer data.
+        version = data_version(conn)
+        key = (name, tuple(sorted(params.items())), version)
+        value = cache.get(key) if cache is not None else None
+        if value is not None:
+            return QueryResult(value[0], value[1], version, True)
+        result = conn.execute(QUERIES[name].build(**params))
+        columns = list(result.keys())
+        rows = [tuple(row) for row in result]
+    if cache is not None:
+        cache.put(key, (columns, rows))
+    return QueryResult(columns, rows, version, False)
+
+def _table(columns, rows):
+    cells = [list(map(str, columns))] + [["" if value is None else str(value) for value in row] for row in rows]
+    widths = [max(len(row[i]) for row in cells) for i in range(len(columns))]
+    return "\n".join("  ".join(value.ljust(width) for value, width in zip(row, widths)).rstrip() for row in cells)
+
+def run_named_query(name=None, params=(), as_json=False, use_cache=True):
+    if name is None:
+        for query_name, query in QUERIES.items():
+            declared = ", ".join(f"{param}={default}" for param, (kind, default) in query.params.items())
+            print(f"{query_name}({declared}): {query.description}")
+        return None
+    sqlite_engine = get_sqlite_engine()
+    cache = QueryCache(path=disk_cache_path(sqlite_engine)) if use_cache else None
+    values = {}
+    for param in params:
+        if '=' not in param:
+            raise ValueError(f"Parameter {param} is not NAME=VALUE")
+        param_name, value = param.split('=', 1)
+        values[param_name] = value
+    try:
+        result = run_query(sqlite_engine, name, values, cache)
+    except SQLAlchemyError as e:
+        # e.g. a warehouse whose aggregates no sync has built yet.
+        print(f"Query {name} failed: {e.orig if getattr(e, 'orig', None) is not None else e}")
+        return None
+    if as_json:
+        print(json.dumps([dict(zip(result.columns, row)) for row in result.rows], indent=2, default=str))
+    else:
+        print(_table(result.columns, result.rows))
+        print(f"({len(result.rows)} rows, data version {result.version}{', cached' if result.cached else ''})")
+    return result
@@ -0,0 +1,207 @@
+import zlib
+from collections import namedtuple
+from datetime import datetime, time, timedelta
+from functools import reduce
+from sqlalchemy import select, func, cast, case, literal_column, String, Integer
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.functions import FunctionElement
+from src.models.analytics import FactRental, FactPayment, DimFilm, DimStore, DimCustomer
+from src.sync.extract import film_query, customer_query, rental_query, payment_query
+
+BUCKETS = 64
+LEAF_SIZE = 64
+
+# Portable SQL for the values the transform derives, so both sides hash the
+# same representation of a row.
+
+class date_key(FunctionElement):
+    type = Integer()
+    inherit_cache = True
+
+@compiles(date_key, 'mysql')
+def _date_key_mysql(element, compiler, **kw):
+    value, = element.clauses
+    return compiler.process(cast(func.date_format(value, '%Y%m%d'), Integer), **kw)
+
+@compiles(date_key, 'sqlite')
+def _date_key_sqlite(element, compiler, **kw):
+    value, = element.clauses
+    return compiler.process(cast(func.strftime('%Y%m%d', value), Integer), **kw)
+
+class day_span(FunctionElement):
+    type = Integer()
+    inherit_cache = True
+
+@compiles(day_span, 'mysql')
+def _day_span_mysql(element, compiler, **kw):
+    start, end = element.clauses
+    seconds = cast(func.timestampdiff(literal_column('SECOND'), start, end), Integer)
+    return compiler.process(seconds // 86400, **kw)
+
+@compiles(day_span, 'sqlite')
+def _day_span_sqlite(element, compiler, **kw):
+    start, end = element.clauses
+    seconds = cast(func.strftime('%s', end), Integer) - cast(func.strftime('%s', start), Integer)
+    # Integer division truncates; shift negative spans so they round down like timedelta.days.
+    return compiler.process((seconds - case((seconds < 0, 86399), else_=0)) // 86400, **kw)
+
+def cents(value):
+    return cast(func.round(value * 100), Integer)
+
+def row_hash(columns):
+    text = [func.coalesce(cast(column, String), '') for column in columns]
+    return func.crc32(reduce(lambda left, right: left.concat('|').concat(right), text))
+
+def _crc32(text):
+    return None if text is None else zlib.crc32(text.encode('utf-8'))
+
+def enable_digests(conn):
+    # MySQL has CRC32() built in; SQLite gets the same function from zlib.
+    if conn.dialect.name == 'sqlite':
+        conn.connection.driver_connection.create_function('crc32', 1, _crc32, deterministic=True)
+
+# One side of a check: the query supplying the rows, its id column, the
+# hashed columns and the filter for the --days window (given its start).
+Side = namedtuple('Side', ['query', 'id', 'columns', 'window'])
+Check = namedtuple('Check', ['name', 'source', 'warehouse'])
+
+def _since(column):
+    return lambda start: column >= start
+
+def _since_key(column):
+    return lambda start: column >= start.year * 10000 + start.month * 100 + start.day
+
+def _source(query, id_name, columns, window, derive=None):
+    c = query.selected_columns
+    values = [c[name] for name in columns] if derive is None else derive(c)
+    return Side(query, c[id_name], values, _since(c[window]))
+
+def _rental_check():
+    warehouse = (
+        select(FactRental.rental_id)
+        .outerjoin(DimFilm, FactRental.film_key == DimFilm.film_key)
+        .outerjoin(DimStore, FactRental.store_key == DimStore.store_key)
+        .outerjoin(DimCustomer, FactRental.customer_key == DimCustomer.customer_key)
+    )
+    return Check(
+        'rental',
+        _source(rental_query(), 'rental_id', None, 'rental_date', lambda c: [
+            date_key(c.rental_date), date_key(c.return_date), c.film_id, c.store_id, c.customer_id,
+            c.staff_id, day_span(c.rental_date, c.return_date)
+        ]),
+        Side(warehouse, FactRental.rental_id, [
+            FactRental.date_key_rented, FactRental.date_key_returned, DimFilm.film_id, DimStore.store_id,
+            DimCustomer.customer_id, FactRental.staff_id, FactRental.rental_duration_days
+        ], _since_key(FactRental.date_key_rented))
+    )
+
+def _payment_check():
+    warehouse = (
+        select(FactPayment.payment_id)
+        .outerjoin(DimStore, FactPayment.store_key == DimStore.store_key)
+        .outerjoin(DimCustomer, FactPayment.customer_key == DimCustomer.customer_key)
+    )
+    return Check(
+        'payment',
+        _source(payment_query(), 'payment_id', None, 'payment_date', lambda c: [
+            date_key(c.payment_date), c.customer_id, c.store_id, c.staff_id, cents(c.amount)
+        ]),
+        Side(warehouse, FactPayment.payment_id, [
+            FactPayment.date_key_paid, DimCustomer.customer_id, DimStore.store_id, FactPayment.staff_id,
+            cents(FactPayment.amount)
+        ], _since_key(FactPayment.date_key_paid))
+    )
+
+def _customer_check():
+    columns = ['first_name', 'last_name', 'active', 'city', 'country']
+    return Check(
+        'customer',
+        _source(customer_query(), 'customer_id', columns, 'last_update'),
+        Side(select(DimCustomer.customer_id), DimCustomer.customer_id,
+             [getattr(DimCustomer, name) for name in columns], _since(DimCustomer.last_update))
+    )
+
+def _film_check():
+    columns = ['title', 'rating', 'length', 'language', 'release_year']
+    return Check(
+        'film',
+        _source(film_query(), 'film_id', columns, 'last_update'),
+        Side(select(DimFilm.film_id), DimFilm.film_id,
+             [getattr(DimFilm, name) for name in columns], _since(DimFilm.last_update))
+    )
+
+def reconcile_checks():
+    return [_rental_check(), _payment_check(), _customer_check(), _film_check()]
+
+class _Scope:
+    def __init__(self, conn, side, since):
+        self.conn = conn
+        self.side = side
+        self.hash = row_hash(side.columns)
+        self.since = since
+        self.queries = 0
+
+    def _query(self, *columns):
+        query = self.side.query.with_only_columns(*columns)
+        if self.since is not None:
+            query = query.where(self.side.window(self.since))
+        return query
+
+    def _run(self, query):
+        self.queries += 1
+        return self.conn.execute(query)
+
+    def bounds(self):
+        return tuple(self._run(self._query(func.min(self.side.id), func.max(self.side.id))).one())
+
+    def digests(self, start, end, width):
+        id_column = self.side.id
+        bucket = ((id_column - start) // width).label('bucket')
+        query = (
+            self._query(bucket, func.count(), func.sum(self.hash))
+            .where(id_column >= start, id_column < end)
+            .group_by(bucket)
+        )
+        return {int(b): (count, int(total or 0)) for b, count, total in self._run(query)}
+
+    def hashes(self, start, end):
+        id_column = self.side.id
+        query = self._query(id_column, self.hash).where(id_column >= start, id_column < end)
+        return dict(self._run(query).all())
+
+def reconcile(mysql_conn, sqlite_conn, check, days=None, buckets=BUCKETS, leaf_size=LEAF_SIZE):
+    # Compare per-range (count, sum of row hashes) digests and only descend
+    # into ranges whose digests differ; ranges of leaf_size ids or fewer are
+    # compared row by row to name the mismatched ids.
+    since = None
+    if days:
+        since = datetime.combine(datetime.now().date() - timedelta(days=days), time())
+    enable_digests(mysql_conn)
+    enable_digests(sqlite_conn)
+    source = _Scope(mysql_conn, check.source, since)
+    warehouse = _Scope(sqlite_conn, check.warehouse, since)
+    result = {'missing': [], 'extra': [], 'changed': []}
+
+    bounds = [b for b in source.bounds() + warehouse.bounds() if b is not None]
+    pending = [(min(bounds), max(bounds) + 1)] if bounds else []
+    while pending:
+        start, end = pending.pop()
+        if end - start <= leaf_size:
+            expected = source.hashes(start, end)
+            actual = warehouse.hashes(start, end)
+            result['missing'] += sorted(expected.keys() - actual.keys())
+            result['extra'] += sorted(actual.keys() - expected.keys())
+            result['changed'] += sorted(i for i in expected.keys() & actual.keys() if expected[i] != actual[i])
+            continue
+        width = -(-(end - start) // buckets)
+        expected = source.digests(start, end, width)
+        actual = warehouse.digests(start, end, width)
+        for bucket in sorted(expected.keys() | actual.keys(), reverse=True):
+            if expected.get(bucket) != actual.get(bucket):
+                low = start + bucket * width
+                pending.append((low, min(low + width, end)))
+
+    for ids in result.values():
+        ids.sort()
+    result['queries'] = source.queries + warehouse.queries
+    return result
@@ -0,0 +1,50 @@
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from src.sync.profiling import thread_profiled
+
+class Stage:
+    def __init__(self, name, run, deps=()):
+        self.name = name
+        self.run = run
+        self.deps = list(deps)
+
+def run_stages(stages, workers=1, telemetry=None):
+    # Each stage is submitted as soon as every stage it depends on has finished;
+    # its run(results) callable receives the return values of finished stages by name.
+    # With telemetry, every stage is timed and its rows and statements counted.
+    names = {stage.name for stage in stages}
+    for stage in stages:
+        missing = [dep for dep in stage.deps if dep not in names]
+        if missing:
+            raise ValueError(f"Stage {stage.name} depends on unknown stage(s): {', '.join(missing)}")
+
+    results = {}
+    pending = list(stages)
+    running = {}
+    error = None
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        while pending or running:
+            if error is None:
+                for stage in list(pending):
+                    if len(running) >= max(1, workers):
+                        break
+                    if all(dep in results for dep in stage.deps):
+                        pending.remove(stage)
+                        run = stage.run if telemetry is None else telemetry.wrap(stage.name, stage.run)
+                        running[pool.submit(thread_profiled(run), results)] = stage
+            if not running:
+                if error is None:
+                    raise ValueError(f"Stage dependency cycle among: {', '.join(s.name for s in pending)}")
+                break
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                stage = running.pop(future)
+                try:
+                    results[stage.name] = future.result()
+                except Exception as e:
+                    if error is None:
+                        error = e
+
+    if error is not None:
+        raise error
+    return results
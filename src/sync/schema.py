@@ -0,0 +1,16 @@
+from sqlalchemy import inspect
+from src.models.analytics import AnalyticsBase
+
+def upgrade_schema(engine):
+    # create_all only adds missing tables, so columns added to existing models
+    # are appended with ALTER TABLE (all such columns are nullable).
+    AnalyticsBase.metadata.create_all(engine)
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        for table in AnalyticsBase.metadata.sorted_tables:
+            existing = {column['name'] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in existing:
+                    conn.exec_driver_sql(
+                        f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column.type.compile(engine.dialect)}"
+                    )
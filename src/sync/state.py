@@ -0,0 +1,94 @@
+from datetime import datetime
+from sqlalchemy import select, or_, and_
+from src.models.sakila import Film, Actor, Category, Store, Customer, Rental, Payment, FilmActor, FilmCategory, Address, City, Country
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from src.models.analytics import SyncState
+from src.sync.bulk import upsert
+
+EPOCH = datetime(2000, 1, 1)
+# sync_state row counting writes to the warehouse (in last_id).
+DATA_VERSION = 'data_version'
+
+# (last_update, primary key) of each source table: the watermark is the
+# largest such tuple already loaded, so it comes from the source's clock.
+WATERMARKS = {
+    'film': (Film.last_update, Film.film_id),
+    'actor': (Actor.last_update, Actor.actor_id),
+    'category': (Category.last_update, Category.category_id),
+    'store': (Store.last_update, Store.store_id),
+    'customer': (Customer.last_update, Customer.customer_id),
+    'rental': (Rental.last_update, Rental.rental_id),
+    'payment': (Payment.last_update, Payment.payment_id),
+    # Link tables have composite keys; bridges only use the last_update part.
+    'film_actor': (FilmActor.last_update, FilmActor.film_id),
+    'film_category': (FilmCategory.last_update, FilmCategory.film_id),
+    'address': (Address.last_update, Address.address_id),
+    'city': (City.last_update, City.city_id),
+    'country': (Country.last_update, Country.country_id),
+}
+
+def get_watermark(sqlite_conn, table_name):
+    row = sqlite_conn.execute(
+        select(SyncState.last_updated, SyncState.last_id).where(SyncState.table_name == table_name)
+    ).first()
+    if row is None or row.last_updated is None:
+        return EPOCH, 0
+    return row.last_updated, row.last_id or 0
+
+def set_watermarks(sqlite_conn, marks):
+    upsert(sqlite_conn, SyncState, [[
+        {'table_name': table_name, 'last_updated': last_updated, 'last_id': last_id}
+        for table_name, (last_updated, last_id) in marks.items()
+    ]])
+
+def get_position(sqlite_conn, name):
+    return sqlite_conn.execute(select(SyncState.position).where(SyncState.table_name == name)).scalar()
+
+def set_position(sqlite_conn, name, position):
+    upsert(sqlite_conn, SyncState, [[{'table_name': name, 'last_updated': datetime.now(), 'position': str(position)}]])
+
+def data_version(sqlite_conn):
+    return sqlite_conn.execute(select(SyncState.last_id).where(SyncState.table_name == DATA_VERSION)).scalar() or 0
+
+def bump_version(sqlite_conn):
+    # Syncs bump the version before they write and again once they are done,
+    # so no result read at an earlier version matches the data afterwards.
+    stmt = sqlite_insert(SyncState.__table__).values(table_name=DATA_VERSION, last_id=1, last_updated=datetime.now())
+    sqlite_conn.execute(stmt.on_conflict_do_update(
+        index_elements=['table_name'],
+        set_={'last_id': SyncState.last_id + 1, 'last_updated': stmt.excluded.last_updated}
+    ))
+
+def source_watermark(mysql_conn, table_name):
+    last_update, key = WATERMARKS[table_name]
+    row = mysql_conn.execute(select(last_update, key).order_by(last_update.desc(), key.desc()).limit(1)).first()
+    return (row[0], row[1]) if row else (EPOCH, 0)
+
+def changed_since(table_name, mark):
+    # Rows after mark in (last_update, key) order.
+    last_update, key = WATERMARKS[table_name]
+    mark_update, mark_id = mark
+    return or_(last_update > mark_update, and_(last_update == mark_update, key > mark_id))
+
+def after_watermark(query, table_name, mark, limit):
+    # Keyset page: the next `limit` rows after mark in (last_update, key) order.
+    last_update, key = WATERMARKS[table_name]
+    return (
+        query.add_columns(last_update.label('watermark_update'), key.label('watermark_id'))
+        .where(changed_since(table_name, mark))
+        .order_by(last_update, key)
+        .limit(limit)
+    )
+
+def watermark_pages(mysql_conn, query, table_name, mark, limit):
+    # Keyset pagination over (last_update, id): the next page only depends on
+    # the last row of the previous one, so pages can be read ahead of writes.
+    while True:
+        page = mysql_conn.execute(after_watermark(query, table_name, mark, limit)).all()
+        mysql_conn.rollback()
+        if not page:
+            return
+        mark = (page[-1].watermark_update, page[-1].watermark_id)
+        yield page
+        if len(page) < limit:
+            return
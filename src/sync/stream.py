@@ -0,0 +1,241 @@
+import json
+import os
+import time
+from collections import defaultdict
+from functools import partial
+from sqlalchemy import select
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import DBAPIError
+from src.config import get_mysql_engine, get_sqlite_engine, SOURCE_URL, SYNC_BATCH_SIZE
+from src.models.sakila import Actor, Category
+from src.models.analytics import DimFilm, DimActor, DimCategory, DimStore, DimCustomer, FactRental, FactPayment
+from src.sync.aggregates import maintained, natural_ids, ensure
+from src.sync.bridges import diff_links, apply_links
+from src.sync.bulk import upsert, batched
+from src.sync.deletes import remove
+from src.sync.extract import film_query, store_query, customer_query, rental_query, payment_query
+from src.sync.keycache import KeyCache, DIMENSIONS
+from src.sync.propagate import LOCATION_CHAIN, LOCATED, changed_addresses, relocated
+from src.sync.schema import upgrade_schema
+from src.sync.state import get_position, set_position, bump_version
+from src.sync.telemetry import Telemetry, record_rows
+from src.sync.transform import film_row, actor_row, category_row, store_row, customer_row, per_row, rental_columns, payment_columns
+
+# Row events only say which keys changed: the current rows are re-read by key
+# through the regular source queries and transforms, so several events on one
+# row cost one lookup and a key that is gone on re-read was deleted.
+# Source table -> (warehouse table, model, source query, key name, transform).
+TABLES = {
+    'film': ('dim_film', DimFilm, film_query, 'film_id', lambda maps: per_row(film_row)),
+    'actor': ('dim_actor', DimActor, lambda: select(Actor.__table__), 'actor_id', lambda maps: per_row(actor_row)),
+    'category': ('dim_category', DimCategory, lambda: select(Category.__table__), 'category_id',
+                 lambda maps: per_row(category_row)),
+    'store': ('dim_store', DimStore, store_query, 'store_id', lambda maps: per_row(store_row)),
+    'customer': ('dim_customer', DimCustomer, customer_query, 'customer_id', lambda maps: per_row(customer_row)),
+    'rental': ('fact_rental', FactRental, rental_query, 'rental_id',
+               lambda maps: partial(rental_columns, film_map=maps['dim_film'], store_map=maps['dim_store'],
+                                    customer_map=maps['dim_customer'])),
+    'payment': ('fact_payment', FactPayment, payment_query, 'payment_id',
+                lambda maps: partial(payment_columns, store_map=maps['dim_store'], customer_map=maps['dim_customer'])),
+}
+# Link tables re-diff the bridge rows of their film.
+BRIDGE_TABLES = {'film_actor': ('bridge_film_actor', 'dim_actor'), 'film_category': ('bridge_film_category', 'dim_category')}
+LOCATION_KEYS = {table_name: key for table_name, key, _ in LOCATION_CHAIN}
+# Server id the binlog client registers with; must differ from every replica's.
+STREAM_SERVER_ID = 4379
+
+def event_key(event):
+    # Key of the row an event touched, in terms of what gets re-read.
+    table, row = event['table'], event['row']
+    if table in TABLES:
+        return row[TABLES[table][3]]
+    if table in BRIDGE_TABLES:
+        return row['film_id']
+    if table in LOCATION_KEYS:
+        return row[LOCATION_KEYS[table].key]
+    return None
+
+def file_events(path, offset=0, follow=False, poll=1.0):
+    # JSONL stand-in for the binlog, one {"table", "type", "row"} event per
+    # line; the byte offset after a line is its position. A line still being
+    # written (no newline yet) is only read once it is complete.
+    offset = int(offset)
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        while True:
+            line = f.readline()
+            if not line.endswith(b'\n') and (follow or not line):
+                if not follow:
+                    return
+                f.seek(offset)
+                yield None
+                time.sleep(poll)
+                continue
+            offset = f.tell()
+            if line.strip():
+                yield offset, [json.loads(line)]
+
+def master_position(mysql_conn):
+    # Current end of the server's binlog; MySQL 8.4 renamed the statement.
+    for statement in ("SHOW BINARY LOG STATUS", "SHOW MASTER STATUS"):
+        try:
+            row = mysql_conn.exec_driver_sql(statement).first()
+        except DBAPIError:
+            mysql_conn.rollback()
+            continue
+        if row is None:
+            break
+        return f"{row[0]}:{row[1]}"
+    raise RuntimeError("The server has no binlog; binlog streaming needs log_bin and binlog_format=ROW")
+
+def binlog_events(url, position, follow=False, poll=1.0):
+    # Row events from the MySQL binlog (binlog_format=ROW) after position
+    # "<log file>:<offset>"; each comes with the position after it. Following
+    # blocks on one connection, with a server heartbeat every poll seconds
+    # passed on as None, so an idle stream still flushes its micro-batch.
+    # Needs the mysql-replication package.
+    try:
+        from pymysqlreplication import BinLogStreamReader
+        from pymysqlreplication.event import HeartbeatLogEvent
+        from pymysqlreplication.row_event import WriteRowsEvent, UpdateRowsEvent, DeleteRowsEvent
+    except ImportError:
+        raise RuntimeError("Binlog streaming needs the mysql-replication package (pip install mysql-replication)")
+    url = make_url(url)
+    settings = {'host': url.host, 'port': url.port or 3306, 'user': url.username, 'passwd': url.password or ''}
+    types = {WriteRowsEvent: 'insert', UpdateRowsEvent: 'update', DeleteRowsEvent: 'delete'}
+    log_file, log_pos = position.rsplit(':', 1)
+    reader = BinLogStreamReader(
+        connection_settings=settings, server_id=STREAM_SERVER_ID, only_schemas=[url.database],
+        only_events=[*types, HeartbeatLogEvent], resume_stream=True, log_file=log_file, log_pos=int(log_pos),
+        blocking=follow, slave_heartbeat=poll if follow else None
+    )
+    try:
+        for event in reader:
+            if isinstance(event, HeartbeatLogEvent):
+                yield None
+                continue
+            yield f"{reader.log_file}:{reader.log_pos}", [
+                {'table': event.table, 'type': types[type(event)], 'row': row.get('after_values', row.get('values'))}
+                for row in event.rows
+            ]
+    finally:
+        reader.close()
+
+def apply_events(mysql_conn, sqlite_conn, touched, maps, batch_size=SYNC_BATCH_SIZE):
+    # touched maps source tables to the keys their events named. Dimensions go
+    # first so facts resolve keys of rows created in the same micro-batch.
+    counts = {'upserted': 0, 'deleted': 0, 'linked': 0, 'unlinked': 0}
+    gone = {}
+    for table_name, (name, model, query, key_name, make_transform) in TABLES.items():
+        for ids in batched(sorted(touched.get(table_name, ())), batch_size):
+            key = query().selected_columns[key_name]
+            rows = mysql_conn.execute(query().where(key.in_(ids))).all()
+            gone.setdefault(name, []).extend(sorted(set(ids) - {getattr(row, key_name) for row in rows}))
+            batch = make_transform(maps)(rows) if rows else []
+            if len(batch):
+                counts['upserted'] += maintained(sqlite_conn, model, natural_ids(model, batch),
+                                                 lambda: upsert(sqlite_conn, model, [batch], maps.get(name)))
+
+    for table_name, (name, dimension) in BRIDGE_TABLES.items():
+        for films in batched(sorted(touched.get(table_name, ())), batch_size):
+            added, removed = diff_links(mysql_conn, sqlite_conn, name, films, maps['dim_film'], maps[dimension])
+            linked, unlinked = apply_links(sqlite_conn, name, added, removed)
+            counts['linked'] += linked
+            counts['unlinked'] += unlinked
+
+    address_ids = changed_addresses(mysql_conn, {
+        table_name: key.in_(sorted(touched[table_name])) for table_name, key in LOCATION_KEYS.items() if touched.get(table_name)
+    })
+    for name in LOCATED:
+        for addresses in batched(address_ids, batch_size):
+            rows = relocated(mysql_conn, name, addresses, maps[name])
+            if rows:
+                counts['upserted'] += upsert(sqlite_conn, LOCATED[name][0], [rows])
+
+    # Facts before the dimensions they reference, as in the deletes stage.
+    for name in sorted(gone, key=lambda name: not name.startswith('fact_')):
+        if gone[name]:
+            counts['deleted'] += remove(sqlite_conn, name, gone[name], maps.get(name), batch_size)
+    return counts
+
+def run_stream(events_path=None, batch_size=SYNC_BATCH_SIZE, follow=False, flush_interval=1.0):
+    print("Starting stream...")
+    source = f"stream:file:{os.path.abspath(events_path)}" if events_path else 'stream:binlog'
+    mysql_engine = get_mysql_engine()
+    sqlite_engine = get_sqlite_engine()
+    cache = KeyCache(sqlite_engine)
+    telemetry = Telemetry('stream')
+    telemetry.watch(mysql_engine, 'mysql')
+    telemetry.watch(sqlite_engine, 'sqlite')
+    upgrade_schema(sqlite_engine)
+    with sqlite_engine.begin() as conn:
+        ensure(conn)
+        position = get_position(conn, source)
+        maps = {name: cache.load(conn, name) for name in DIMENSIONS}
+    if position:
+        print(f"Resuming from position {position}")
+    elif events_path:
+        print("Starting from the beginning of the event file")
+    else:
+        # A new binlog stream starts at the server's current position, saved
+        # right away so a restart before the first event does not skip ahead.
+        with mysql_engine.connect() as mysql_conn:
+            position = master_position(mysql_conn)
+        with sqlite_engine.begin() as conn:
+            set_position(conn, source, position)
+        print(f"Starting from the current binlog position {position}")
+    if events_path:
+        events = file_events(events_path, position or 0, follow, flush_interval)
+    else:
+        events = binlog_events(SOURCE_URL, position, follow, flush_interval)
+
+    touched = defaultdict(set)
+    pending = 0
+    applied = 0
+    started = time.monotonic()
+
+    def flush(position):
+        # One transaction per micro-batch: the rows and the position it
+        # reached commit together, so a restart resumes right after it.
+        with mysql_engine.connect() as mysql_conn, sqlite_engine.begin() as conn:
+            counts = apply_events(mysql_conn, conn, touched, maps, batch_size)
+            set_position(conn, source, position)
+            bump_version(conn)
+            stamps = {name: cache.stamp(conn, name) for name, keys in maps.items() if keys.dirty}
+        for name, stamp in stamps.items():
+            cache.save(name, maps[name], stamp)
+        record_rows('extracted', pending)
+        for kind, rows in counts.items():
+            record_rows(kind, rows)
+        print(f"Applied {pending} events ({', '.join(f'{rows} {kind}' for kind, rows in counts.items())}), "
+              f"position {position}")
+        touched.clear()
+
+    status = 'error'
+    try:
+        with telemetry.stage('stream'):
+            try:
+                for item in events:
+                    if item is not None:
+                        position, batch = item
+                        for event in batch:
+                            key = event_key(event)
+                            if key is not None:
+                                touched[event['table']].add(key)
+                        pending += len(batch)
+                    due = item is None or pending >= batch_size or time.monotonic() - started >= flush_interval
+                    if pending and due:
+                        flush(position)
+                        applied += pending
+                        pending = 0
+                        started = time.monotonic()
+            except KeyboardInterrupt:
+                print("Stopping stream...")
+            if pending:
+                flush(position)
+                applied += pending
+        status = 'ok'
+        print(f"Stream stopped ({applied} events applied)")
+    except Exception as e:
+        print(f"Stream failed: {e}")
+    return telemetry.finish(status)
@@ -0,0 +1,195 @@
+import json
+import os
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+from threading import Lock
+from sqlalchemy import event
+from src.config import SYNC_METRICS_DIR
+from src.sync.memory import peak_rss_mb
+
+# Stage being run by the current thread; threads started from a stage copy
+# their context so their statements are attributed to it.
+_current = ContextVar('sync_stage', default=None)
+
+def current_stage():
+    stage = _current.get()
+    return stage.name if stage is not None else None
+
+def record_rows(kind, rows):
+    # Add rows to a counter ('extracted', 'inserted', 'upserted', ...) of the current stage.
+    stage = _current.get()
+    if stage is not None:
+        with stage.lock:
+            stage.rows[kind] = stage.rows.get(kind, 0) + rows
+
+def record_queues(channels):
+    # Add the counters of pipeline queues to the current stage, by queue name.
+    stage = _current.get()
+    if stage is None:
+        return
+    with stage.lock:
+        for channel in channels:
+            counters = channel.counters()
+            total = stage.queues.setdefault(channel.name, dict.fromkeys(counters, 0))
+            for name, value in counters.items():
+                total[name] = max(total[name], value) if name in ('capacity', 'max_depth') else total[name] + value
+
+class StageMetrics:
+    def __init__(self, name):
+        self.name = name
+        self.status = 'running'
+        self.rows = {}
+        self.statements = {}
+        self.queues = {}
+        self.wall_s = None
+        self.peak_rss_mb = None
+        self.lock = Lock()
+
+    def rows_per_sec(self):
+        moved = self.rows.get('extracted') or max(self.rows.values(), default=0)
+        return round(moved / self.wall_s, 1) if self.wall_s else 0.0
+
+    def queue_report(self):
+        return {name: {
+            'capacity': q['capacity'],
+            'batches': q['batches'],
+            'mean_depth': round(q['depth_total'] / q['batches'], 2) if q['batches'] else 0.0,
+            'max_depth': q['max_depth'],
+            'producer_stall_s': round(q['producer_stall_s'], 3),
+            'consumer_stall_s': round(q['consumer_stall_s'], 3),
+        } for name, q in self.queues.items()}
+
+    def report(self):
+        return {
+            'name': self.name,
+            'status': self.status,
+            'wall_s': self.wall_s,
+            'rows': dict(self.rows),
+            'rows_per_sec': self.rows_per_sec(),
+            'statements': dict(self.statements),
+            'queues': self.queue_report(),
+            'peak_rss_mb': self.peak_rss_mb,
+        }
+
+class Telemetry:
+    def __init__(self, run, metrics_dir=None):
+        self.run = run
+        self.metrics_dir = SYNC_METRICS_DIR if metrics_dir is None else metrics_dir
+        self.stages = []
+        self.statements = {}
+        self.listeners = []
+        self.lock = Lock()
+        self.started_at = datetime.now()
+        self.start = time.perf_counter()
+
+    def watch(self, engine, label):
+        def count(conn, cursor, statement, parameters, context, executemany):
+            stage = _current.get()
+            with self.lock:
+                self.statements[label] = self.statements.get(label, 0) + 1
+                if stage is not None:
+                    stage.statements[label] = stage.statements.get(label, 0) + 1
+
+        event.listen(engine, 'before_cursor_execute', count)
+        self.listeners.append((engine, count))
+
+    @contextmanager
+    def stage(self, name):
+        metrics = StageMetrics(name)
+        with self.lock:
+            self.stages.append(metrics)
+        token = _current.set(metrics)
+        start = time.perf_counter()
+        try:
+            yield metrics
+            metrics.status = 'ok'
+        except BaseException:
+            metrics.status = 'error'
+            raise
+        finally:
+            metrics.wall_s = round(time.perf_counter() - start, 3)
+            metrics.peak_rss_mb = peak_rss_mb()
+            _current.reset(token)
+
+    def wrap(self, name, run):
+        def instrumented(*args):
+            with self.stage(name):
+                return run(*args)
+        return instrumented
+
+    def finish(self, status):
+        for engine, count in self.listeners:
+            event.remove(engine, 'before_cursor_execute', count)
+        self.listeners = []
+        report = {
+            'run': self.run,
+            'status': status,
+            'started_at': self.started_at.isoformat(),
+            'wall_s': round(time.perf_counter() - self.start, 3),
+            'statements': dict(self.statements),
+            'peak_rss_mb': peak_rss_mb(),
+            'stages': [stage.report() for stage in self.stages],
+        }
+        if self.metrics_dir:
+            os.makedirs(self.metrics_dir, exist_ok=True)
+            _write(os.path.join(self.metrics_dir, f"{self.run}.json"), json.dumps(report, indent=2))
+            _write(os.path.join(self.metrics_dir, f"sakila_sync_{self.run}.prom"), prometheus(report))
+            print(f"Run report written to {self.metrics_dir}")
+        return report
+
+def _write(path, text):
+    # Written atomically so the textfile collector never reads a partial file.
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        f.write(text)
+    os.replace(tmp, path)
+
+def _labels(**labels):
+    return "{" + ",".join(f'{k}="{v}"' for k, v in labels.items()) + "}"
+
+def prometheus(report):
+    run = report['run']
+    metrics = {
+        'sakila_sync_run_success': ('gauge', "1 if the last run succeeded.", [({}, int(report['status'] == 'ok'))]),
+        'sakila_sync_run_duration_seconds': ('gauge', "Wall time of the last run.", [({}, report['wall_s'])]),
+        'sakila_sync_run_last_timestamp_seconds': ('gauge', "Start time of the last run.",
+                                                   [({}, int(datetime.fromisoformat(report['started_at']).timestamp()))]),
+        'sakila_sync_stage_success': ('gauge', "1 if the stage succeeded.", []),
+        'sakila_sync_stage_duration_seconds': ('gauge', "Wall time of the stage.", []),
+        'sakila_sync_stage_rows': ('gauge', "Rows handled by the stage.", []),
+        'sakila_sync_stage_rows_per_second': ('gauge', "Stage throughput.", []),
+        'sakila_sync_stage_statements': ('gauge', "SQL statements executed by the stage.", []),
+        'sakila_sync_stage_peak_rss_bytes': ('gauge', "Process peak RSS when the stage ended.", []),
+        'sakila_sync_stage_queue_mean_depth': ('gauge', "Mean batches waiting in a pipeline queue.", []),
+        'sakila_sync_stage_queue_max_depth': ('gauge', "Most batches waiting in a pipeline queue.", []),
+        'sakila_sync_stage_queue_stall_seconds': ('gauge', "Time a side of a pipeline queue spent blocked.", []),
+    }
+    for stage in report['stages']:
+        name = stage['name']
+        metrics['sakila_sync_stage_success'][2].append(({'stage': name}, int(stage['status'] == 'ok')))
+        metrics['sakila_sync_stage_duration_seconds'][2].append(({'stage': name}, stage['wall_s']))
+        metrics['sakila_sync_stage_rows_per_second'][2].append(({'stage': name}, stage['rows_per_sec']))
+        for kind, rows in stage['rows'].items():
+            metrics['sakila_sync_stage_rows'][2].append(({'stage': name, 'kind': kind}, rows))
+        for engine, count in stage['statements'].items():
+            metrics['sakila_sync_stage_statements'][2].append(({'stage': name, 'engine': engine}, count))
+        for queue, q in stage['queues'].items():
+            labels = {'stage': name, 'queue': queue}
+            metrics['sakila_sync_stage_queue_mean_depth'][2].append((labels, q['mean_depth']))
+            metrics['sakila_sync_stage_queue_max_depth'][2].append((labels, q['max_depth']))
+            metrics['sakila_sync_stage_queue_stall_seconds'][2].append((dict(labels, side='producer'), q['producer_stall_s']))
+            metrics['sakila_sync_stage_queue_stall_seconds'][2].append((dict(labels, side='consumer'), q['consumer_stall_s']))
+        if stage['peak_rss_mb'] is not None:
+            metrics['sakila_sync_stage_peak_rss_bytes'][2].append(({'stage': name}, int(stage['peak_rss_mb'] * 1024 * 1024)))
+
+    lines = []
+    for metric, (kind, help_text, samples) in metrics.items():
+        if not samples:
+            continue
+        lines.append(f"# HELP {metric} {help_text}")
+        lines.append(f"# TYPE {metric} {kind}")
+        for labels, value in samples:
+            lines.append(f"{metric}{_labels(run=run, **labels)} {value}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,92 @@
+from src.sync.columnar import ColumnBatch, date_keys, day_spans, lookup, to_float
+
+def film_row(film):
+    return {
+        'film_id': film.film_id,
+        'title': film.title,
+        'rating': film.rating,
+        'length': film.length,
+        'language': film.language,
+        'release_year': str(film.release_year),
+        'last_update': film.last_update
+    }
+
+def actor_row(actor):
+    return {
+        'actor_id': actor.actor_id,
+        'first_name': actor.first_name,
+        'last_name': actor.last_name,
+        'last_update': actor.last_update
+    }
+
+def category_row(cat):
+    return {
+        'category_id': cat.category_id,
+        'name': cat.name,
+        'last_update': cat.last_update
+    }
+
+def store_row(store):
+    return {
+        'store_id': store.store_id,
+        'city': store.city,
+        'country': store.country,
+        'last_update': store.last_update
+    }
+
+def customer_row(customer):
+    return {
+        'customer_id': customer.customer_id,
+        'first_name': customer.first_name,
+        'last_name': customer.last_name,
+        'active': customer.active,
+        'city': customer.city,
+        'country': customer.country,
+        'last_update': customer.last_update
+    }
+
+def film_actor_row(fa, film_map, actor_map):
+    fk = film_map.get(fa.film_id)
+    ak = actor_map.get(fa.actor_id)
+    if fk and ak:
+        return {'film_key': fk, 'actor_key': ak}
+    return None
+
+def film_category_row(fc, film_map, category_map):
+    fk = film_map.get(fc.film_id)
+    ck = category_map.get(fc.category_id)
+    if fk and ck:
+        return {'film_key': fk, 'category_key': ck}
+    return None
+
+def per_row(transform):
+    def apply(batch):
+        return [row for row in map(transform, batch) if row is not None]
+    return apply
+
+# Fact batches are transformed column by column: one pass per output column
+# instead of a dict and a strftime call per row.
+
+def rental_columns(batch, film_map, store_map, customer_map):
+    source = ColumnBatch.from_rows(batch).columns
+    return ColumnBatch({
+        'rental_id': source['rental_id'],
+        'date_key_rented': date_keys(source['rental_date']),
+        'date_key_returned': date_keys(source['return_date']),
+        'film_key': lookup(film_map, source['film_id']),
+        'store_key': lookup(store_map, source['store_id']),
+        'customer_key': lookup(customer_map, source['customer_id']),
+        'staff_id': source['staff_id'],
+        'rental_duration_days': day_spans(source['rental_date'], source['return_date'])
+    })
+
+def payment_columns(batch, store_map, customer_map):
+    source = ColumnBatch.from_rows(batch).columns
+    return ColumnBatch({
+        'payment_id': source['payment_id'],
+        'date_key_paid': date_keys(source['payment_date']),
+        'customer_key': lookup(customer_map, source['customer_id']),
+        'store_key': lookup(store_map, source['store_id']),
+        'staff_id': source['staff_id'],
+        'amount': to_float(source['amount'])
+    })
@@ -1,78 +1,155 @@
-from sqlalchemy.orm import sessionmaker
-from sqlalchemy import func
+import json
+import time
+from sqlalchemy import select, func
 from src.config import get_mysql_engine, get_sqlite_engine
-from src.models.sakila import Rental, Payment, Customer, Film, Staff, Inventory
-from src.models.analytics import FactRental, FactPayment, DimCustomer, DimFilm, DimStore
+from src.models.sakila import Rental, Payment, Customer, Film, Inventory
+from src.models.analytics import FactRental, FactPayment, DimCustomer, DimFilm, DimStore, AggDailyStoreRevenue
+from src.sync.reconcile import reconcile, reconcile_checks
+from src.sync.scheduler import Stage, run_stages
+from src.sync.telemetry import Telemetry
 
-def run_validate(days=30):
-    print(f"Running validation (days parameter: {days})...")
+def _ids(ids, limit=20):
+    shown = ", ".join(map(str, ids[:limit]))
+    return shown + (f", ... ({len(ids)} total)" if len(ids) > limit else "")
 
-    mysql_session = sessionmaker(bind=get_mysql_engine())()
-    sqlite_session = sessionmaker(bind=get_sqlite_engine())()
-    errors = 0
+def _count(model):
+    return select(func.count()).select_from(model)
+
+def _total(column):
+    return select(func.coalesce(func.sum(column), 0))
+
+def _scalar(result):
+    return float(result.scalar())
+
+def _by_store(result):
+    return {store_id: float(total or 0) for store_id, total in result if store_id is not None}
+
+def _equal(mysql_value, sqlite_value):
+    return mysql_value == sqlite_value
 
+def _close(mysql_value, sqlite_value):
+    return abs(mysql_value - sqlite_value) <= 1
+
+def _stores_close(mysql_value, sqlite_value):
+    stores = mysql_value.keys() | sqlite_value.keys()
+    return all(_close(mysql_value.get(s, 0), sqlite_value.get(s, 0)) for s in stores)
+
+# name, label, MySQL query, SQLite query, result reader, comparison
+CHECKS = [
+    ('rental_count', "Rental count", _count(Rental), _count(FactRental), _scalar, _equal),
+    ('payment_total', "Payment total", _total(Payment.amount), _total(FactPayment.amount), _scalar, _close),
+    ('customer_count', "Customer count", _count(Customer), _count(DimCustomer), _scalar, _equal),
+    ('film_count', "Film count", _count(Film), _count(DimFilm), _scalar, _equal),
+    # Every store in one pass instead of one three-way join per store; the
+    # warehouse side sums the daily store aggregate instead of the fact.
+    ('store_payment_totals', "Payment total by store",
+     select(Inventory.store_id, func.sum(Payment.amount))
+        .select_from(Payment)
+        .join(Rental, Payment.rental_id == Rental.rental_id)
+        .join(Inventory, Rental.inventory_id == Inventory.inventory_id)
+        .group_by(Inventory.store_id),
+     select(DimStore.store_id, func.sum(AggDailyStoreRevenue.revenue_cents) / 100.0)
+        .select_from(AggDailyStoreRevenue)
+        .join(DimStore, AggDailyStoreRevenue.store_key == DimStore.store_key)
+        .group_by(DimStore.store_id),
+     _by_store, _stores_close),
+]
+
+def _timed(run):
+    start = time.perf_counter()
     try:
-        mysql_rental_count = mysql_session.query(Rental).count()
-        sqlite_rental_count = sqlite_session.query(FactRental).count()
-        print(f"Rental count - MySQL: {mysql_rental_count}, SQLite: {sqlite_rental_count}")
-        if mysql_rental_count != sqlite_rental_count:
-            print("WARNING: Rental count mismatch!")
-            errors += 1
+        return {'value': run(), 'latency_ms': round((time.perf_counter() - start) * 1000, 1)}
+    except Exception as e:
+        return {'error': str(e), 'latency_ms': round((time.perf_counter() - start) * 1000, 1)}
 
-        mysql_payment_total = float(mysql_session.query(func.sum(Payment.amount)).scalar() or 0)
-        sqlite_payment_total = float(sqlite_session.query(func.sum(FactPayment.amount)).scalar() or 0)
-        print(f"Payment total - MySQL: {mysql_payment_total:.2f}, SQLite: {sqlite_payment_total:.2f}")
-        if abs(mysql_payment_total - sqlite_payment_total) > 1:
-            print("WARNING: Payment total mismatch!")
-            errors += 1
+def _query_stage(name, engine, query, read):
+    def run(results):
+        def execute():
+            with engine.connect() as conn:
+                return read(conn.execute(query))
+        return _timed(execute)
+    return Stage(name, run)
 
-        mysql_customer_count = mysql_session.query(Customer).count()
-        sqlite_customer_count = sqlite_session.query(DimCustomer).count()
-        print(f"Customer count - MySQL: {mysql_customer_count}, SQLite: {sqlite_customer_count}")
-        if mysql_customer_count != sqlite_customer_count:
-            print("WARNING: Customer count mismatch!")
-            errors += 1
+def _reconcile_stage(mysql_engine, sqlite_engine, check, days):
+    def run(results):
+        def execute():
+            with mysql_engine.connect() as mysql_conn, sqlite_engine.connect() as sqlite_conn:
+                return reconcile(mysql_conn, sqlite_conn, check, days)
+        return _timed(execute)
+    return Stage(f"reconcile:{check.name}", run)
 
-        mysql_film_count = mysql_session.query(Film).count()
-        sqlite_film_count = sqlite_session.query(DimFilm).count()
-        print(f"Film count - MySQL: {mysql_film_count}, SQLite: {sqlite_film_count}")
-        if mysql_film_count != sqlite_film_count:
-            print("WARNING: Film count mismatch!")
-            errors += 1
+def _format(value):
+    if isinstance(value, dict):
+        return ", ".join(f"store {s}: {v:.2f}" for s, v in sorted(value.items()))
+    return f"{value:.2f}" if value != int(value) else str(int(value))
+
+def run_validate(days=30, report_path=None):
+    print(f"Running validation (days parameter: {days})...")
+
+    mysql_engine = get_mysql_engine()
+    sqlite_engine = get_sqlite_engine()
+    telemetry = Telemetry('validate')
+    telemetry.watch(mysql_engine, 'mysql')
+    telemetry.watch(sqlite_engine, 'sqlite')
+    checks = reconcile_checks()
+    # Every query gets its own connection and thread, so the run takes as
+    # long as the slowest query rather than the sum of all of them.
+    stages = []
+    for name, label, mysql_query, sqlite_query, read, compare in CHECKS:
+        stages.append(_query_stage(f"mysql:{name}", mysql_engine, mysql_query, read))
+        stages.append(_query_stage(f"sqlite:{name}", sqlite_engine, sqlite_query, read))
+    stages += [_reconcile_stage(mysql_engine, sqlite_engine, check, days) for check in checks]
+
+    start = time.perf_counter()
+    results = run_stages(stages, len(stages), telemetry)
+    report = {'days': days, 'checks': []}
+    errors = 0
 
-        if errors == 0:
-            print("Validation passed! All checks OK.")
+    for name, label, mysql_query, sqlite_query, read, compare in CHECKS:
+        mysql_side, sqlite_side = results[f"mysql:{name}"], results[f"sqlite:{name}"]
+        entry = {'name': name, 'mysql': mysql_side, 'sqlite': sqlite_side}
+        if 'error' in mysql_side or 'error' in sqlite_side:
+            entry['status'] = 'error'
+            print(f"{label} - failed: {mysql_side.get('error') or sqlite_side.get('error')}")
         else:
-            print(f"Validation finished with {errors} warning(s).")
-
-        print("Checking payment total by store...")
-        store1_key = sqlite_session.query(DimStore.store_key).filter_by(store_id=1).scalar()
-        store2_key = sqlite_session.query(DimStore.store_key).filter_by(store_id=2).scalar()
-
-        mysql_store1 = float(mysql_session.query(func.sum(Payment.amount))
-            .join(Rental, Payment.rental_id == Rental.rental_id)
-            .join(Inventory, Rental.inventory_id == Inventory.inventory_id)
-            .filter(Inventory.store_id == 1).scalar() or 0)
-        mysql_store2 = float(mysql_session.query(func.sum(Payment.amount))
-            .join(Rental, Payment.rental_id == Rental.rental_id)
-            .join(Inventory, Rental.inventory_id == Inventory.inventory_id)
-            .filter(Inventory.store_id == 2).scalar() or 0)
-
-        sqlite_store1 = float(sqlite_session.query(func.sum(FactPayment.amount))
-            .filter(FactPayment.store_key == store1_key).scalar() or 0)
-        sqlite_store2 = float(sqlite_session.query(func.sum(FactPayment.amount))
-            .filter(FactPayment.store_key == store2_key).scalar() or 0)
-
-        print(f"Store 1 payment total - MySQL: {mysql_store1:.2f}, SQLite: {sqlite_store1:.2f}")
-        print(f"Store 2 payment total - MySQL: {mysql_store2:.2f}, SQLite: {sqlite_store2:.2f}")
-
-        if abs(mysql_store1 - sqlite_store1) > 1 or abs(mysql_store2 - sqlite_store2) > 1:
-            print("WARNING: Payment total by store mismatch!")
+            entry['status'] = 'ok' if compare(mysql_side['value'], sqlite_side['value']) else 'mismatch'
+            print(f"{label} - MySQL: {_format(mysql_side['value'])}, SQLite: {_format(sqlite_side['value'])}")
+        if entry['status'] != 'ok':
+            print(f"WARNING: {label} mismatch!")
+            errors += 1
+        report['checks'].append(entry)
+
+    window = f"last {days} days" if days else "all rows"
+    print(f"Reconciling row digests ({window})...")
+    for check in checks:
+        outcome = results[f"reconcile:{check.name}"]
+        entry = {'name': f"reconcile_{check.name}", 'latency_ms': outcome['latency_ms']}
+        if 'error' in outcome:
+            entry.update(status='error', error=outcome['error'])
+            print(f"{check.name}: failed: {outcome['error']}")
         else:
-            print("Store payment totals match!")
+            result = outcome['value']
+            mismatched = len(result['missing']) + len(result['extra']) + len(result['changed'])
+            entry.update(result, status='mismatch' if mismatched else 'ok')
+            print(f"{check.name}: {mismatched} mismatched row(s), {result['queries']} queries")
+            for kind in ('missing', 'extra', 'changed'):
+                if result[kind]:
+                    print(f"  {kind}: {_ids(result[kind])}")
+        if entry['status'] != 'ok':
+            print(f"WARNING: {check.name} rows differ!")
+            errors += 1
+        report['checks'].append(entry)
 
-    except Exception as e:
-        print(f"Validation failed: {e}")
-    finally:
-        mysql_session.close()
-        sqlite_session.close()
\ No newline at end of file
+    report['elapsed_ms'] = round((time.perf_counter() - start) * 1000, 1)
+    report['passed'] = errors == 0
+    if errors == 0:
+        print("Validation passed! All checks OK.")
+    else:
+        print(f"Validation finished with {errors} warning(s).")
+
+    telemetry.finish('ok' if errors == 0 else 'failed')
+    if report_path:
+        with open(report_path, 'w') as f:
+            json.dump(report, f, indent=2, default=str)
+        print(f"Report written to {report_path}")
+    return report
@@ -0,0 +1,42 @@
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from functools import partial
+from src.sync.columnar import ColumnBatch
+from src.sync.keycache import KeyMap
+
+# Transform of the current worker process, set once when the pool starts.
+_transform = None
+
+def _start(transform):
+    global _transform
+    _transform = transform
+
+def _apply(batch):
+    return _transform(batch)
+
+def shippable(transform):
+    # Key maps travel to the workers as bare arrays (one buffer each, plus any
+    # sparse ids) without their SQLAlchemy columns.
+    if not isinstance(transform, partial):
+        return transform
+    keywords = {name: KeyMap(None, None, value.keys, value.sparse) if isinstance(value, KeyMap) else value
+                for name, value in transform.keywords.items()}
+    return partial(transform.func, *transform.args, **keywords)
+
+@contextmanager
+def transform_pool(transform, processes):
+    # Pool of processes applying transform to column batches; None when
+    # processes is 0. Workers are not forked from this (threaded) process.
+    if processes <= 0:
+        yield None
+        return
+    methods = multiprocessing.get_all_start_methods()
+    context = multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+    with ProcessPoolExecutor(processes, mp_context=context, initializer=_start,
+                             initargs=(shippable(transform),)) as pool:
+        yield pool
+
+def submit(pool, rows):
+    # Source rows are sent as plain column lists, not as Row objects.
+    return pool.submit(_apply, ColumnBatch.from_rows(rows))
@@ -1,5 +1,5 @@
 import pytest
-from sqlalchemy import create_engine, inspect
+from sqlalchemy import create_engine, inspect, select, func
 from sqlalchemy.orm import sessionmaker
 from datetime import datetime
 from unittest.mock import patch
@@ -104,4 +104,1005 @@ def test_validate(test_engine):
     assert mysql_film_count == sqlite_session.query(DimFilm).count()
     assert mysql_customer_count == sqlite_session.query(DimCustomer).count()
     sqlite_session.close()
-    print("Test 5 passed: Validate confirms data consistency")
\ No newline at end of file
+    print("Test 5 passed: Validate confirms data consistency")
+
+def test_full_load_idempotent(test_engine):
+    from src.sync import full_load
+    with patch.object(full_load, "get_sqlite_engine", lambda: test_engine):
+        full_load.run_full_load()
+        session = sessionmaker(bind=test_engine)()
+        rentals = session.query(FactRental).count()
+        payments = session.query(FactPayment).count()
+        session.close()
+        full_load.run_full_load()
+    session = sessionmaker(bind=test_engine)()
+    assert session.query(DimFilm).count() == 1000
+    assert session.query(FactRental).count() == rentals
+    assert session.query(FactPayment).count() == payments
+    session.close()
+    print("Test 6 passed: Full load is idempotent")
+
+def test_full_load_parallel(test_engine):
+    from src.sync import full_load
+    with patch.object(full_load, "get_sqlite_engine", lambda: test_engine):
+        full_load.run_full_load(workers=4)
+    session = sessionmaker(bind=test_engine)()
+    assert session.query(DimFilm).count() == 1000
+    assert session.query(DimActor).count() == 200
+    assert session.query(DimCustomer).count() == 599
+    assert session.query(FactRental).filter(FactRental.film_key.is_(None)).count() == 0
+    assert session.query(SyncState).filter(SyncState.table_name.in_(full_load.STATE_TABLES)).count() == 12
+    session.close()
+    print("Test 7 passed: Parallel full load loads all data successfully")
+
+def test_validate_reconcile(test_engine):
+    from src.sync import full_load
+    from src.sync.reconcile import reconcile, reconcile_checks
+    with patch.object(full_load, "get_sqlite_engine", lambda: test_engine):
+        full_load.run_full_load()
+    session = sessionmaker(bind=test_engine)()
+    rental = session.query(FactRental).order_by(FactRental.rental_id).first()
+    rental.staff_id = 99
+    rental_id = rental.rental_id
+    payment = session.query(FactPayment).order_by(FactPayment.payment_id.desc()).first()
+    payment_id = payment.payment_id
+    session.delete(payment)
+    customer = session.query(DimCustomer).filter_by(customer_id=300).first()
+    customer.city = "Nowhere"
+    session.commit()
+    session.close()
+    checks = {check.name: check for check in reconcile_checks()}
+    with get_mysql_engine().connect() as mysql_conn, test_engine.connect() as sqlite_conn:
+        assert reconcile(mysql_conn, sqlite_conn, checks['rental'])['changed'] == [rental_id]
+        assert reconcile(mysql_conn, sqlite_conn, checks['payment'])['missing'] == [payment_id]
+        assert reconcile(mysql_conn, sqlite_conn, checks['customer'])['changed'] == [300]
+        result = reconcile(mysql_conn, sqlite_conn, checks['film'])
+        assert result['missing'] == result['extra'] == result['changed'] == []
+    print("Test 8 passed: Reconciliation finds the exact mismatched rows")
+
+def test_validate_report(test_engine, tmp_path):
+    import json
+    from src.sync import full_load, validate
+    with patch.object(full_load, "get_sqlite_engine", lambda: test_engine):
+        full_load.run_full_load()
+    report_path = tmp_path / "validation.json"
+    with patch.object(validate, "get_sqlite_engine", lambda: test_engine):
+        validate.run_validate(days=0, report_path=str(report_path))
+    report = json.loads(report_path.read_text())
+    assert report['passed']
+    checks = {check['name']: check for check in report['checks']}
+    assert checks['rental_count']['status'] == 'ok'
+    assert len(checks['store_payment_totals']['mysql']['value']) == len(checks['store_payment_totals']['sqlite']['value'])
+    assert all('latency_ms' in check['mysql'] for check in report['checks'] if 'mysql' in check)
+    print("Test 9 passed: Validate writes a passing JSON report")
+
+def test_full_load_resume(test_engine):
+    from src.sync import full_load
+    from src.models.analytics import LoadCheckpoint
+
+    def fail(*args, **kwargs):
+        raise RuntimeError("source timeout")
+
+    with patch.object(full_load, "get_sqlite_engine", lambda: test_engine):
+        with patch.object(full_load, "payment_columns", fail):
+            full_load.run_full_load()
+        session = sessionmaker(bind=test_engine)()
+        done = {c.table_name for c in session.query(LoadCheckpoint).filter(LoadCheckpoint.completed_at.isnot(None))}
+        assert {'dim_film', 'dim_customer', 'fact_rental'} <= done
+        assert 'fact_payment' not in done
+        assert session.query(FactPayment).count() == 0
+        rentals = session.query(FactRental).count()
+        session.close()
+        # Finished tables are skipped on resume, so their transforms never run.
+        with patch.object(full_load, "film_row", fail), patch.object(full_load, "rental_columns", fail):
+            full_load.run_full_load()
+    session = sessionmaker(bind=test_engine)()
+    assert session.query(FactRental).count() == rentals
+    assert session.query(FactPayment).count() > 0
+    assert session.query(LoadCheckpoint).count() == 0
+    assert session.query(SyncState).filter(SyncState.table_name.in_(full_load.STATE_TABLES)).count() == 12
+    session.close()
+    print("Test 10 passed: Full load resumes from its checkpoints")
+
+def test_full_load_telemetry(test_engine, tmp_path):
+    import json
+    from src.sync import full_load, telemetry
+    with patch.object(full_load, "get_sqlite_engine", lambda: test_engine), \
+            patch.object(telemetry, "SYNC_METRICS_DIR", str(tmp_path)):
+        full_load.run_full_load()
+    report = json.loads((tmp_path / "full_load.json").read_text())
+    assert report['status'] == 'ok'
+    stages = {stage['name']: stage for stage in report['stages']}
+    assert stages['dim_film']['rows'] == {'extracted': 1000, 'inserted': 1000}
+    assert stages['fact_rental']['rows_per_sec'] > 0
+    assert stages['fact_rental']['statements']['mysql'] > 0
+    assert stages['fact_rental']['statements']['sqlite'] > 0
+    queues = stages['fact_rental']['queues']
+    assert queues['extracted']['batches'] == queues['transformed']['batches'] > 0
+    assert 1 <= queues['transformed']['max_depth'] <= queues['transformed']['capacity']
+    prom = (tmp_path / "sakila_sync_full_load.prom").read_text()
+    assert 'sakila_sync_run_success{run="full_load"} 1' in prom
+    assert 'sakila_sync_stage_rows{run="full_load",stage="dim_film",kind="inserted"} 1000' in prom
+    assert 'sakila_sync_stage_queue_stall_seconds{run="full_load",stage="fact_rental",queue="transformed",side="producer"}' in prom
+    print("Test 11 passed: Full load writes a run report and Prometheus metrics")
+
+def test_full_load_synthetic_source(test_engine, tmp_path):
+    from src.bench.generate import generate, row_counts
+    from src.sync import full_load
+    source = generate(f"sqlite:///{tmp_path / 'sakila.db'}", scale=0.1)
+    with patch.object(full_load, "get_mysql_engine", lambda: source), \
+            patch.object(full_load, "get_sqlite_engine", lambda: test_engine):
+        full_load.run_full_load()
+    counts = row_counts(0.1)
+    session = sessionmaker(bind=test_engine)()
+    assert session.query(DimFilm).count() == counts['film']
+    assert session.query(DimCustomer).count() == counts['customer']
+    assert session.query(FactRental).count() == counts['rental']
+    assert session.query(FactPayment).count() == counts['rental']
+    session.close()
+    source.dispose()
+    print("Test 12 passed: Full load runs against a synthetic Sakila source")
+
+def test_profile_statements(test_engine, tmp_path):
+    import csv
+    from sqlalchemy import text
+    from src.sync import full_load
+    from src.sync.profiling import profile_run, normalize
+    from src.sync.telemetry import Telemetry
+    assert normalize("SELECT * FROM film WHERE film_id IN (1, 2, 3) AND title = 'A'") == \
+        "SELECT * FROM film WHERE film_id IN (?, ...) AND title = ?"
+    with profile_run('full_load', str(tmp_path)):
+        with patch.object(full_load, "get_sqlite_engine", lambda: test_engine):
+            full_load.run_full_load(workers=2)
+        with Telemetry('lookup').stage('lookup'), test_engine.connect() as conn:
+            for film_key in range(60):
+                conn.execute(text(f"SELECT title FROM dim_film WHERE film_key = {film_key}"))
+    assert (tmp_path / "full_load.prof").exists()
+    assert 'run_full_load' in (tmp_path / "full_load-functions.txt").read_text()
+    with open(tmp_path / "full_load-statements.csv") as f:
+        rows = list(csv.DictReader(f))
+    flagged = [row for row in rows if row['n_plus_one'] == 'True']
+    assert [(row['stage'], row['count']) for row in flagged] == [('lookup', '60')]
+    assert flagged[0]['statement'] == "SELECT title FROM dim_film WHERE film_key = ?"
+    assert flagged[0]['caller'].startswith('tests/test_commands.py')
+    assert any(row['stage'] == 'fact_rental' and row['statement'].startswith('INSERT INTO fact_rental') for row in rows)
+    print("Test 13 passed: Profiling groups statements by shape and flags N+1 loops")
+
+def test_incremental_bridges(test_engine):
+    from sqlalchemy import delete, insert
+    from src.models.analytics import DimCategory, BridgeFilmActor, BridgeFilmCategory
+    from src.sync import full_load, incremental
+    with patch.object(full_load, "get_sqlite_engine", lambda: test_engine):
+        full_load.run_full_load()
+    session = sessionmaker(bind=test_engine)()
+    actor_links = session.query(BridgeFilmActor).count()
+    category_links = session.query(BridgeFilmCategory).count()
+    link = session.query(BridgeFilmActor).first()
+    film_key, actor_key = link.film_key, link.actor_key
+    session.execute(delete(BridgeFilmActor).where(BridgeFilmActor.film_key == film_key))
+    session.execute(insert(BridgeFilmCategory).values(film_key=film_key, category_key=-1))
+    category = session.query(DimCategory).first()
+    category_id, name = category.category_id, category.name
+    category.name = "UPDATED NAME"
+    for table in ['category', 'film_actor', 'film_category']:
+        session.query(SyncState).filter_by(table_name=table).update({'last_updated': datetime(2000, 1, 1)})
+    session.commit()
+    session.close()
+    with patch.object(incremental, "get_sqlite_engine", lambda: test_engine):
+        report = incremental.run_incremental()
+    assert report['status'] == 'ok'
+    session = sessionmaker(bind=test_engine)()
+    assert session.query(BridgeFilmActor).count() == actor_links
+    assert session.query(BridgeFilmActor).filter_by(film_key=film_key, actor_key=actor_key).count() == 1
+    assert session.query(BridgeFilmCategory).count() == category_links
+    assert session.query(BridgeFilmCategory).filter_by(category_key=-1).count() == 0
+    assert session.query(DimCategory).filter_by(category_id=category_id).one().name == name
+    assert session.query(SyncState).filter_by(table_name='film_actor').one().last_updated > datetime(2000, 1, 1)
+    session.close()
+    print("Test 14 passed: Incremental refreshes dim_category and the bridge tables")
+
+def test_incremental_locations(test_engine):
+    from src.models.analytics import DimStore
+    from src.sync import full_load, incremental
+    with patch.object(full_load, "get_sqlite_engine", lambda: test_engine):
+        full_load.run_full_load()
+    session = sessionmaker(bind=test_engine)()
+    cities = {c.customer_id: (c.city, c.country) for c in session.query(DimCustomer)}
+    session.query(DimCustomer).update({'city': 'zz', 'country': 'zz'})
+    session.query(DimStore).update({'city': 'zz'})
+    session.commit()
+    session.close()
+    with patch.object(incremental, "get_sqlite_engine", lambda: test_engine):
+        incremental.run_incremental()
+    session = sessionmaker(bind=test_engine)()
+    assert session.query(DimCustomer).filter_by(city='zz').count() == 599
+    for table in ['address', 'city', 'country']:
+        session.query(SyncState).filter_by(table_name=table).update({'last_updated': datetime(2000, 1, 1)})
+    session.commit()
+    session.close()
+    with patch.object(incremental, "get_sqlite_engine", lambda: test_engine):
+        incremental.run_incremental()
+    session = sessionmaker(bind=test_engine)()
+    assert {c.customer_id: (c.city, c.country) for c in session.query(DimCustomer)} == cities
+    assert session.query(DimStore).filter_by(city='zz').count() == 0
+    assert session.query(SyncState).filter_by(table_name='city').one().last_updated > datetime(2000, 1, 1)
+    session.close()
+    print("Test 15 passed: Incremental propagates address/city/country changes to dimensions")
+
+def test_incremental_deletes(test_engine):
+    from sqlalchemy import insert
+    from src.models.analytics import BridgeFilmActor
+    from src.sync import full_load, incremental
+    from src.sync.keycache import KeyCache
+    with patch.object(full_load, "get_sqlite_engine", lambda: test_engine):
+        full_load.run_full_load()
+    session = sessionmaker(bind=test_engine)()
+    rentals = session.query(FactRental).count()
+    session.execute(insert(DimCustomer).values(customer_id=5000, first_name='GONE'))
+    customer_key = session.query(DimCustomer).filter_by(customer_id=5000).one().customer_key
+    session.execute(insert(DimFilm).values(film_id=5000, title='GONE'))
+    film_key = session.query(DimFilm).filter_by(film_id=5000).one().film_key
+    session.execute(insert(BridgeFilmActor).values(film_key=film_key, actor_key=1))
+    session.execute(insert(FactRental).values(rental_id=20000, customer_key=customer_key, film_key=film_key))
+    session.query(FactPayment).filter_by(payment_id=3).update({'customer_key': customer_key})
+    session.execute(insert(FactPayment).values(payment_id=30000, customer_key=customer_key))
+    session.commit()
+    session.close()
+    with patch.object(incremental, "get_sqlite_engine", lambda: test_engine):
+        report = incremental.run_incremental()
+    assert {stage['name']: stage for stage in report['stages']}['deletes']['rows']['deleted'] == 4
+    session = sessionmaker(bind=test_engine)()
+    assert session.query(FactRental).count() == rentals
+    assert session.query(FactPayment).filter_by(payment_id=30000).count() == 0
+    assert session.query(FactPayment).filter_by(payment_id=3).one().customer_key is None
+    assert session.query(DimCustomer).filter_by(customer_id=5000).count() == 0
+    assert session.query(DimFilm).filter_by(film_id=5000).count() == 0
+    assert session.query(BridgeFilmActor).filter_by(film_key=film_key).count() == 0
+    session.close()
+    with test_engine.connect() as conn:
+        assert KeyCache(test_engine).load(conn, 'dim_customer').get(5000) is None
+    print("Test 16 passed: Incremental removes rows deleted from the source")
+
+def test_stream_events(test_engine, tmp_path):
+    import json
+    from sqlalchemy import insert, update, delete
+    from src.bench.generate import generate
+    from src.models.sakila import Film, FilmCategory, Customer, Address, City, Rental, Payment
+    from src.models.analytics import BridgeFilmCategory, DimCategory
+    from src.sync import full_load, stream
+    source = generate(f"sqlite:///{tmp_path / 'sakila.db'}", scale=0.1)
+    with patch.object(full_load, "get_mysql_engine", lambda: source), \
+            patch.object(full_load, "get_sqlite_engine", lambda: test_engine):
+        full_load.run_full_load()
+    now = datetime.now()
+    with source.begin() as conn:
+        address_id = conn.execute(select(Customer.address_id).where(Customer.customer_id == 1)).scalar()
+        city_id = conn.execute(select(Address.city_id).where(Address.address_id == address_id)).scalar()
+        category_id = conn.execute(select(FilmCategory.category_id).where(FilmCategory.film_id == 2)).scalar()
+        conn.execute(update(Film).where(Film.film_id == 1).values(title='STREAMED', last_update=now))
+        conn.execute(update(City).where(City.city_id == city_id).values(city='RENAMED', last_update=now))
+        conn.execute(update(FilmCategory).where(FilmCategory.film_id == 2).values(category_id=category_id % 16 + 1))
+        conn.execute(delete(Payment).where(Payment.payment_id == 5))
+        conn.execute(insert(Customer).values(customer_id=1000, first_name='NEW', address_id=address_id, last_update=now))
+        conn.execute(insert(Rental).values(rental_id=100000, rental_date=now, inventory_id=1, customer_id=1000,
+                                           staff_id=1, last_update=now))
+    events = [
+        {'table': 'film', 'type': 'update', 'row': {'film_id': 1}},
+        {'table': 'city', 'type': 'update', 'row': {'city_id': city_id}},
+        {'table': 'film_category', 'type': 'delete', 'row': {'film_id': 2, 'category_id': category_id}},
+        {'table': 'film_category', 'type': 'insert', 'row': {'film_id': 2, 'category_id': category_id % 16 + 1}},
+        {'table': 'payment', 'type': 'delete', 'row': {'payment_id': 5}},
+        {'table': 'customer', 'type': 'insert', 'row': {'customer_id': 1000}},
+        {'table': 'rental', 'type': 'insert', 'row': {'rental_id': 100000}},
+    ]
+    events_path = tmp_path / "events.jsonl"
+    events_path.write_text(''.join(json.dumps(event) + '\n' for event in events))
+    with patch.object(stream, "get_mysql_engine", lambda: source), \
+            patch.object(stream, "get_sqlite_engine", lambda: test_engine):
+        report = stream.run_stream(str(events_path), batch_size=4)
+        assert report['status'] == 'ok'
+        assert report['stages'][0]['rows']['extracted'] == 7
+        again = stream.run_stream(str(events_path))
+        assert 'extracted' not in again['stages'][0]['rows']
+    session = sessionmaker(bind=test_engine)()
+    assert session.query(DimFilm).filter_by(film_id=1).one().title == 'STREAMED'
+    assert session.query(DimCustomer).filter_by(customer_id=1).one().city == 'RENAMED'
+    new_customer = session.query(DimCustomer).filter_by(customer_id=1000).one()
+    assert new_customer.city == 'RENAMED'
+    assert session.query(FactRental).filter_by(rental_id=100000).one().customer_key == new_customer.customer_key
+    assert session.query(FactPayment).filter_by(payment_id=5).count() == 0
+    film_key = session.query(DimFilm).filter_by(film_id=2).one().film_key
+    categories = [session.get(DimCategory, link.category_key).category_id
+                  for link in session.query(BridgeFilmCategory).filter_by(film_key=film_key)]
+    assert categories == [category_id % 16 + 1]
+    position = session.query(SyncState).filter_by(table_name=f"stream:file:{events_path}").one().position
+    assert int(position) == events_path.stat().st_size
+    session.close()
+    source.dispose()
+    print("Test 17 passed: Stream applies replayed row events and checkpoints its position")
+
+def test_overlapped_pipeline():
+    from src.sync.overlap import overlapped
+    from src.sync.telemetry import Telemetry
+    telemetry = Telemetry('overlap', metrics_dir='')
+    with telemetry.stage('numbers'):
+        assert list(overlapped(iter(range(20)), lambda n: n * 2, depth=2)) == list(range(0, 40, 2))
+
+    def failing():
+        yield 1
+        raise RuntimeError("source timeout")
+    with pytest.raises(RuntimeError, match="source timeout"):
+        list(overlapped(failing(), lambda n: n))
+    with pytest.raises(ZeroDivisionError):
+        list(overlapped(iter(range(5)), lambda n: 1 / (n - 3)))
+    queues = telemetry.finish('ok')['stages'][0]['queues']
+    assert queues['extracted']['batches'] == 20 and queues['extracted']['max_depth'] <= 2
+    print("Test 18 passed: Overlapped pipeline keeps order and surfaces errors")
+
+def test_full_load_processes(test_engine):
+    from src.sync import full_load
+    with patch.object(full_load, "get_sqlite_engine", lambda: test_engine):
+        report = full_load.run_full_load(workers=2, processes=2)
+    assert report['status'] == 'ok'
+    session = sessionmaker(bind=test_engine)()
+    assert session.query(FactRental).count() == 16044
+    assert session.query(FactPayment).count() == 16044
+    assert session.query(FactRental).filter(FactRental.film_key.is_(None)).count() == 0
+    assert session.query(FactPayment).filter(FactPayment.customer_key.is_(None)).count() == 0
+    session.close()
+    print("Test 19 passed: Full load transforms facts on a process pool")
+
+def test_incremental_aggregates(test_engine, tmp_path):
+    from sqlalchemy import insert, update, delete
+    from src.bench.generate import generate
+    from src.models.sakila import Rental, Payment
+    from src.models.analytics import AggDailyStoreRevenue
+    from src.sync import full_load, incremental, aggregates
+    source = generate(f"sqlite:///{tmp_path / 'sakila.db'}", scale=0.1)
+
+    def snapshot(conn):
+        return {a.model.__tablename__: sorted(map(tuple, conn.execute(select(a.model)))) for a in aggregates.AGGREGATES}
+
+    def rebuilt():
+        with test_engine.connect() as conn:
+            aggregates.rebuild(conn)
+            rows = snapshot(conn)
+            conn.rollback()
+        return rows
+
+    with patch.object(full_load, "get_mysql_engine", lambda: source), \
+            patch.object(full_load, "get_sqlite_engine", lambda: test_engine):
+        full_load.run_full_load()
+    with test_engine.connect() as conn:
+        loaded = snapshot(conn)
+        cents = conn.execute(select(func.sum(AggDailyStoreRevenue.revenue_cents))).scalar()
+        stored = conn.execute(select(func.sum(FactPayment.amount)).where(FactPayment.store_key.isnot(None))).scalar()
+    assert all(loaded.values())
+    assert abs(cents / 100 - float(stored)) < 0.01
+
+    now = datetime.now()
+    with source.begin() as conn:
+        conn.execute(update(Payment).where(Payment.payment_id == 1).values(amount=99.99, last_update=now))
+        conn.execute(update(Rental).where(Rental.rental_id == 2).values(inventory_id=3, rental_date=now, last_update=now))
+        conn.execute(delete(Payment).where(Payment.payment_id == 2))
+        conn.execute(insert(Payment).values(payment_id=900000, customer_id=1, staff_id=1, rental_id=1,
+                                            amount=5, payment_date=now, last_update=now))
+    with patch.object(incremental, "get_mysql_engine", lambda: source), \
+            patch.object(incremental, "get_sqlite_engine", lambda: test_engine):
+        report = incremental.run_incremental()
+    assert report['status'] == 'ok'
+    with test_engine.connect() as conn:
+        maintained = snapshot(conn)
+    assert maintained != loaded
+    assert maintained == rebuilt()
+    print("Test 20 passed: Aggregates are built by full load and maintained from incremental deltas")
+
+def test_query_cache(test_engine, tmp_path):
+    from src.sync import full_load, incremental
+    from src.sync.queries import QueryCache, run_query
+    with patch.object(full_load, "get_sqlite_engine", lambda: test_engine):
+        full_load.run_full_load()
+    cache = QueryCache(maxsize=2, path=str(tmp_path / "queries"))
+    first = run_query(test_engine, 'top_films', {'limit': '5'}, cache)
+    assert len(first.rows) == 5 and not first.cached
+    again = run_query(test_engine, 'top_films', {'limit': 5}, cache)
+    assert again.cached and again.rows == first.rows and again.version == first.version
+    from_disk = run_query(test_engine, 'top_films', {'limit': 5}, QueryCache(path=str(tmp_path / "queries")))
+    assert from_disk.cached and from_disk.rows == first.rows
+    run_query(test_engine, 'customer_ltv', {}, cache)
+    run_query(test_engine, 'category_rentals', {}, cache)
+    assert len(cache.entries) == 2
+    with patch.object(incremental, "get_sqlite_engine", lambda: test_engine):
+        incremental.run_incremental()
+    fresh = run_query(test_engine, 'category_rentals', {}, cache)
+    assert fresh.version > first.version and not fresh.cached
+    with pytest.raises(ValueError):
+        run_query(test_engine, 'top_films', {'year': 2005}, cache)
+    print("Test 21 passed: Query results are cached until a sync bumps the data version")
+
+def test_export_parquet(test_engine, tmp_path):
+    pq = pytest.importorskip("pyarrow.parquet")
+    from sqlalchemy import update, delete
+    from src.bench.generate import generate
+    from src.models.sakila import Rental, Payment
+    from src.sync import full_load, incremental, export
+    source = generate(f"sqlite:///{tmp_path / 'sakila.db'}", scale=0.1)
+    with patch.object(full_load, "get_mysql_engine", lambda: source), \
+            patch.object(full_load, "get_sqlite_engine", lambda: test_engine):
+        full_load.run_full_load()
+    out = tmp_path / "export"
+
+    def written(report):
+        return {stage['name']: stage['rows'].get('partitions', 0) for stage in report['stages']}
+
+    with patch.object(export, "get_sqlite_engine", lambda: test_engine):
+        first = export.run_export(str(out))
+        session = sessionmaker(bind=test_engine)()
+        rentals = session.query(FactRental).count()
+        payment_id, date_key = session.query(FactPayment.payment_id, FactPayment.date_key_paid).filter(
+            FactPayment.date_key_paid.isnot(None)).first()
+        first_month = session.query(func.min(FactRental.date_key_rented)).scalar() // 100
+        session.close()
+        assert pq.read_table(out / "fact_rental", partitioning='hive').num_rows == rentals
+        assert pq.read_table(out / "dim_film.parquet").num_rows == 1000
+        assert all(written(first).values())
+        assert written(export.run_export(str(out))) == dict.fromkeys(export.TABLES, 0)
+
+        now = datetime.now()
+        start = datetime(first_month // 100, first_month % 100, 1)
+        with source.begin() as conn:
+            conn.execute(update(Payment).where(Payment.payment_id == payment_id).values(amount=123.45, last_update=now))
+            conn.execute(delete(Rental).where(Rental.rental_date >= start,
+                                              Rental.rental_date < datetime(start.year + start.month // 12, start.month % 12 + 1, 1)))
+        with patch.object(incremental, "get_mysql_engine", lambda: source), \
+                patch.object(incremental, "get_sqlite_engine", lambda: test_engine):
+            assert incremental.run_incremental()['status'] == 'ok'
+        changed = written(export.run_export(str(out)))
+    # Dimensions are rewritten after any sync; of the facts only the changed months.
+    assert changed == dict(dict.fromkeys(export.TABLES, 1), fact_rental=0, fact_payment=1)
+    month = date_key // 100
+    payments = pq.read_table(out / "fact_payment" / f"year={month // 100}" / f"month={month % 100}").to_pylist()
+    assert [float(p['amount']) for p in payments if p['payment_id'] == payment_id] == [123.45]
+    assert not (out / "fact_rental" / f"year={first_month // 100}" / f"month={first_month % 100}").exists()
+    print("Test 22 passed: Export writes partitioned Parquet and rewrites only changed partitions")
+
+def test_incremental_deleted_links(test_engine, tmp_path):
+    from sqlalchemy import delete
+    from src.bench.generate import generate
+    from src.models.sakila import FilmActor
+    from src.models.analytics import BridgeFilmActor
+    from src.sync import full_load, incremental
+    source = generate(f"sqlite:///{tmp_path / 'sakila.db'}", scale=0.1)
+    with patch.object(full_load, "get_mysql_engine", lambda: source), \
+            patch.object(full_load, "get_sqlite_engine", lambda: test_engine):
+        full_load.run_full_load()
+    with source.begin() as conn:
+        film_id, actor_id = conn.execute(select(FilmActor.film_id, FilmActor.actor_id).limit(1)).one()
+        conn.execute(delete(FilmActor).where(FilmActor.film_id == film_id, FilmActor.actor_id == actor_id))
+        links = conn.execute(select(func.count()).select_from(FilmActor).where(FilmActor.film_id == film_id)).scalar()
+    with patch.object(incremental, "get_mysql_engine", lambda: source), \
+            patch.object(incremental, "get_sqlite_engine", lambda: test_engine):
+        report = incremental.run_incremental()
+        assert report['status'] == 'ok'
+        stages = {stage['name']: stage for stage in report['stages']}
+        assert stages['bridge_film_actor']['rows']['extracted'] == 0
+        assert stages['deletes']['rows']['deleted'] == 1
+        again = {stage['name']: stage for stage in incremental.run_incremental()['stages']}
+    assert again['deletes']['rows']['deleted'] == 0
+    assert again['bridge_film_actor']['rows']['extracted'] == 0
+    session = sessionmaker(bind=test_engine)()
+    film_key = session.query(DimFilm).filter_by(film_id=film_id).one().film_key
+    actor_key = session.query(DimActor).filter_by(actor_id=actor_id).one().actor_key
+    assert session.query(BridgeFilmActor).filter_by(film_key=film_key).count() == links
+    assert session.query(BridgeFilmActor).filter_by(film_key=film_key, actor_key=actor_key).count() == 0
+    session.close()
+    print("Test 23 passed: Incremental mirrors links deleted from the source")
+
+def test_binlog_events():
+    import sys
+    import types
+    from src.sync import stream
+
+    class Heartbeat:
+        pass
+
+    class RowsEvent:
+        def __init__(self, table, rows):
+            self.table, self.rows = table, rows
+
+    class Write(RowsEvent):
+        pass
+
+    class Update(RowsEvent):
+        pass
+
+    class Delete(RowsEvent):
+        pass
+
+    readers = []
+
+    class Reader:
+        def __init__(self, **kwargs):
+            self.kwargs = kwargs
+            self.closed = False
+            self.log_file = kwargs['log_file']
+            readers.append(self)
+
+        def __iter__(self):
+            events = [Write('rental', [{'values': {'rental_id': 1}}]), Heartbeat(),
+                      Update('film', [{'before_values': {'film_id': 2}, 'after_values': {'film_id': 2}}]),
+                      Delete('payment', [{'values': {'payment_id': 3}}, {'values': {'payment_id': 4}}])]
+            for offset, event in enumerate(events):
+                self.log_pos = 200 + offset
+                yield event
+
+        def close(self):
+            self.closed = True
+
+    modules = {'pymysqlreplication': types.ModuleType('pymysqlreplication'),
+               'pymysqlreplication.event': types.ModuleType('pymysqlreplication.event'),
+               'pymysqlreplication.row_event': types.ModuleType('pymysqlreplication.row_event')}
+    modules['pymysqlreplication'].BinLogStreamReader = Reader
+    modules['pymysqlreplication.event'].HeartbeatLogEvent = Heartbeat
+    row_event = modules['pymysqlreplication.row_event']
+    row_event.WriteRowsEvent, row_event.UpdateRowsEvent, row_event.DeleteRowsEvent = Write, Update, Delete
+    url = "mysql+pymysql://sync:secret@db:3307/sakila"
+    with patch.dict(sys.modules, modules):
+        items = list(stream.binlog_events(url, "binlog.000002:157", follow=True, poll=5.0))
+        list(stream.binlog_events(url, "binlog.000002:157"))
+    assert items == [
+        ("binlog.000002:200", [{'table': 'rental', 'type': 'insert', 'row': {'rental_id': 1}}]),
+        None,
+        ("binlog.000002:202", [{'table': 'film', 'type': 'update', 'row': {'film_id': 2}}]),
+        ("binlog.000002:203", [{'table': 'payment', 'type': 'delete', 'row': {'payment_id': 3}},
+                               {'table': 'payment', 'type': 'delete', 'row': {'payment_id': 4}}]),
+    ]
+    follow, once = readers
+    assert follow.kwargs['connection_settings'] == {'host': 'db', 'port': 3307, 'user': 'sync', 'passwd': 'secret'}
+    assert follow.kwargs['only_schemas'] == ['sakila']
+    assert (follow.kwargs['resume_stream'], follow.kwargs['log_file'], follow.kwargs['log_pos']) == (True, 'binlog.000002', 157)
+    assert (follow.kwargs['blocking'], follow.kwargs['slave_heartbeat']) == (True, 5.0)
+    assert (once.kwargs['blocking'], once.kwargs['slave_heartbeat']) == (False, None)
+    assert follow.closed and once.closed
+
+    class Status:
+        def __init__(self, rows):
+            self.rows = rows
+
+        def exec_driver_sql(self, statement):
+            if statement not in self.rows:
+                raise stream.DBAPIError(statement, None, Exception("syntax"))
+            return types.SimpleNamespace(first=lambda: self.rows[statement])
+
+        def rollback(self):
+            pass
+
+    assert stream.master_position(Status({"SHOW MASTER STATUS": ('binlog.000007', 4242)})) == "binlog.000007:4242"
+    assert stream.master_position(Status({"SHOW BINARY LOG STATUS": ('binlog.000008', 1)})) == "binlog.000008:1"
+    with pytest.raises(RuntimeError):
+        stream.master_position(Status({"SHOW MASTER STATUS": None}))
+    print("Test 24 passed: Binlog events resume from a saved position and follow with a heartbeat")
+
+def test_key_map_bounds(test_engine, tmp_path):
+    import pickle
+    from src.sync import bulk, keycache
+    from src.sync.columnar import lookup
+    from src.sync.keycache import KeyMap, KeyCache
+    keys = KeyMap(DimActor.actor_id, DimActor.actor_key)
+    keys.update([(1, 10), (2, 20), (-1, 30), (2 ** 31, 40), (10 ** 7, 50)])
+    assert [keys.get(i) for i in (1, 2, -1, 2 ** 31, 10 ** 7, 3, -2, None)] == [10, 20, 30, 40, 50, None, None, None]
+    assert len(keys) == 5 and len(keys.keys) < keycache.DENSE_IDS
+    assert lookup(keys, [1, -1, 10 ** 7, 3, None]) == [10, 30, 50, None, None]
+    keys.update([(-1, 0), (2, 0)])
+    assert keys.get(-1) is None and keys.get(2) is None and len(keys) == 3
+    shipped = pickle.loads(pickle.dumps(KeyMap(None, None, keys.keys, keys.sparse)))
+    assert shipped.get(2 ** 31) == 40 and shipped.get(1) == 10
+
+    # Without RETURNING the written keys are read back, and a sparse map is
+    # rebuilt from the table rather than cached.
+    rows = [{'actor_id': actor_id, 'first_name': 'A', 'last_name': 'B', 'last_update': datetime(2024, 1, 1)}
+            for actor_id in (1, 5, 2 ** 40)]
+    cache = KeyCache(test_engine)
+    with patch.object(bulk, "RETURNING", False), test_engine.begin() as conn:
+        keys = cache.load(conn, 'dim_actor')
+        assert bulk.upsert(conn, DimActor, [rows], keys) == 3
+        stored = dict(conn.execute(select(DimActor.actor_id, DimActor.actor_key)).all())
+        stamp = cache.stamp(conn, 'dim_actor')
+    assert {actor_id: keys.get(actor_id) for actor_id in stored} == stored
+    cache.save('dim_actor', keys, stamp)
+    with test_engine.connect() as conn:
+        assert cache.load(conn, 'dim_actor').get(2 ** 40) == stored[2 ** 40]
+    print("Test 25 passed: Key maps keep negative, huge and sparse ids out of the array")
+
+def test_incremental_resume(test_engine, tmp_path):
+    from datetime import timedelta
+    from sqlalchemy import update
+    from src.bench.generate import generate
+    from src.models.sakila import Rental
+    from src.sync import full_load, incremental
+    from src.sync.state import get_watermark
+    source = generate(f"sqlite:///{tmp_path / 'sakila.db'}", scale=0.1)
+    with patch.object(full_load, "get_mysql_engine", lambda: source), \
+            patch.object(full_load, "get_sqlite_engine", lambda: test_engine):
+        full_load.run_full_load()
+    now = datetime.now().replace(microsecond=0)
+    with source.begin() as conn:
+        for rental_id in range(1, 31):
+            conn.execute(update(Rental).where(Rental.rental_id == rental_id)
+                         .values(staff_id=3 - Rental.staff_id, last_update=now + timedelta(seconds=rental_id)))
+
+    def rentals(engine):
+        with engine.connect() as conn:
+            return sorted(map(tuple, conn.execute(select(FactRental.__table__.c[1:]))))
+
+    pages = []
+    rental_columns = incremental.rental_columns
+
+    def failing(rows, **maps):
+        pages.append(len(rows))
+        if len(pages) == 2:
+            raise RuntimeError("transform failed")
+        return rental_columns(rows, **maps)
+
+    with patch.object(incremental, "get_mysql_engine", lambda: source), \
+            patch.object(incremental, "get_sqlite_engine", lambda: test_engine):
+        with patch.object(incremental, "rental_columns", failing):
+            assert incremental.run_incremental(batch_size=10)['status'] == 'error'
+        with test_engine.connect() as conn:
+            assert get_watermark(conn, 'rental') == (now + timedelta(seconds=10), 10)
+        report = incremental.run_incremental(batch_size=10)
+    assert report['status'] == 'ok'
+    stages = {stage['name']: stage for stage in report['stages']}
+    assert stages['fact_rental']['rows']['extracted'] == 20
+
+    fresh = create_engine(f"sqlite:///{tmp_path / 'fresh.db'}")
+    AnalyticsBase.metadata.create_all(fresh)
+    with patch.object(full_load, "get_mysql_engine", lambda: source), \
+            patch.object(full_load, "get_sqlite_engine", lambda: fresh):
+        full_load.run_full_load()
+    resumed = rentals(test_engine)
+    assert len({row[0] for row in resumed}) == len(resumed)
+    assert resumed == rentals(fresh)
+    fresh.dispose()
+    print("Test 26 passed: An interrupted incremental run resumes after its last committed page")
+
+def test_full_load_indexes(test_engine, tmp_path):
+    from src.bench.generate import generate
+    from src.sync import full_load
+    from src.sync.bulk import secondary_indexes
+    source = generate(f"sqlite:///{tmp_path / 'sakila.db'}", scale=0.1)
+    expected = {index.name for index in secondary_indexes()}
+    assert expected
+
+    def indexes():
+        with test_engine.connect() as conn:
+            return set(conn.exec_driver_sql("SELECT name FROM sqlite_master WHERE type = 'index'").scalars())
+
+    during = []
+
+    def failing(rows, **maps):
+        during.append(indexes())
+        raise RuntimeError("transform failed")
+
+    with patch.object(full_load, "get_mysql_engine", lambda: source), \
+            patch.object(full_load, "get_sqlite_engine", lambda: test_engine):
+        with patch.object(full_load, "rental_columns", failing):
+            assert full_load.run_full_load()['status'] == 'error'
+        assert during and not expected & during[0]
+        assert expected <= indexes()
+        assert full_load.run_full_load()['status'] == 'ok'
+    assert expected <= indexes()
+    print("Test 27 passed: Full load drops secondary indexes and rebuilds them, also when it fails")
+
+def test_fact_columns_missing_keys():
+    from collections import namedtuple
+    from decimal import Decimal
+    from src.sync.keycache import KeyMap
+    from src.sync.transform import rental_columns, payment_columns
+    film_map, store_map, customer_map = KeyMap(None, None), KeyMap(None, None), KeyMap(None, None)
+    film_map.update([(1, 11), (3, 13)])
+    store_map.update([(1, 21)])
+    customer_map.update([(2, 32), (2 ** 40, 33)])
+    Rental = namedtuple('Rental', ['rental_id', 'rental_date', 'return_date', 'film_id', 'store_id', 'customer_id', 'staff_id'])
+    Payment = namedtuple('Payment', ['payment_id', 'payment_date', 'customer_id', 'store_id', 'staff_id', 'amount'])
+    rentals = [Rental(1, datetime(2005, 5, 24, 22, 53), datetime(2005, 5, 26, 22, 4), 1, 1, 2, 1),
+               Rental(2, datetime(2005, 12, 31, 23, 59), None, 2, 2, 1, 2),
+               Rental(3, datetime(2006, 2, 14, 15, 16), datetime(2006, 2, 14, 15, 17), None, None, None, 1),
+               Rental(4, datetime(2005, 6, 1), datetime(2005, 6, 9), -1, 9, 2 ** 40, 2)]
+    payments = [Payment(1, datetime(2005, 5, 25, 11, 30), 2, 1, 1, Decimal('2.99')),
+                Payment(2, datetime(2005, 6, 15), 5, 3, 2, Decimal('0.00')),
+                Payment(3, datetime(2005, 7, 8), None, None, 1, Decimal('10.99')),
+                Payment(4, datetime(2005, 8, 1), 2 ** 40, -3, 2, Decimal('4.99'))]
+
+    # The row-wise transforms the column passes replaced, as the reference.
+    def date_key(dt):
+        return None if dt is None else int(dt.strftime('%Y%m%d'))
+
+    def rental_row(rental):
+        duration = (rental.return_date - rental.rental_date).days if rental.return_date and rental.rental_date else None
+        return {'rental_id': rental.rental_id, 'date_key_rented': date_key(rental.rental_date),
+                'date_key_returned': date_key(rental.return_date), 'film_key': film_map.get(rental.film_id),
+                'store_key': store_map.get(rental.store_id), 'customer_key': customer_map.get(rental.customer_id),
+                'staff_id': rental.staff_id, 'rental_duration_days': duration}
+
+    def payment_row(payment):
+        return {'payment_id': payment.payment_id, 'date_key_paid': date_key(payment.payment_date),
+                'customer_key': customer_map.get(payment.customer_id), 'store_key': store_map.get(payment.store_id),
+                'staff_id': payment.staff_id, 'amount': float(payment.amount)}
+
+    assert list(rental_columns(rentals, film_map, store_map, customer_map)) == list(map(rental_row, rentals))
+    assert list(payment_columns(payments, store_map, customer_map)) == list(map(payment_row, payments))
+    print("Test 28 passed: Column transforms match the row-wise ones when dimension keys are missing")
+
+def test_full_load_pragmas(test_engine, tmp_path):
+    from src.bench.generate import generate
+    from src.config import SQLITE_PRAGMAS, SQLITE_LOAD_PRAGMAS
+    from src.sync import full_load
+    source = generate(f"sqlite:///{tmp_path / 'sakila.db'}", scale=0.1)
+
+    def pragmas():
+        with test_engine.connect() as conn:
+            return tuple(conn.exec_driver_sql(f"PRAGMA {name}").scalar() for name in ('synchronous', 'cache_size'))
+
+    loading = (0, SQLITE_LOAD_PRAGMAS['cache_size'])
+    normal = (1, SQLITE_PRAGMAS['cache_size'])
+    during = []
+
+    def failing(rows, **maps):
+        during.append(pragmas())
+        raise RuntimeError("transform failed")
+
+    with patch.object(full_load, "get_mysql_engine", lambda: source), \
+            patch.object(full_load, "get_sqlite_engine", lambda: test_engine):
+        with patch.object(full_load, "rental_columns", failing):
+            assert full_load.run_full_load()['status'] == 'error'
+        assert during and during[0] == loading
+        assert pragmas() == normal
+        assert full_load.run_full_load()['status'] == 'ok'
+    assert pragmas() == normal
+    print("Test 29 passed: Full load reverts its load pragmas when it returns, also after a failure")
+
+def test_run_stages():
+    from threading import Barrier
+    from src.sync.scheduler import Stage, run_stages
+    # b and c only pass the barrier if they run at the same time.
+    barrier = Barrier(2, timeout=10)
+    ran = []
+
+    def step(name, value):
+        def run(results):
+            if name in ('b', 'c'):
+                barrier.wait()
+            ran.append(name)
+            return value(results)
+        return run
+
+    stages = [Stage('d', step('d', lambda r: r['b'] + r['c']), ['b', 'c']),
+              Stage('b', step('b', lambda r: r['a'] + 1), ['a']),
+              Stage('c', step('c', lambda r: r['a'] * 10), ['a']),
+              Stage('a', step('a', lambda r: 1))]
+    assert run_stages(stages, workers=2) == {'a': 1, 'b': 2, 'c': 10, 'd': 12}
+    assert ran[0] == 'a' and ran[-1] == 'd'
+
+    ran.clear()
+
+    def failing(results):
+        raise RuntimeError("stage failed")
+    with pytest.raises(RuntimeError, match="stage failed"):
+        run_stages([Stage('x', failing), Stage('y', step('y', lambda r: 0), ['x']),
+                    Stage('z', step('z', lambda r: 0))], workers=2)
+    assert ran == ['z']
+    with pytest.raises(ValueError, match="unknown"):
+        run_stages([Stage('x', failing, ['missing'])])
+    with pytest.raises(ValueError, match="cycle"):
+        run_stages([Stage('x', failing, ['y']), Stage('y', failing, ['x'])])
+    print("Test 30 passed: Stages run once their dependencies finish, side by side, and failures propagate")
+
+def test_upsert_batches(test_engine):
+    from src.sync.bulk import upsert, batched
+    from src.sync.keycache import KeyMap
+    stamp = datetime(2024, 1, 1)
+    rows = [{'actor_id': i, 'first_name': f"A{i}", 'last_name': 'B', 'last_update': stamp} for i in range(1, 6)]
+    with test_engine.begin() as conn:
+        assert upsert(conn, DimActor, batched(rows, 2)) == 5
+        before = dict(conn.execute(select(DimActor.actor_id, DimActor.actor_key)).all())
+    changed = [dict(row, last_name='C') for row in rows[3:]] + \
+              [{'actor_id': 6, 'first_name': 'A6', 'last_name': 'C', 'last_update': stamp}]
+    keys = KeyMap(DimActor.actor_id, DimActor.actor_key)
+    with test_engine.begin() as conn:
+        assert upsert(conn, DimActor, batched(changed, 2), keys) == 3
+        after = conn.execute(select(DimActor.actor_id, DimActor.actor_key, DimActor.last_name)
+                             .order_by(DimActor.actor_id)).all()
+    # Conflicting rows are updated in place, keeping their surrogate keys.
+    assert [(actor_id, last_name) for actor_id, _, last_name in after] == \
+           [(1, 'B'), (2, 'B'), (3, 'B'), (4, 'C'), (5, 'C'), (6, 'C')]
+    assert all(before[actor_id] == key for actor_id, key, _ in after if actor_id in before)
+    assert [keys.get(actor_id) for actor_id in (4, 5, 6)] == [key for _, key, _ in after[3:]]
+    print("Test 31 passed: Batched upserts update rows in place and insert new ones")
+
+def test_stream_batches(tmp_path):
+    from src.bench.generate import generate
+    from src.models.sakila import Rental
+    from src.sync.extract import stream, rental_query
+    source = generate(f"sqlite:///{tmp_path / 'sakila.db'}", scale=0.1)
+    with source.connect() as conn:
+        total = conn.execute(select(func.count()).select_from(Rental)).scalar()
+        sizes = [len(batch) for batch in stream(conn, rental_query(), 100)]
+        assert sum(sizes) == total and len(sizes) == -(-total // 100)
+        assert all(size == 100 for size in sizes[:-1])
+        # Closing the stream early closes its cursor, leaving the connection usable.
+        batches = stream(conn, rental_query(), 100)
+        assert len(next(batches)) == 100
+        batches.close()
+        assert conn.execute(select(func.count()).select_from(Rental)).scalar() == total
+    print("Test 32 passed: Source extraction streams fixed-size batches")
+
+def test_partitioned_ranges(tmp_path):
+    from src.bench.generate import generate
+    from src.models.sakila import Rental
+    from src.sync.extract import rental_query
+    from src.sync.parallel import partitioned, key_ranges, split_range
+    source = generate(f"sqlite:///{tmp_path / 'sakila.db'}", scale=0.1)
+    assert split_range(1, 10, 3) == [(1, 5), (5, 9), (9, 11)]
+    with source.connect() as conn:
+        ids = sorted(conn.execute(select(Rental.rental_id)).scalars())
+        ranges = key_ranges(conn, rental_query(), Rental.rental_id, 3, max_span=200)
+    assert ranges[0][0] == ids[0] and ranges[-1][1] == ids[-1] + 1 and len(ranges) >= len(ids) // 200
+    assert all(end == start for (_, end), (start, _) in zip(ranges, ranges[1:]))
+
+    seen = []
+    finished = []
+    for key_range, batch in partitioned(source, rental_query(), Rental.rental_id, lambda rows: rows, 3, 50, ranges):
+        if batch is None:
+            finished.append(key_range)
+            continue
+        assert key_range not in finished and len(batch) <= 50
+        assert all(key_range[0] <= row.rental_id < key_range[1] for row in batch)
+        seen.extend(row.rental_id for row in batch)
+    # Every key exactly once, and every range reported done.
+    assert sorted(seen) == ids and sorted(finished) == ranges
+
+    def failing(rows):
+        raise RuntimeError("transform failed")
+    with pytest.raises(RuntimeError, match="transform failed"):
+        list(partitioned(source, rental_query(), Rental.rental_id, failing, 3, 50, ranges))
+    print("Test 33 passed: Parallel key ranges extract every row once and surface errors")
+
+def test_source_queries(tmp_path):
+    from sqlalchemy import update
+    from src.bench.generate import generate
+    from src.models.sakila import Film, Language, Inventory, Rental, Payment
+    from src.sync.extract import film_query, rental_query, payment_query
+    source = generate(f"sqlite:///{tmp_path / 'sakila.db'}", scale=0.1)
+    with source.begin() as conn:
+        # Dangling references are kept by the outer joins, with nulls.
+        conn.execute(update(Film).where(Film.film_id == 1).values(language_id=999))
+        conn.execute(update(Rental).where(Rental.rental_id == 1).values(inventory_id=999999))
+        conn.execute(update(Payment).where(Payment.payment_id == 1).values(rental_id=999999))
+    with source.connect() as conn:
+        languages = dict(conn.execute(select(Language.language_id, Language.name)).all())
+        inventory = {row.inventory_id: row for row in conn.execute(select(Inventory))}
+        rentals = dict(conn.execute(select(Rental.rental_id, Rental.inventory_id)).all())
+        films = {row.film_id: row.language for row in conn.execute(film_query())}
+        assert films == {film_id: languages.get(language_id, 'Unknown')
+                         for film_id, language_id in conn.execute(select(Film.film_id, Film.language_id))}
+        joined = {row.rental_id: (row.film_id, row.store_id) for row in conn.execute(rental_query())}
+        assert joined == {rental_id: (inventory[item].film_id, inventory[item].store_id) if item in inventory else (None, None)
+                          for rental_id, item in rentals.items()}
+        assert joined[1] == (None, None)
+        stores = dict(conn.execute(payment_query().with_only_columns(Payment.payment_id, Inventory.store_id)).all())
+        expected = {}
+        for payment_id, rental_id in conn.execute(select(Payment.payment_id, Payment.rental_id)):
+            item = inventory.get(rentals.get(rental_id))
+            expected[payment_id] = item.store_id if item is not None else None
+        assert stores == expected and stores[1] is None
+    print("Test 34 passed: Source queries resolve foreign keys in the join, keeping dangling rows")
+
+def test_full_load_empty_fact(test_engine, tmp_path):
+    from sqlalchemy import delete
+    from src.bench.generate import generate
+    from src.models.sakila import Payment
+    from src.sync import full_load, incremental
+    from src.sync.bulk import upsert, insert_ignore
+    source = generate(f"sqlite:///{tmp_path / 'sakila.db'}", scale=0.1)
+    with source.begin() as conn:
+        conn.execute(delete(Payment))
+    with test_engine.begin() as conn:
+        assert upsert(conn, SyncState, [[]]) == 0 and insert_ignore(conn, SyncState, [[]]) == 0
+    with patch.object(full_load, "get_mysql_engine", lambda: source), \
+            patch.object(full_load, "get_sqlite_engine", lambda: test_engine):
+        assert full_load.run_full_load()['status'] == 'ok'
+        assert full_load.run_full_load(resume=False)['status'] == 'ok'
+    with patch.object(incremental, "get_mysql_engine", lambda: source), \
+            patch.object(incremental, "get_sqlite_engine", lambda: test_engine):
+        assert incremental.run_incremental()['status'] == 'ok'
+    session = sessionmaker(bind=test_engine)()
+    assert session.query(FactPayment).count() == 0
+    assert session.query(FactRental).count() > 0
+    session.close()
+    print("Test 35 passed: Full load handles an empty fact table")
+
+def test_profile_cli(test_engine, tmp_path):
+    import pstats
+    import types
+    from click.testing import CliRunner
+    import cli
+    from src.bench.generate import generate
+    from src.sync import full_load, incremental, validate, profiling
+    from src.sync.overlap import overlapped
+    source = generate(f"sqlite:///{tmp_path / 'sakila.db'}", scale=0.1)
+    engines = [patch.object(module, name, lambda engine=engine: engine)
+               for module in (full_load, incremental, validate)
+               for name, engine in (("get_mysql_engine", source), ("get_sqlite_engine", test_engine))]
+    for engine_patch in engines:
+        engine_patch.start()
+    try:
+        runner = CliRunner()
+        for command, options, done in (('full-load', ['--workers', '2'], "Full load complete!"),
+                                       ('incremental', ['--workers', '2'], "Incremental update complete!"),
+                                       ('validate', [], "")):
+            result = runner.invoke(cli.cli, [command, *options, '--profile', str(tmp_path / 'profile')])
+            assert result.exit_code == 0, result.output
+            assert done in result.output and "failed" not in result.output
+            name = command.replace('-', '_')
+            assert (tmp_path / 'profile' / f"{name}.prof").exists()
+    finally:
+        for engine_patch in engines:
+            engine_patch.stop()
+    # Work done on the stage and pipeline threads is in the profile.
+    functions = {function for _, _, function in pstats.Stats(str(tmp_path / 'profile' / 'full_load.prof')).stats}
+    assert 'rental_columns' in functions
+
+    # A thread that cannot start its own profiler still runs its work.
+    class Busy:
+        def enable(self):
+            raise ValueError("Another profiling tool is already active")
+    with patch.object(profiling, "_session", profiling.ProfileSession()), \
+            patch.object(profiling, "PER_THREAD", True), \
+            patch.object(profiling, "cProfile", types.SimpleNamespace(Profile=Busy)):
+        assert profiling.thread_profiled(lambda: 42)() == 42
+
+    # A source whose close fails still ends the pipeline, with its error.
+    class Source:
+        def __iter__(self):
+            return iter(range(3))
+
+        def close(self):
+            raise RuntimeError("close failed")
+    with pytest.raises(RuntimeError, match="close failed"):
+        list(overlapped(Source(), lambda n: n))
+    print("Test 36 passed: --profile runs full-load, incremental and validate on this interpreter")
+
+def test_incremental_processes(test_engine, tmp_path):
+    from datetime import timedelta
+    from sqlalchemy import update
+    from src.bench.generate import generate
+    from src.models.sakila import Rental, Payment
+    from src.sync import full_load, incremental
+    source = generate(f"sqlite:///{tmp_path / 'sakila.db'}", scale=0.1)
+    with patch.object(full_load, "get_mysql_engine", lambda: source), \
+            patch.object(full_load, "get_sqlite_engine", lambda: test_engine):
+        full_load.run_full_load()
+    later = datetime.now() + timedelta(seconds=1)
+    with source.begin() as conn:
+        conn.execute(update(Rental).where(Rental.rental_id <= 25).values(staff_id=3 - Rental.staff_id, last_update=later))
+        conn.execute(update(Payment).where(Payment.payment_id <= 25).values(amount=Payment.amount + 1, last_update=later))
+    with patch.object(incremental, "get_mysql_engine", lambda: source), \
+            patch.object(incremental, "get_sqlite_engine", lambda: test_engine):
+        report = incremental.run_incremental(batch_size=10, workers=2, processes=2)
+    assert report['status'] == 'ok'
+    stages = {stage['name']: stage for stage in report['stages']}
+    assert stages['fact_rental']['rows']['upserted'] == 25 and stages['fact_payment']['rows']['upserted'] == 25
+
+    def facts(engine):
+        with engine.connect() as conn:
+            return [sorted(map(tuple, conn.execute(select(fact.__table__.c[1:])))) for fact in (FactRental, FactPayment)]
+
+    fresh = create_engine(f"sqlite:///{tmp_path / 'fresh.db'}")
+    AnalyticsBase.metadata.create_all(fresh)
+    with patch.object(full_load, "get_mysql_engine", lambda: source), \
+            patch.object(full_load, "get_sqlite_engine", lambda: fresh):
+        full_load.run_full_load()
+    assert facts(test_engine) == facts(fresh)
+    fresh.dispose()
+    print("Test 37 passed: Incremental transforms fact pages on a process pool")